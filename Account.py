@@ -1,5 +1,4 @@
 import secrets
-import requests
 import hashlib
 import base64
 import json
@@ -7,8 +6,17 @@ from enum import Enum
 from edft_secrets import CLIENT_ID, FERNET_KEY
 from cryptography.fernet import Fernet
 import logging
+import threading
 import time
+from collections import deque
+from typing import NamedTuple
 from edft_shared_constants import API_QUERY_INTERVAL
+from edft_metrics import REGISTRY, SIZE_BUCKETS
+from edft_budget import BUDGET
+from edft_logging import PayloadSnippet
+from edft_archive import compress_payload, payload_digest
+from edft_diff import ChangeType, change_event, diff_payload
+import edft_transport
 
 REDIRECT_URI = "edft://redirect"
 API_AUTH_HOST = "https://auth.frontierstore.net"
@@ -19,6 +27,13 @@ API_CMDR_ENDPOINT = "/profile"
 API_FC_ENDPOINT = "/fleetcarrier"
 
 
+def request_host(endpoint) -> str:
+    """
+    :return: the host requests to an endpoint go to
+    """
+    return API_AUTH_HOST if endpoint == API_TOKEN_ENDPOINT else API_DATA_HOST
+
+
 def get_pcke_pair(length: int = 32) -> [str, str]:
     """
     Generates the code verifier and code challenge for the PCKE authentication scheme
@@ -42,33 +57,77 @@ class ApiRequestType(Enum):
     FC = 1
 
 
+class OnboardingState(Enum):
+    QUEUED = 0
+    EXCHANGING_TOKENS = 1
+    FETCHING = 2
+
+
+class AccountSnapshot(NamedTuple):
+    """
+    An immutable, versioned view of an account's cAPI state. An Account never modifies its current snapshot; it builds a
+    new one with the changes and swaps it in with a single assignment, bumping the version. A thread that reads
+    `account.snapshot` once therefore has a consistent view of everything in it, without taking any locks, for as long
+    as it holds on to it. The documents are shared between successive snapshots and must be treated as read-only too.
+    """
+
+    name: str
+    version: int = 0
+    reauth_required: bool = True
+    last_fetched: float = 0.0
+    cmdr_data: dict = None
+    fc_data: dict = None
+    access_token: str = None
+    refresh_token: str = None
+    token_ciphertext: tuple = None
+    onboarding: OnboardingState = None
+
+    def get(self, field) -> object:
+        """
+        Same as Account.get(), so a snapshot can stand in for the account when generating label text.
+        :param field: The field to be returned
+        :return: The value of the field.
+        """
+        return getattr(self, field)
+
+
 class Account:
+    """
+    One commander account and its fleet carrier. The cAPI state lives in `snapshot` (see AccountSnapshot); the
+    attributes of the same name are read-only shortcuts to the current snapshot. Only the thread updating the account
+    from cAPI normally publishes new snapshots, but publishing is serialized by a lock anyway, as reauthorization also
+    happens from the GUI. Readers never need the lock.
+    """
+
     name = None
     log_handler = None
     code_verifier = None
     code_challenge = None
     code = None
     statestring = None
-    access_token = None
-    refresh_token = None
-    cmdr_data = None
-    fc_data = None
     conn = None
     retries = 0
-    reauth_required = False
     reauth_prompted = False
-    needs_sync = False
+    synced_version = 0
     auth_uri = ""
     cipher = None
+    archive = None
+    change_feed = None
+    snapshot = None
 
-    def __init__(self, conn, log_handler, friendly_name):
+    def __init__(self, conn, log_handler, friendly_name, archive, change_feed):
         self.name = friendly_name
         self.conn = conn
+        self.archive = archive
+        self.change_feed = change_feed
+        self.payload_digests = {}
+        self.pending_payloads = deque()
+        self.write_lock = threading.Lock()
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
         self.log_handler = log_handler
         self.logger.addHandler(log_handler)
-        self.logger.debug("Initializing Account: " + self.name)
+        self.logger.debug("Initializing Account: %s", self.name)
         self.cipher = Fernet(FERNET_KEY)
         cur = self.conn.cursor()
         res = cur.execute("select * from accounts where name=?", (self.name,))
@@ -78,15 +137,102 @@ class Account:
             self.code = data[2]
             self.code_challenge = data[3]
             self.code_verifier = data[4]
-            self.access_token = self.cipher.decrypt(data[5]).decode("utf8")
-            self.refresh_token = self.cipher.decrypt(data[6]).decode("utf8")
-            self.reauth_required = data[7] == 1
             self.reauth_prompted = 0  # Regardless of previous state, if we shut down before processing just regenerate.
-            self.cmdr_data = json.loads(data[9] if data[9] is not None else "{}")
-            self.fc_data = json.loads(data[10] if data[10] is not None else "{}")
+            cmdr_fetched_at, cmdr_data = self._load_payload(API_CMDR_ENDPOINT, data[9])
+            fc_fetched_at, fc_data = self._load_payload(API_FC_ENDPOINT, data[10])
+            if data[11] is not None:
+                last_fetched = data[11]
+            elif cmdr_fetched_at is not None and fc_fetched_at is not None:
+                # Not recorded yet; the archive knows when the data last changed, which is at least as old
+                last_fetched = min(cmdr_fetched_at, fc_fetched_at)
+            else:
+                last_fetched = 0.0
+            has_tokens = data[5] is not None and data[6] is not None
+            self.snapshot = AccountSnapshot(
+                name=self.name,
+                reauth_required=data[7] == 1 or not has_tokens,
+                last_fetched=last_fetched,
+                cmdr_data=cmdr_data,
+                fc_data=fc_data,
+                access_token=(
+                    self.cipher.decrypt(data[5]).decode("utf8") if has_tokens else None
+                ),
+                refresh_token=(
+                    self.cipher.decrypt(data[6]).decode("utf8") if has_tokens else None
+                ),
+                token_ciphertext=(data[5], data[6]) if has_tokens else None,
+            )
         else:
-            self.logger.info("Account" + self.name + " not found, setting up new")
-            self.reauth_required = True
+            self.logger.info("Account %s not found, setting up new", self.name)
+            self.snapshot = AccountSnapshot(name=self.name)
+        self.synced_version = self.snapshot.version
+
+    @property
+    def cmdr_data(self) -> dict:
+        return self.snapshot.cmdr_data
+
+    @property
+    def fc_data(self) -> dict:
+        return self.snapshot.fc_data
+
+    @property
+    def reauth_required(self) -> bool:
+        return self.snapshot.reauth_required
+
+    @property
+    def last_fetched(self) -> float:
+        return self.snapshot.last_fetched
+
+    @property
+    def access_token(self) -> str:
+        return self.snapshot.access_token
+
+    @property
+    def refresh_token(self) -> str:
+        return self.snapshot.refresh_token
+
+    @property
+    def data_version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def needs_sync(self) -> bool:
+        """
+        Whether anything has changed since the account was last written to the database.
+        """
+        return self.snapshot.version != self.synced_version or bool(
+            self.pending_payloads
+        )
+
+    @property
+    def onboarding(self) -> OnboardingState:
+        return self.snapshot.onboarding
+
+    def _publish(self, **changes) -> [AccountSnapshot, AccountSnapshot]:
+        """
+        Publishes a new snapshot with the given fields changed and the version bumped.
+        :param changes: AccountSnapshot fields and their new values
+        :return: the snapshot that was replaced, and the one that replaced it
+        """
+        with self.write_lock:
+            previous = self.snapshot
+            self.snapshot = previous._replace(version=previous.version + 1, **changes)
+        return previous, self.snapshot
+
+    def _load_payload(self, endpoint, legacy_data) -> [float, dict]:
+        """
+        Loads the most recent payload for an endpoint from the archive. Databases written before the archive existed
+        only have the copy stored in the accounts table, so fall back to that.
+        :param endpoint: The cAPI endpoint whose data to load
+        :param legacy_data: The JSON string from the accounts table, or None
+        :return: When the payload was archived (None if it wasn't), and the parsed payload, or an empty dict if there
+        is none
+        """
+        fetched_at, content = self.archive.get(self.name, endpoint)
+        if content is not None:
+            self.payload_digests[endpoint] = payload_digest(content)
+            return fetched_at, json.loads(content)
+        return None, json.loads(legacy_data if legacy_data is not None else "{}")
 
     def setup_uri(self, request_type) -> str:
         """
@@ -95,7 +241,7 @@ class Account:
         :param request_type: Can only be TokenRequestType.INITIAL. Tech debt.
         :return: the setup URI to (re)authorize this account.
         """
-        self.logger.debug("creating setup URI for account " + self.name)
+        self.logger.debug("creating setup URI for account %s", self.name)
         cur = self.conn.cursor()
         self.statestring, nothing = get_pcke_pair(32)
 
@@ -119,7 +265,7 @@ class Account:
                 else:  # account doesn't exist, so generate everything
                     self.code_verifier, self.code_challenge = get_pcke_pair(32)
                     cur.execute(
-                        "insert into accounts values (?,?,?,?,?,?,?,?,?,?,?)",
+                        "insert into accounts values (?,?,?,?,?,?,?,?,?,?,?,?)",
                         (
                             self.name,
                             self.statestring,
@@ -132,10 +278,11 @@ class Account:
                             True,
                             None,
                             None,
+                            None,
                         ),
                     )
             case _:
-                self.logger.error("invalid TokenRequestType passed: " + request_type)
+                self.logger.error("invalid TokenRequestType passed: %s", request_type)
                 return "error://invalid"
         self.reauth_prompted = True
         self.conn.commit()
@@ -181,26 +328,102 @@ class Account:
                     "&refresh_token={1}".format(CLIENT_ID, self.refresh_token)
                 )
             case _:
-                self.logger.error("invalid TokenRequestType passed: " + request_type)
+                self.logger.error("invalid TokenRequestType passed: %s", request_type)
                 return
 
-        req = requests.post(
-            url=API_AUTH_HOST + API_TOKEN_ENDPOINT,
+        start = time.perf_counter()
+        req = edft_transport.TRANSPORT.request(
+            self.name,
+            "POST",
+            API_AUTH_HOST,
+            API_TOKEN_ENDPOINT,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
             data=body,
         )
+        self._record_request(API_TOKEN_ENDPOINT, req, time.perf_counter() - start)
         json_data = json.loads(req.content)
 
         if req.status_code == 200:
-            # Update in memory
-            self.access_token = json_data["access_token"]
-            self.refresh_token = json_data["refresh_token"]
-            self.reauth_required = False
+            # Update in memory. Tokens only change here, so this is the only place they need encrypting for storage.
+            self._publish(
+                access_token=json_data["access_token"],
+                refresh_token=json_data["refresh_token"],
+                token_ciphertext=(
+                    self.cipher.encrypt(json_data["access_token"].encode("utf8")),
+                    self.cipher.encrypt(json_data["refresh_token"].encode("utf8")),
+                ),
+            )
+            self._set_reauth_required(False)
             self.reauth_prompted = False
-            self.needs_sync = True
         else:
-            self.logger.warning("Expired Refresh Token on account " + self.name)
-            self.reauth_required = True
+            self.logger.warning(
+                "Expired Refresh Token on account %s",
+                self.name,
+                extra={"account": self.name},
+            )
+            self._set_reauth_required(True)
+
+    def _set_reauth_required(self, reauth_required) -> None:
+        """
+        Updates the account's authorization state, publishing an AUTH change event if it actually changed.
+        :param reauth_required: True if the user must (re)authorize this account
+        """
+        with self.write_lock:
+            if reauth_required == self.snapshot.reauth_required:
+                return
+            self.snapshot = self.snapshot._replace(
+                version=self.snapshot.version + 1, reauth_required=reauth_required
+            )
+        self.change_feed.publish(
+            [
+                change_event(
+                    ChangeType.AUTH,
+                    self.name,
+                    None,
+                    ("reauth_required",),
+                    not reauth_required,
+                    reauth_required,
+                )
+            ]
+        )
+
+    def set_onboarding(self, state) -> None:
+        """
+        Publishes the progress of a (re)authorization.
+        :param state: an OnboardingState, or None once it has finished
+        """
+        self._publish(onboarding=state)
+
+    def onboard(self, code) -> bool:
+        """
+        Completes a (re)authorization once the helper has delivered the code: exchanges it for tokens and fetches the
+        account's data for the first time. Blocks for several seconds, so it is run as a background job (see
+        EliteDangerousFleetTracker.start_onboarding); progress is published in the snapshot's `onboarding` field. On
+        failure, reauth_prompted is cleared so a fresh authorization link is generated.
+        :param code: the code the helper stored for this account
+        :return: True if the account is now authorized
+        """
+        self.set_code(code)
+        try:
+            self.set_onboarding(OnboardingState.EXCHANGING_TOKENS)
+            self.logger.debug("obtaining tokens", extra={"account": self.name})
+            self.obtain_tokens(TokenRequestType.INITIAL)
+            if self.reauth_required:
+                self.reauth_prompted = False
+                return False
+            self.set_onboarding(OnboardingState.FETCHING)
+            self.update_from_capi()
+            return True
+        except Exception:
+            self.logger.exception(
+                "authorization failed for account %s",
+                self.name,
+                extra={"account": self.name},
+            )
+            self.reauth_prompted = False
+            return False
+        finally:
+            self.set_onboarding(None)
 
     def set_code(self, new_code) -> None:
         """
@@ -219,73 +442,179 @@ class Account:
         req = function()
         if req.status_code != 200 and self.retries <= 1:
             try:
-                self.logger.debug(req.content)
+                self.logger.debug(
+                    "cAPI query failed, refreshing token: %s",
+                    PayloadSnippet(req.content),
+                    extra={"account": self.name, "status": req.status_code},
+                )
                 self.obtain_tokens(TokenRequestType.REFRESH)
             except:
                 self.logger.exception("")
         elif self.retries > 1:
-            self.logger.warning("Retry limit reached for account " + self.name)
+            self.logger.warning(
+                "Retry limit reached for account %s",
+                self.name,
+                extra={"account": self.name},
+            )
             self.retries = 0
-            self.reauth_required = True
+            self._set_reauth_required(True)
+
+    def _record_request(self, endpoint, req, elapsed) -> None:
+        """
+        Records latency, outcome and payload size metrics for a completed cAPI request, and counts it against
+        the request budget.
+        :param endpoint: The endpoint that was queried, e.g. API_CMDR_ENDPOINT
+        :param req: The Response object for the completed request
+        :param elapsed: How long the request took, in seconds
+        """
+        BUDGET.record(request_host(endpoint), self.name)
+        REGISTRY.observe(
+            "edft_capi_request_seconds", elapsed, endpoint=endpoint, account=self.name
+        )
+        REGISTRY.inc(
+            "edft_capi_requests_total",
+            endpoint=endpoint,
+            account=self.name,
+            status=str(req.status_code),
+        )
+        REGISTRY.observe(
+            "edft_capi_payload_bytes",
+            len(req.content),
+            buckets=SIZE_BUCKETS,
+            endpoint=endpoint,
+        )
+        self.logger.debug(
+            "cAPI request completed",
+            extra={
+                "account": self.name,
+                "endpoint": endpoint,
+                "status": req.status_code,
+                "latency_ms": round(elapsed * 1000),
+            },
+        )
 
-    def _query_cmdr_data_impl(self) -> requests.Response:
+    def _accept_payload(self, endpoint, content) -> object:
+        """
+        Handles the body of a successful data query. A body identical to the last one seen for this endpoint is skipped
+        entirely--no parsing, no sync, no archive entry. Otherwise it is parsed, and compressed and queued for the
+        archive.
+        :param endpoint: The endpoint that was queried
+        :param content: The raw response body
+        :return: The parsed payload, or None if nothing changed.
+        """
+        digest = payload_digest(content)
+        if digest == self.payload_digests.get(endpoint):
+            return None
+        with REGISTRY.time("edft_stage_seconds", stage="parse", account=self.name):
+            json_data = json.loads(content)
+        self.payload_digests[endpoint] = digest
+        self.pending_payloads.append(
+            (endpoint, time.time(), compress_payload(content), len(content), digest)
+        )
+        return json_data
+
+    def _replace_payload(self, endpoint, json_data) -> None:
+        """
+        Swaps in a new document for an endpoint and publishes what changed relative to the previous one.
+        :param endpoint: API_CMDR_ENDPOINT or API_FC_ENDPOINT
+        :param json_data: the new (possibly projected) document
+        """
+        if endpoint == API_CMDR_ENDPOINT:
+            previous_data = self._publish(cmdr_data=json_data)[0].cmdr_data
+        else:
+            previous_data = self._publish(fc_data=json_data)[0].fc_data
+        self.change_feed.publish(
+            diff_payload(self.name, endpoint, previous_data, json_data)
+        )
+
+    def _mark_fetched(self, fetched_at) -> None:
+        """
+        Records that fresh data was received, whether or not it differed from what we had. Persisted with the account so
+        the poll scheduler knows how stale the cached data is after a restart.
+        :param fetched_at: when the data was received (epoch seconds)
+        """
+        self._publish(last_fetched=fetched_at)
+
+    def _query_cmdr_data_impl(self) -> object:
         """
         Implementation for the CMDR data query
         :return: The Response object for the completed query.
         """
-        req = requests.get(
-            url=API_DATA_HOST + API_CMDR_ENDPOINT,
+        start = time.perf_counter()
+        req = edft_transport.TRANSPORT.request(
+            self.name,
+            "GET",
+            API_DATA_HOST,
+            API_CMDR_ENDPOINT,
             headers={"Authorization": "Bearer " + self.access_token},
         )
+        self._record_request(API_CMDR_ENDPOINT, req, time.perf_counter() - start)
         if req.status_code == 200:
-            json_data = json.loads(req.content)
-            self.cmdr_data = json_data
-            self.needs_sync = True
+            self._mark_fetched(time.time())
+            json_data = self._accept_payload(API_CMDR_ENDPOINT, req.content)
+            if json_data is not None:
+                self._replace_payload(API_CMDR_ENDPOINT, json_data)
         return req
 
-    def _query_fc_data_impl(self) -> requests.Response:
+    def _query_fc_data_impl(self) -> object:
         """
         Implementation for the Fleet Carrier data query
         :return: The Response object for the completed query.
         """
-        req = requests.get(
-            url=API_DATA_HOST + API_FC_ENDPOINT,
+        start = time.perf_counter()
+        req = edft_transport.TRANSPORT.request(
+            self.name,
+            "GET",
+            API_DATA_HOST,
+            API_FC_ENDPOINT,
             headers={"Authorization": "Bearer " + self.access_token},
         )
+        self._record_request(API_FC_ENDPOINT, req, time.perf_counter() - start)
         if req.status_code == 200:
-            json_data = json.loads(req.content)
-            self.fc_data = json_data
-            # self.copy_dict(json_data, self.fc_data)
-            self.needs_sync = True
+            self._mark_fetched(time.time())
+            json_data = self._accept_payload(API_FC_ENDPOINT, req.content)
+            if json_data is not None:
+                self._replace_payload(API_FC_ENDPOINT, json_data)
         return req
 
     def sync_to_database(self) -> None:
         """
-        Writes the data currently in memory for this account to the database on disk and removes the needs_sync flag.
+        Writes the current snapshot of this account to the database on disk, and records its version so needs_sync is
+        cleared unless the account has changed again since.
+        Raw payloads received since the last sync go to the payload archive; the accounts row only holds credentials,
+        auth state and when data was last fetched.
         """
         # cache data for next startup
+        snapshot = self.snapshot
+        with REGISTRY.time("edft_stage_seconds", stage="persist", account=self.name):
+            self._sync_to_database_impl(snapshot)
+        self.synced_version = snapshot.version
+
+    def _sync_to_database_impl(self, snapshot) -> None:
+        """
+        Implementation for sync_to_database, separated so the whole write can be timed.
+        :param snapshot: the AccountSnapshot to write
+        """
+        while self.pending_payloads:
+            self.archive.store(self.name, *self.pending_payloads.popleft())
+        if snapshot.token_ciphertext is None:
+            # No tokens yet; nothing else in the row can have changed either
+            self.conn.commit()
+            return
         cur = self.conn.cursor()
-        cur.execute(
-            "update accounts set cmdr_data=? where name=?",
-            (json.dumps(self.cmdr_data), self.name),
-        )
-        cur.execute(
-            "update accounts set fc_data=? where name=?",
-            (json.dumps(self.fc_data), self.name),
-        )
         cur.execute(
             "update accounts set access_token=?, refresh_token=?, code=null, reauth_required=?, "
-            "reauth_prompted=? where name=?",
+            "reauth_prompted=?, last_fetched=? where name=?",
             (
-                self.cipher.encrypt(self.access_token.encode("utf8")),
-                self.cipher.encrypt(self.refresh_token.encode("utf8")),
-                self.reauth_required,
+                snapshot.token_ciphertext[0],
+                snapshot.token_ciphertext[1],
+                snapshot.reauth_required,
                 self.reauth_prompted,
+                snapshot.last_fetched,
                 self.name,
             ),
         )
         self.conn.commit()
-        self.needs_sync = False
 
     def query_api_data(self, query_type) -> None:
         """
@@ -298,7 +627,7 @@ class Account:
             case ApiRequestType.FC:
                 self.api_query_wrapper(self._query_fc_data_impl)
             case _:
-                self.logger.error("invalid ApiRequestType passed: " + query_type)
+                self.logger.error("invalid ApiRequestType passed: %s", query_type)
 
     def get(self, field) -> object:
         """
@@ -314,18 +643,132 @@ class Account:
         Highest-level wrapper, queries the CMDR and FC endpoints sequentially, enforcing API_QUERY_INTERVAL between
         successive queries.
         """
-        self.logger.debug("cAPI update started for " + self.name)
+        self.logger.debug("cAPI update started for %s", self.name)
         self.query_api_data(ApiRequestType.CMDR)
-        time.sleep(API_QUERY_INTERVAL / 1000)
+        edft_transport.TRANSPORT.pace(API_QUERY_INTERVAL / 1000)
         self.query_api_data(ApiRequestType.FC)
-        time.sleep(API_QUERY_INTERVAL / 1000)
-        self.logger.debug("cAPI update finished for " + self.name)
+        edft_transport.TRANSPORT.pace(API_QUERY_INTERVAL / 1000)
+        self.logger.debug("cAPI update finished for %s", self.name)
+
+    def collection_job(self, projection_paths) -> dict:
+        """
+        Describes this account's next cAPI update for a collector worker process (see edft_workers).
+        :param projection_paths: dict of endpoint -> key tuples the worker should keep from each document
+        :return: a picklable job dict
+        """
+        snapshot = self.snapshot
+        return {
+            "name": self.name,
+            "access_token": snapshot.access_token,
+            "refresh_token": snapshot.refresh_token,
+            "digests": dict(self.payload_digests),
+            "projection_paths": projection_paths,
+        }
+
+    def apply_collected(self, result) -> None:
+        """
+        Applies the outcome of a collector worker's update to this account, equivalent to what update_from_capi() would
+        have done in-process. cmdr_data and fc_data receive the worker's projections rather than full documents; the
+        full documents go to the archive.
+        :param result: the result dict returned by edft_workers.collect_shard()
+        """
+        for endpoint, status, elapsed, size in result["requests"]:
+            BUDGET.record(request_host(endpoint), self.name)
+            REGISTRY.observe(
+                "edft_capi_request_seconds",
+                elapsed,
+                endpoint=endpoint,
+                account=self.name,
+            )
+            REGISTRY.inc(
+                "edft_capi_requests_total",
+                endpoint=endpoint,
+                account=self.name,
+                status=str(status),
+            )
+            REGISTRY.observe(
+                "edft_capi_payload_bytes", size, buckets=SIZE_BUCKETS, endpoint=endpoint
+            )
+        if result["payloads"]:
+            REGISTRY.observe(
+                "edft_stage_seconds",
+                result["parse_seconds"],
+                stage="parse",
+                account=self.name,
+            )
+        if "error" in result:
+            self.logger.error(
+                "collector worker failed: %s",
+                result["error"],
+                extra={"account": self.name},
+            )
+        if result["token_ciphertext"] is not None:
+            self._publish(
+                access_token=result["access_token"],
+                refresh_token=result["refresh_token"],
+                token_ciphertext=result["token_ciphertext"],
+            )
+        if result["fetched_at"] is not None:
+            self._mark_fetched(result["fetched_at"])
+        for endpoint, payload in result["payloads"].items():
+            self.payload_digests[endpoint] = payload["digest"]
+            self.pending_payloads.append(
+                (
+                    endpoint,
+                    payload["fetched_at"],
+                    payload["compressed"],
+                    payload["raw_size"],
+                    payload["digest"],
+                )
+            )
+            self._replace_payload(endpoint, payload["projection"])
+        if result["reauth_required"]:
+            self.logger.warning(
+                "Expired Refresh Token on account %s",
+                self.name,
+                extra={"account": self.name},
+            )
+            self._set_reauth_required(True)
+
+    def apply_shared_state(self, state) -> None:
+        """
+        Takes over an update another EDFT instance made to this account while holding its lease (see edft_leases), so
+        this instance shows it without polling the account itself. The documents are not archived again; the instance
+        that fetched them has done that.
+        :param state: the state dict published by the lease holder, see edft_leases.shared_state(); keys it leaves out
+        are left as they are
+        """
+        if state.get("token_ciphertext") is not None:
+            ciphertext = tuple(
+                token.encode("ascii") for token in state["token_ciphertext"]
+            )
+            if ciphertext != self.snapshot.token_ciphertext:
+                self._publish(
+                    access_token=self.cipher.decrypt(ciphertext[0]).decode("utf8"),
+                    refresh_token=self.cipher.decrypt(ciphertext[1]).decode("utf8"),
+                    token_ciphertext=ciphertext,
+                )
+        for endpoint, field in (
+            (API_CMDR_ENDPOINT, "cmdr_data"),
+            (API_FC_ENDPOINT, "fc_data"),
+        ):
+            if state.get(field) is not None and state[field] != self.snapshot.get(
+                field
+            ):
+                # Our last digest no longer describes what we show, so the next poll we make must not skip on it
+                self.payload_digests.pop(endpoint, None)
+                self._replace_payload(endpoint, state[field])
+        if state.get("fetched_at") and state["fetched_at"] > (self.last_fetched or 0):
+            self._mark_fetched(state["fetched_at"])
+        if "reauth_required" in state:
+            self._set_reauth_required(state["reauth_required"])
 
     def destroy(self) -> None:
         """
         Removes this account from the on-disk database.
         """
-        self.logger.debug("destroying account " + self.name)
+        self.logger.debug("destroying account %s", self.name)
         cur = self.conn.cursor()
         cur.execute("delete from accounts where name=?", (self.name,))
+        self.archive.forget(self.name)
         self.conn.commit()
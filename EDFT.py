@@ -1,65 +1,139 @@
-import sqlite3
 from EliteDangerousFleetTracker import EliteDangerousFleetTracker
-from edft_shared_constants import LOCAL_DB_PATH
+from edft_api_server import FleetStateServer
+from edft_statefile import FleetStateFile
+from edft_logging import create_log_handler
+from edft_shared_constants import (
+    LOCAL_DB_PATH,
+    COLLECTOR_PROCESSES,
+    PROFILE_ON_START,
+    CAPI_REPLAY_DIR,
+)
+import edft_transport
+from edft_workers import CollectorPool
+from edft_scheduler import PollScheduler
+from edft_leases import LeaseCoordinator, create_lease_store
+from edft_budget import BUDGET
+from edft_db import ThreadLocalConnection
 import logging
-from logging import handlers
+import multiprocessing
 import threading
 import time
 import os
 
-if not os.path.isdir(LOCAL_DB_PATH):
-    os.makedirs(LOCAL_DB_PATH)
-if not os.path.isdir(LOCAL_DB_PATH + "\\logs"):
-    os.makedirs(LOCAL_DB_PATH + "\\logs")
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# lh = logging.StreamHandler()
-lh = logging.handlers.RotatingFileHandler(
-    LOCAL_DB_PATH + "\\logs\\edft.log", maxBytes=128 * 1024 * 1024, backupCount=5
-)
-lh.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-
-lh.setFormatter(formatter)
-logger.addHandler(lh)
-
 API_REFRESH_INTERVAL = 60000
 
 
-def capi_refresh_task(exitapp, instance) -> None:
+def capi_refresh_task(exitapp, instance, collector_pool=None, leases=None) -> None:
     """
     Task that is executed by the thread dedicated to updating cAPI data. Broken into one-second chunks to hasten exit.
+    Each account is polled once its data is a refresh interval old, as decided by a PollScheduler. The interval starts
+    at API_REFRESH_INTERVAL and is then planned by the request budget (see edft_budget) from the number of accounts
+    polled here and how long polling them takes.
     :param exitapp: cheekily-mutable boolean flag that is set when GUI thread completes (user clicks quit button).
     :param instance: Reference to the instantiated EDFT main class to gain access to the accounts to update.
+    :param collector_pool: A started CollectorPool to fan the updates out to worker processes, or None to update the
+    accounts one after another on this thread.
+    :param leases: A LeaseCoordinator shared with other EDFT instances, or None to poll every account. With one, only
+    the accounts this instance holds the lease on are polled, and the rest are kept up to date from the other instances.
     """
-    counter = 10000
+    scheduler = PollScheduler(API_REFRESH_INTERVAL / 1000, instance.log_handler)
+    parallelism = collector_pool.processes if collector_pool is not None else 1
     while exitapp[0] is False:
-        if counter >= API_REFRESH_INTERVAL / 1000:
-            for account in instance.account_table:
-                if exitapp[0]:
-                    break
-                if not account.reauth_required:
+        table = list(instance.account_table)
+        if leases is not None:
+            owned = leases.claim(table, time.time())
+            leases.adopt(table)
+            table = [account for account in table if account.name in owned]
+        pollable = [account for account in table if not account.reauth_required]
+        # Instances sharing a fleet share the host too, so each plans against its part of the host budget
+        scheduler.interval = BUDGET.plan(
+            len(pollable),
+            parallelism,
+            instances=leases.instance_count if leases is not None else 1,
+        )["interval"]
+        accounts = scheduler.due_accounts(table, time.time())
+        if accounts:
+            started = time.perf_counter()
+            if collector_pool is not None:
+                collector_pool.collect(accounts, instance.projection_paths(), exitapp)
+            else:
+                for account in accounts:
+                    if exitapp[0]:
+                        break
                     account.update_from_capi()
-            counter = 0
-        counter += 1
+            BUDGET.polled(
+                [account.name for account in accounts],
+                time.perf_counter() - started,
+                parallelism,
+            )
+            for account in accounts:
+                scheduler.polled(account, time.time())
+        if leases is not None:
+            leases.publish(list(instance.account_table))
         time.sleep(1)
 
 
-with sqlite3.connect(LOCAL_DB_PATH + "\\edft.db") as conn:
-    EDFT = EliteDangerousFleetTracker(conn, lh)
-    logger.debug("starting up")
-    cur = conn.cursor()
-    res = cur.execute("SELECT name FROM sqlite_master WHERE name='accounts'")
-    if res.fetchone() is None:  # i.e. first start, table doesn't exist.
-        cur.execute(
-            "CREATE TABLE accounts(name, state, code, challenge, verifier, access_token, refresh_token,"
-            "reauth_required, reauth_prompted, cmdr_data, fc_data)"
+if __name__ == "__main__":
+    # Everything below must only run in the GUI process, not in collector worker processes, which re-import this
+    # module when they are spawned.
+    multiprocessing.freeze_support()
+    if not os.path.isdir(LOCAL_DB_PATH):
+        os.makedirs(LOCAL_DB_PATH)
+    if not os.path.isdir(os.path.join(LOCAL_DB_PATH, "logs")):
+        os.makedirs(os.path.join(LOCAL_DB_PATH, "logs"))
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+
+    lh = create_log_handler("edft.log")
+    logger.addHandler(lh)
+
+    conn = ThreadLocalConnection(lh)
+    try:
+        EDFT = EliteDangerousFleetTracker(conn, lh)
+        logger.debug("starting up")
+        cur = conn.cursor()
+        res = cur.execute("SELECT name FROM sqlite_master WHERE name='accounts'")
+        if res.fetchone() is None:  # i.e. first start, table doesn't exist.
+            cur.execute(
+                "CREATE TABLE accounts(name, state, code, challenge, verifier, access_token, refresh_token,"
+                "reauth_required, reauth_prompted, cmdr_data, fc_data, last_fetched)"
+            )
+        elif "last_fetched" not in [
+            column[1] for column in cur.execute("PRAGMA table_info(accounts)")
+        ]:  # databases created before fetch times were recorded
+            cur.execute("ALTER TABLE accounts ADD COLUMN last_fetched")
+        conn.commit()
+        if PROFILE_ON_START > 0:
+            EDFT.profiler.start(PROFILE_ON_START)
+        EDFT.init_account_table()
+        exitapp = [False]
+        collector_pool = None
+        # Replays are served per process, so a replayed session is always collected in this one
+        if COLLECTOR_PROCESSES > 0 and not CAPI_REPLAY_DIR:
+            collector_pool = CollectorPool(COLLECTOR_PROCESSES)
+            collector_pool.start()
+        lease_store = create_lease_store(lh)
+        EDFT.leases = LeaseCoordinator(lease_store, lh, EDFT.projection_paths())
+        polling_thread = threading.Thread(
+            target=capi_refresh_task,
+            args=[exitapp, EDFT, collector_pool, EDFT.leases],
+            name="capi-poller",
         )
-    EDFT.init_account_table()
-    exitapp = [False]
-    polling_thread = threading.Thread(target=capi_refresh_task, args=[exitapp, EDFT])
-    polling_thread.start()
-    EDFT.create_gui()
-    exitapp[0] = True
-    polling_thread.join()
+        polling_thread.start()
+        fleet_state_server = FleetStateServer(EDFT, lh)
+        fleet_state_server.start()
+        fleet_state_file = FleetStateFile(EDFT, lh)
+        fleet_state_file.start()
+        EDFT.create_gui()
+        exitapp[0] = True
+        EDFT.onboarding_pool.shutdown(wait=False, cancel_futures=True)
+        fleet_state_server.stop()
+        fleet_state_file.stop()
+        polling_thread.join()
+        EDFT.leases.stop()
+        lease_store.close()
+        if collector_pool is not None:
+            collector_pool.stop()
+    finally:
+        edft_transport.TRANSPORT.close()
+        conn.close()
@@ -1,14 +1,35 @@
 import sqlite3
 import webbrowser
-from Account import TokenRequestType
-from Account import Account
+from Account import TokenRequestType, OnboardingState
+from Account import Account, API_CMDR_ENDPOINT, API_FC_ENDPOINT
+from edft_archive import PayloadArchive
+from edft_diff import ChangeFeed, DIFF_PATHS
+from edft_alerts import AlertEngine, DEFAULT_ALERT_CONFIG, load_alert_config
 from tkinter import *
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import filedialog
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from edft_metrics import REGISTRY
+from edft_budget import BUDGET
+from edft_profiler import Profiler
+from edft_squadron import SquadronView, SQUADRON_PATHS
+from edft_projections import FleetHistory
+from edft_views import DEFAULT_VIEWS, TableView, ViewCache, load_views
+from edft_shared_constants import LOCAL_DB_PATH, LADDER, TONNAGE_FIELDS
 
 GUI_LABEL_REFRESH_INTERVAL = 1000
+ONBOARDING_WORKERS = 8
+DIAGNOSTICS_REFRESH_INTERVAL = 5000
+SQUADRON_REFRESH_INTERVAL = 5000
+PROJECTIONS_REFRESH_INTERVAL = 5000
+VIEWS_REFRESH_INTERVAL = 1000
+METRICS_EXPORT_PATH = os.path.join(LOCAL_DB_PATH, "metrics.prom")
 
 
 class Owner(Enum):
@@ -20,32 +41,35 @@ class Owner(Enum):
     DELETE = 5
 
 
+""" Projections tab columns: heading, and the projected field shown (see edft_projections.project_fleet) """
+PROJECTION_COLUMNS = (
+    ("Carrier", "name"),
+    ("Balance", "balance"),
+    ("Spent/day", "balance_burn"),
+    ("Days of Balance", "balance_days"),
+    ("Fuel", "fuel"),
+    ("Fuel/day", "fuel_burn"),
+    ("Days of Fuel", "fuel_days"),
+)
+
+""" Squadron tab columns: heading, and the group and display name of the exported value shown (see export_account) """
+SQUADRON_COLUMNS = (
+    ("Callsign", "fleet_carrier", "Callsign"),
+    ("Carrier", "fleet_carrier", "Name"),
+    ("Operator", None, None),
+    ("Commander", "commander", "Name"),
+    ("System", "fleet_carrier", "System"),
+    ("N#", "fleet_carrier", "N#"),
+    ("Fuel", "fleet_carrier", "Fuel"),
+    ("Balance", "fleet_carrier", "Balance"),
+    ("Updated", None, None),
+)
+
 """ Dynamic Label Entry Indices """
 LABEL = 0
 ACCOUNT = 1
 COLUMN = 2
 
-""" The Ladder """
-LADDER = {
-    "Gali": "N16",
-    "Wregoe ZE-B c28-2": "N15",
-    "Wregoe OP-D b58-0": "N14",
-    "Plaa Trua QL-B c27-0": "N13",
-    "Plaa Trua WQ-C d13-0": "N12",
-    "HD 107865": "N11",
-    "HD 105548": "N10",
-    "HD 104785": "N9",
-    "HD 102000": "N8",
-    "HD 102779": "N7",
-    "HD 104392": "N6",
-    "HIP 56843": "N5",
-    "HIP 57478": "N4",
-    "HIP 57784": "N3",
-    "HD 104495": "N2",
-    "HD 105341": "N1",
-    "HIP 58832": "N0",
-}
-
 
 def dynamic_item_spec(owner, display_name, keys, post_processors) -> dict:
     """
@@ -78,15 +102,38 @@ class EliteDangerousFleetTracker:
     log_handler = None
     account_table = None
     frm1 = None
-    frm2 = None
     frm3 = None
+    frm_alerts = None
+    alerts_list = None
+    alerts_version = -1
+    alert_engine = None
     root = None
     tab_control = None
     dynamic_labels = []
     capi_buttons = []
     input_box = None
-    ready_accounts = 0
     columns = None
+    diagnostics_text = None
+    profiler = None
+    profile_button = None
+    archive = None
+    change_feed = None
+    changed_accounts = None
+    onboarding_pool = None
+    squadron = None
+    frm_squadron = None
+    squadron_tree = None
+    history = None
+    frm_projections = None
+    projections_tree = None
+    projections_totals = None
+    projected_version = None
+    leases = None
+    views = None
+    view_tabs = None
+    view_cache = None
+    main_pending = None
+    budget_label = None
 
     def __init__(self, conn, log_handler):
         self.version = "0.2.2"
@@ -96,12 +143,32 @@ class EliteDangerousFleetTracker:
         self.log_handler = log_handler
         self.logger.addHandler(log_handler)
         self.logger.debug("Starting up main EDFT instance")
+        self.archive = PayloadArchive(conn, log_handler)
+        self.change_feed = ChangeFeed(log_handler)
+        self.changed_accounts = set()
+        self.changes_lock = threading.Lock()
+        self.change_feed.subscribe(self.note_changes)
+        try:
+            alert_config = load_alert_config()
+        except (OSError, ValueError):
+            self.logger.exception("could not load alert configuration, using defaults")
+            alert_config = DEFAULT_ALERT_CONFIG
+        self.alert_engine = AlertEngine(alert_config, self.change_feed, log_handler)
+        self.profiler = Profiler(log_handler)
+        self.squadron = SquadronView(conn, log_handler)
+        self.history = FleetHistory(conn, log_handler)
+        self.onboarding_pool = ThreadPoolExecutor(
+            max_workers=ONBOARDING_WORKERS, thread_name_prefix="edft-onboarding"
+        )
         self.columns = [
             dynamic_item_spec(Owner.DELETE, "", None, (self.delete_column,)),
             dynamic_item_spec(Owner.CAPI, "cAPI", None, (self.capi_column,)),
             dynamic_item_spec(
                 Owner.ACCOUNT, "Nickname", ("name",), (self.passthrough,)
             ),
+            dynamic_item_spec(
+                Owner.ACCOUNT, "Age", ("last_fetched",), (self.age_format,)
+            ),
             dynamic_item_spec(
                 Owner.COMMANDER, "Name", ("commander", "name"), (self.passthrough,)
             ),
@@ -172,6 +239,25 @@ class EliteDangerousFleetTracker:
                 (self.ghost_orders,),
             ),
         ]
+        self.view_cache = ViewCache(
+            lambda column, account, snapshot: self.generate_dynamic_label_text(
+                (None, account, column), snapshot
+            ),
+            self.column_document,
+            log_handler,
+        )
+        self.main_pending = set()
+        try:
+            view_definitions = load_views()
+        except (OSError, ValueError):
+            self.logger.exception("could not load views, using defaults")
+            view_definitions = DEFAULT_VIEWS
+        self.views = []
+        for definition in view_definitions:
+            try:
+                self.views.append(TableView(definition, self.column_names()))
+            except ValueError:
+                self.logger.exception("skipping view %s", definition)
 
     def create_gui(self) -> None:
         """
@@ -180,10 +266,27 @@ class EliteDangerousFleetTracker:
         """
         self.root = Tk()
         self.tab_control = ttk.Notebook(self.root, padding=10)
-        self.frm2 = ttk.Frame(self.tab_control, padding=10)
-        self.tab_control.add(self.frm2, text="None of Your Business")
+        self.view_tabs = [self.create_view_frame(view) for view in self.views]
+        self.frm3 = ttk.Frame(self.tab_control, padding=10)
+        self.create_diagnostics_frame(self.frm3)
+        self.tab_control.add(self.frm3, text="Diagnostics")
+        self.frm_alerts = ttk.Frame(self.tab_control, padding=10)
+        self.alerts_list = Listbox(self.frm_alerts, width=120, height=20)
+        self.alerts_list.grid(row=0, column=0, sticky="nsew")
+        self.tab_control.add(self.frm_alerts, text="Alerts")
+        self.frm_squadron = ttk.Frame(self.tab_control, padding=10)
+        self.create_squadron_frame(self.frm_squadron)
+        self.tab_control.add(self.frm_squadron, text="Squadron")
+        self.frm_projections = ttk.Frame(self.tab_control, padding=10)
+        self.create_projections_frame(self.frm_projections)
+        self.tab_control.add(self.frm_projections, text="Projections")
         self.create_main_frame(self.tab_control)
         self.tab_control.pack(expand=1, fill="both")
+        self.tab_control.bind(
+            "<<NotebookTabChanged>>", lambda e: self.update_views(False)
+        )
+        self.root.after(GUI_LABEL_REFRESH_INTERVAL, self.update_dynamic_labels)
+        self.root.after(VIEWS_REFRESH_INTERVAL, self.update_views)
         self.root.title("Elite Dangerous Fleet Tracker v" + self.version)
         self.root.mainloop()
 
@@ -203,7 +306,405 @@ class EliteDangerousFleetTracker:
         self.frm1.pack()
         parent.add(self.frm1, text="Main")
         parent.select(parent.index("end") - 1)
-        self.root.after(GUI_LABEL_REFRESH_INTERVAL, self.update_dynamic_labels)
+
+    def create_view_frame(self, view) -> dict:
+        """
+        Creates the tab of a user-defined view (see edft_views), with an empty table that update_views() fills in once
+        the tab is shown.
+        :param view: the TableView
+        :return: dict holding the view, its frame and table, and the rows currently shown
+        """
+        frame = ttk.Frame(self.tab_control, padding=10)
+        column_ids = [str(i) for i in range(len(view.columns))]
+        tree = ttk.Treeview(frame, columns=column_ids, show="headings", height=25)
+        for column_id, heading in zip(column_ids, view.headings()):
+            tree.heading(column_id, text=heading, anchor="w")
+            tree.column(column_id, width=120, anchor="w")
+        tree.grid(row=0, column=0, sticky="nsew")
+        self.tab_control.add(frame, text=view.name)
+        return {"view": view, "frame": frame, "tree": tree, "shown": {}}
+
+    def update_views(self, reschedule=True) -> None:
+        """
+        Evaluates the user-defined view on the visible tab, if any, and updates the rows that changed. Views that aren't
+        visible cost nothing; when one is shown, it is evaluated straight away.
+        :param reschedule: Whether to schedule the next periodic refresh. False when called because the tab changed.
+        :return: None
+        """
+        try:
+            selected = self.tab_control.select()
+            for view_tab in self.view_tabs:
+                if selected == str(view_tab["frame"]):
+                    rows = view_tab["view"].evaluate(
+                        self.account_table, self.view_cache
+                    )
+                    self.show_view_rows(view_tab, rows)
+        except:
+            self.logger.exception("")
+        if reschedule:
+            self.root.after(VIEWS_REFRESH_INTERVAL, self.update_views)
+
+    @staticmethod
+    def show_view_rows(view_tab, rows) -> None:
+        """
+        Brings a view's table in line with freshly evaluated rows, touching only the rows that were added, removed,
+        moved or changed.
+        :param view_tab: the dict returned by create_view_frame()
+        :param rows: list of (account name, list of label texts), in display order
+        :return: None
+        """
+        tree = view_tab["tree"]
+        shown = view_tab["shown"]
+        names = {name for name, _ in rows}
+        for name in list(shown):
+            if name not in names:
+                tree.delete(name)
+                del shown[name]
+        for index, (name, values) in enumerate(rows):
+            if name not in shown:
+                tree.insert("", index, iid=name, values=values)
+            else:
+                if shown[name] != values:
+                    tree.item(name, values=values)
+                if tree.index(name) != index:
+                    tree.move(name, "", index)
+            shown[name] = values
+
+    def create_diagnostics_frame(self, parent) -> None:
+        """
+        Creates the "Diagnostics" tab, which shows the request, parse, persist and render timings recorded in the
+        metrics registry, and lets the profiler be started and stopped.
+        :param parent: the frame that holds the tab's contents
+        :return: None
+        """
+        self.diagnostics_text = Text(parent, width=140, height=30, wrap="none")
+        self.diagnostics_text.grid(row=0, column=0, columnspan=3, sticky="nsew")
+        ttk.Button(
+            parent, text="Refresh", command=lambda: self.update_diagnostics(False)
+        ).grid(row=1, column=0, sticky="w")
+        self.profile_button = ttk.Button(
+            parent, text="Start Profiling", command=self.profile_callback
+        )
+        self.profile_button.grid(row=1, column=1)
+        ttk.Button(parent, text="Export", command=self.export_metrics_callback).grid(
+            row=1, column=2, sticky="e"
+        )
+        self.root.after(DIAGNOSTICS_REFRESH_INTERVAL, self.update_diagnostics)
+
+    def update_diagnostics(self, reschedule=True) -> None:
+        """
+        Rewrites the Diagnostics tab from the metrics registry. Only does any work while the tab is actually visible.
+        :param reschedule: Whether to schedule the next periodic refresh. False for manual refreshes.
+        :return: None
+        """
+        try:
+            if self.tab_control.select() == str(self.frm3):
+                lines = REGISTRY.summary_lines() or ["No metrics recorded yet."]
+                if BUDGET.latest is not None:
+                    lines = BUDGET.usage_lines(BUDGET.latest) + [""] + lines
+                if self.leases is not None:
+                    lines = [self.leases.status(), ""] + lines
+                self.diagnostics_text.configure(state="normal")
+                self.diagnostics_text.delete("1.0", END)
+                self.diagnostics_text.insert(
+                    "1.0", "\n".join([self.profiler.status(), ""] + lines)
+                )
+                self.diagnostics_text.configure(state="disabled")
+                self.profile_button.configure(
+                    text=(
+                        "Stop Profiling"
+                        if self.profiler.running()
+                        else "Start Profiling"
+                    )
+                )
+        except:
+            self.logger.exception("")
+        if reschedule:
+            self.root.after(DIAGNOSTICS_REFRESH_INTERVAL, self.update_diagnostics)
+
+    def create_squadron_frame(self, parent) -> None:
+        """
+        Creates the "Squadron" tab, which shows the carriers of this and other EDFT instances merged into one table, and
+        the buttons to exchange snapshot files with them.
+        :param parent: the frame that holds the tab's contents
+        :return: None
+        """
+        self.squadron_tree = ttk.Treeview(
+            parent,
+            columns=[column[0] for column in SQUADRON_COLUMNS],
+            show="headings",
+            height=25,
+        )
+        for column in SQUADRON_COLUMNS:
+            self.squadron_tree.heading(column[0], text=column[0], anchor="w")
+            self.squadron_tree.column(column[0], width=120, anchor="w")
+        self.squadron_tree.grid(row=0, column=0, columnspan=3, sticky="nsew")
+        ttk.Button(
+            parent, text="Export Snapshot", command=self.export_snapshot_callback
+        ).grid(row=1, column=0, sticky="w")
+        ttk.Button(
+            parent, text="Import Snapshots", command=self.import_snapshots_callback
+        ).grid(row=1, column=1)
+        ttk.Button(
+            parent, text="Reimport All", command=self.reimport_snapshots_callback
+        ).grid(row=1, column=2, sticky="e")
+        self.root.after(SQUADRON_REFRESH_INTERVAL, self.update_squadron)
+
+    def update_squadron(self, reschedule=True) -> None:
+        """
+        Merges any changes to this instance's own carriers into the squadron view and updates the rows that changed.
+        Only does any work while the Squadron tab is visible.
+        :param reschedule: Whether to schedule the next periodic refresh. False for refreshes after an import.
+        :return: None
+        """
+        try:
+            if self.tab_control.select() == str(self.frm_squadron):
+                self.squadron.merge_local(self)
+                for key in self.squadron.drain_changes():
+                    values = self.squadron_row(self.squadron.carriers[key])
+                    if self.squadron_tree.exists(key):
+                        self.squadron_tree.item(key, values=values)
+                    else:
+                        self.squadron_tree.insert("", END, iid=key, values=values)
+        except:
+            self.logger.exception("")
+        if reschedule:
+            self.root.after(SQUADRON_REFRESH_INTERVAL, self.update_squadron)
+
+    def squadron_row(self, record) -> list:
+        """
+        Generates the values of a Squadron tab row from a merged carrier record.
+        :param record: the carrier record
+        :return: list of cell values, in SQUADRON_COLUMNS order
+        """
+        values = []
+        for heading, group, name in SQUADRON_COLUMNS:
+            match heading:
+                case "Operator":
+                    value = self.squadron.source_name(record["source"])
+                case "Updated":
+                    value = time.strftime(
+                        "%Y-%m-%d %H:%M", time.localtime(record["updated_at"])
+                    )
+                case _:
+                    value = record.get(group, {}).get(name)
+            values.append("-" if value is None else value)
+        return values
+
+    def create_projections_frame(self, parent) -> None:
+        """
+        Creates the "Projections" tab, which shows how fast each carrier's balance and fuel have been going down and how
+        long they will last at that rate, with fleet-wide totals underneath.
+        :param parent: the frame that holds the tab's contents
+        :return: None
+        """
+        self.projections_tree = ttk.Treeview(
+            parent,
+            columns=[column[0] for column in PROJECTION_COLUMNS],
+            show="headings",
+            height=25,
+        )
+        for heading, field in PROJECTION_COLUMNS:
+            self.projections_tree.heading(heading, text=heading, anchor="w")
+            self.projections_tree.column(heading, width=120, anchor="w")
+        self.projections_tree.grid(row=0, column=0, sticky="nsew")
+        self.projections_totals = ttk.Label(parent, text="")
+        self.projections_totals.grid(row=1, column=0, sticky="w")
+        self.root.after(PROJECTIONS_REFRESH_INTERVAL, self.update_projections)
+
+    def update_projections(self) -> None:
+        """
+        Recomputes the projections and redraws the Projections tab. Only does any work while the tab is visible, and
+        only if the history has changed since the last time.
+        :return: None
+        """
+        try:
+            if (
+                self.tab_control.select() == str(self.frm_projections)
+                and self.history.version != self.projected_version
+            ):
+                self.projected_version = self.history.version
+                names = [account.name for account in self.account_table]
+                projection = self.history.project(names)
+                self.projections_tree.delete(*self.projections_tree.get_children())
+                for carrier in projection["carriers"]:
+                    self.projections_tree.insert(
+                        "",
+                        END,
+                        iid=carrier["name"],
+                        values=self.projection_row(carrier),
+                    )
+                totals = projection["totals"]
+                self.projections_totals.configure(
+                    text="Fleet: {0} Cr, spending {1} Cr/day ({2} days); {3} t fuel, burning {4} t/day. "
+                    "First to run out: balance in {5} days, fuel in {6} days.".format(
+                        *[
+                            self.projection_format(totals[field])
+                            for field in (
+                                "balance",
+                                "balance_burn",
+                                "balance_days",
+                                "fuel",
+                                "fuel_burn",
+                                "first_balance_days",
+                                "first_fuel_days",
+                            )
+                        ]
+                    )
+                )
+        except:
+            self.logger.exception("")
+        self.root.after(PROJECTIONS_REFRESH_INTERVAL, self.update_projections)
+
+    def projection_row(self, carrier) -> list:
+        """
+        Generates the values of a Projections tab row.
+        :param carrier: a per-carrier dict from project_fleet()
+        :return: list of cell values, in PROJECTION_COLUMNS order
+        """
+        return [
+            (
+                carrier["name"]
+                if field == "name"
+                else self.projection_format(carrier[field])
+            )
+            for heading, field in PROJECTION_COLUMNS
+        ]
+
+    @staticmethod
+    def projection_format(value) -> str:
+        """
+        Formats a projected value: "-" when it isn't known (too little history, or nothing is being spent).
+        :param value: the number, or None
+        :return: the formatted number
+        """
+        if value is None:
+            return "-"
+        return EliteDangerousFleetTracker.currency_format(value)
+
+    def export_snapshot_callback(self) -> None:
+        """
+        Writes this instance's carriers to a snapshot file chosen by the user. Executed when the "Export Snapshot"
+        button on the Squadron tab is pressed.
+        :return: Nothing
+        """
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("EDFT fleet snapshot", "*.json")],
+            initialfile="edft-fleet.json",
+        )
+        if not path:
+            return
+        try:
+            count = self.squadron.export_snapshot(self, path)
+            messagebox.showinfo("Squadron", str(count) + " carriers written to " + path)
+        except OSError:
+            self.logger.exception("")
+            messagebox.showerror("Error", "Could not write " + path)
+
+    def import_snapshots_callback(self) -> None:
+        """
+        Merges snapshot files from other instances, chosen by the user, into the squadron view. Executed when the
+        "Import Snapshots" button on the Squadron tab is pressed.
+        :return: Nothing
+        """
+        paths = filedialog.askopenfilenames(
+            filetypes=[("EDFT fleet snapshot", "*.json")]
+        )
+        failed = []
+        for path in paths:
+            try:
+                self.squadron.import_snapshot(path)
+            except (OSError, ValueError, KeyError, TypeError):
+                self.logger.exception("could not import %s", path)
+                failed.append(path)
+        if failed:
+            messagebox.showerror("Error", "Could not import:\n" + "\n".join(failed))
+        self.update_squadron(False)
+
+    def reimport_snapshots_callback(self) -> None:
+        """
+        Imports every previously imported snapshot file again, merging whatever changed since. Executed when the
+        "Reimport All" button on the Squadron tab is pressed.
+        :return: Nothing
+        """
+        self.squadron.reimport()
+        self.update_squadron(False)
+
+    def export_metrics_callback(self) -> None:
+        """
+        Writes the current metrics to METRICS_EXPORT_PATH in Prometheus text format. Executed when the "Export" button
+        on the Diagnostics tab is pressed.
+        :return: Nothing
+        """
+        try:
+            REGISTRY.export_to_file(METRICS_EXPORT_PATH)
+            messagebox.showinfo("Metrics", "Metrics written to " + METRICS_EXPORT_PATH)
+        except OSError:
+            self.logger.exception("")
+            messagebox.showerror("Error", "Could not write " + METRICS_EXPORT_PATH)
+
+    def profile_callback(self) -> None:
+        """
+        Starts a profile of PROFILE_DURATION seconds, or ends the one in progress early. Executed when the profiling
+        button on the Diagnostics tab is pressed.
+        :return: Nothing
+        """
+        if self.profiler.running():
+            self.profiler.stop()
+            self.profile_button.configure(text="Start Profiling")
+        else:
+            self.profiler.start()
+            self.profile_button.configure(text="Stop Profiling")
+        self.update_diagnostics(False)
+
+    @staticmethod
+    def record_tick(elapsed) -> None:
+        """
+        Records how long a GUI tick took, and whether it overran GUI_LABEL_REFRESH_INTERVAL.
+        :param elapsed: tick duration in seconds
+        :return: None
+        """
+        REGISTRY.observe("edft_stage_seconds", elapsed, stage="render")
+        if elapsed * 1000 > GUI_LABEL_REFRESH_INTERVAL:
+            REGISTRY.inc("edft_gui_tick_overruns_total")
+
+    def note_changes(self, events) -> None:
+        """
+        Change feed subscriber. Runs on the polling thread, so it only records which accounts changed; the next GUI
+        tick picks them up.
+        :param events: list of change events
+        :return: None
+        """
+        with self.changes_lock:
+            for event in events:
+                self.changed_accounts.add(event["account"])
+        for event in events:
+            REGISTRY.inc("edft_change_events_total", type=event["type"].name)
+
+    def update_alerts(self) -> None:
+        """
+        Redraws the Alerts tab, if the set of active alerts has changed since it was last drawn.
+        :return: None
+        """
+        if self.alert_engine.version == self.alerts_version:
+            return
+        self.alerts_version = self.alert_engine.version
+        alerts = self.alert_engine.active_alerts()
+        self.alerts_list.delete(0, END)
+        for alert in alerts:
+            self.alerts_list.insert(
+                END,
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(alert["raised_at"]))
+                + "  "
+                + alert["account"]
+                + ": "
+                + alert["message"],
+            )
+        self.tab_control.tab(
+            self.frm_alerts,
+            text="Alerts (" + str(len(alerts)) + ")" if alerts else "Alerts",
+        )
 
     def update_dynamic_labels(self) -> None:
         """
@@ -212,36 +713,58 @@ class EliteDangerousFleetTracker:
         thoon.
 
         This method currently manages the labels, the database polling while waiting for the code from the API endpoint
-        to generate new tokens, and the synchronization of the account table in memory with the one on disk.
+        (the token exchange itself is handed off to start_onboarding()), and the synchronization of the account table in
+        memory with the one on disk.
+
+        Commander and Fleet Carrier labels are only regenerated for accounts the change feed has reported changes for
+        since the last tick; their text can't have changed otherwise, and it comes from the cache the views share. While
+        another tab is showing, no labels are regenerated at all; the changes are caught up with once Main is shown.
         :return: None
         """
+        start = time.perf_counter()
         try:
-            new_ready_accounts = self.count_ready_accounts()
-            if new_ready_accounts > self.ready_accounts:
-                self.logger.debug("found new account")
-                self.recreate_main_frame()
-            self.ready_accounts = new_ready_accounts
+            with self.changes_lock:
+                changed, self.changed_accounts = self.changed_accounts, set()
+            main_visible = self.tab_control.select() == str(self.frm1)
+            if main_visible:
+                changed |= self.main_pending
+                self.main_pending = set()
+            else:
+                self.main_pending |= changed
+            # One snapshot per account for the whole tick, so each row is drawn from a single consistent version
+            snapshots = {None: None}
             for entry in self.dynamic_labels:
+                if entry[ACCOUNT] not in snapshots:
+                    snapshots[entry[ACCOUNT]] = entry[ACCOUNT].snapshot
+                snapshot = snapshots[entry[ACCOUNT]]
                 # Update each Dynamic Label as long as the account is current.
                 # Update CAPI, Account, None, and Delete columns always.
-                if (
+                if main_visible and (
                     entry[COLUMN]["owner"] is Owner.CAPI
                     or entry[COLUMN]["owner"] is Owner.ACCOUNT
                     or entry[COLUMN]["owner"] is Owner.DELETE
                     or entry[COLUMN]["owner"] is Owner.NONE
-                    or not entry[ACCOUNT].reauth_required
                 ):
-                    txt = self.generate_dynamic_label_text(entry)
+                    txt = self.generate_dynamic_label_text(entry, snapshot)
+                    entry[LABEL].configure(text=txt)
+                elif (
+                    main_visible
+                    and entry[ACCOUNT].name in changed
+                    and not snapshot.reauth_required
+                ):
+                    txt = self.view_cache.text(
+                        entry[ACCOUNT],
+                        snapshot,
+                        self.column_key(entry[COLUMN]),
+                        entry[COLUMN],
+                    )
                     entry[LABEL].configure(text=txt)
 
                 # Additional behavior for cAPI column:
-                if entry[COLUMN]["owner"] == Owner.CAPI:
+                if entry[COLUMN]["owner"] == Owner.CAPI and snapshot.onboarding is None:
                     account = entry[ACCOUNT]
                     if account.reauth_required and not account.reauth_prompted:
                         account.setup_uri(TokenRequestType.INITIAL)
-                        entry[LABEL].bind(
-                            "<Button-1>", lambda e: self.generate_capi_uri(e)
-                        )
                     if account.reauth_prompted:
                         cur = self.conn.cursor()
                         res = cur.execute(
@@ -250,26 +773,40 @@ class EliteDangerousFleetTracker:
                         )
                         code = res.fetchone()
                         if code is not None:
-                            account.set_code(code[0])
-                            self.logger.debug("obtaining tokens")
-                            account.obtain_tokens(TokenRequestType.INITIAL)
-                            self.logger.debug("capi update for just this account")
-                            account.update_from_capi()
-
-                # Additional behavior for delete column
-                if entry[COLUMN]["owner"] == Owner.DELETE:
-                    entry[LABEL].bind(
-                        "<Button-1>", lambda e: self.remove_account_callback(e)
-                    )
+                            self.start_onboarding(account, code[0])
+
+            if main_visible:
+                self.budget_label.configure(text=self.budget_status())
+            self.update_alerts()
 
             # Finally, check to see if any accounts need to be synced to disk. If so, do it now.
             for account in self.account_table:
                 if account.needs_sync:
                     account.sync_to_database()
-            self.root.after(GUI_LABEL_REFRESH_INTERVAL, self.update_dynamic_labels)
+            self.history.record(self.account_table)
         except:
             """Over-broad exception handling sure, but at least it doesn't swallow?"""
             self.logger.exception("")
+        finally:
+            self.record_tick(time.perf_counter() - start)
+            # The only place the next tick is scheduled, so there is only ever one of these loops running
+            self.root.after(GUI_LABEL_REFRESH_INTERVAL, self.update_dynamic_labels)
+
+    def start_onboarding(self, account, code) -> None:
+        """
+        Hands a (re)authorization off to the onboarding pool, so the token exchange and first fetch never block the GUI
+        and several accounts can be authorized at once. The code is cleared from the database straight away so the
+        next tick doesn't pick it up again.
+        :param account: the account being authorized
+        :param code: the code the helper stored for it
+        :return: None
+        """
+        cur = self.conn.cursor()
+        cur.execute("update accounts set code = null where name = ?", (account.name,))
+        self.conn.commit()
+        account.set_onboarding(OnboardingState.QUEUED)
+        self.logger.debug("queued onboarding", extra={"account": account.name})
+        self.onboarding_pool.submit(account.onboard, code)
 
     def test(self):
         # test code goes here
@@ -278,20 +815,37 @@ class EliteDangerousFleetTracker:
     def init_account_table(self) -> None:
         """
         This reads the account table from storage and loads it into memory. It constructs an Account object for each
-        account found on disk and places them in the account table for later retrieval.
+        account found on disk and places them in the account table for later retrieval. Archived payloads and carrier
+        history past their retention period are pruned first; if there is no carrier history yet, it is built from the
+        archive.
         :return: None
         """
-        self.account_table = []
+        self.archive.prune()
+        account_table = []
         cur = self.conn.cursor()
         try:
+            self.history.prune()
             names = cur.execute("select name from accounts").fetchall()
+            if self.history.empty():
+                self.history.backfill(
+                    self.archive, [name[0] for name in names], API_FC_ENDPOINT
+                )
             for name in names:
-                self.account_table.append(Account(self.conn, self.log_handler, name[0]))
+                account_table.append(
+                    Account(
+                        self.conn,
+                        self.log_handler,
+                        name[0],
+                        self.archive,
+                        self.change_feed,
+                    )
+                )
         except sqlite3.OperationalError:
             self.logger.exception("empty DB?")
-        self.ready_accounts = self.count_ready_accounts()
+        self.account_table = account_table
+        self.alert_engine.seed(self.account_table)
 
-    def generate_dynamic_label_text(self, dynamic_label_tuple) -> str:
+    def generate_dynamic_label_text(self, dynamic_label_tuple, snapshot=None) -> str:
         """
         Returns the text that should appear in the label defined by the input tuple. Fetches data from cache, indexes
         and applies post-processors as defined in the column specification.
@@ -301,22 +855,26 @@ class EliteDangerousFleetTracker:
         commander and data about the fleet carrier.
         :param dynamic_label_tuple: Contains reference to the label object, the account to which the data belongs, and
         the column specification that governs the formatted output data (in that order).
+        :param snapshot: The AccountSnapshot to read the data from. Defaults to the account's current snapshot; pass one
+        in to draw several labels from the same version.
         :return: The label text, after all post-processors have been applied. Guaranteed to be str.
         """
         column = dynamic_label_tuple[COLUMN]
         account = dynamic_label_tuple[ACCOUNT]
+        if snapshot is None and account is not None:
+            snapshot = account.snapshot
         match column["owner"]:
             case Owner.ACCOUNT | Owner.CAPI | Owner.DELETE:
-                prior = account
+                prior = snapshot
             case Owner.COMMANDER:
-                prior = account.cmdr_data
+                prior = snapshot.cmdr_data
             case Owner.FLEETCARRIER:
-                prior = account.fc_data
+                prior = snapshot.fc_data
             case Owner.NONE:
                 prior = None
             case _:
                 prior = None
-                self.logger.error("Invalid Owner Type Passed: " + str(column["owner"]))
+                self.logger.error("Invalid Owner Type Passed: %s", column["owner"])
 
         if column["keys"] is not None:
             for key in column["keys"]:
@@ -332,7 +890,8 @@ class EliteDangerousFleetTracker:
         self, parent, row, col, account, column_spec=None
     ) -> None:
         """
-        Creates a dynamic label and appends a reference to it to the dynamic labels list for later update.
+        Creates a dynamic label and appends a reference to it to the dynamic labels list for later update. Commander
+        and Fleet Carrier labels show the cached data straight away if there is any, and "-" otherwise.
         :param parent: the GUI element that contains the Label grid
         :param row: which row in the Label grid the Label lives in
         :param col: which column in the Label grid the Label lives in
@@ -344,16 +903,26 @@ class EliteDangerousFleetTracker:
             column = self.columns[col]
         else:
             column = column_spec
-        if account is None or (
-            (not account.reauth_required or column["owner"] is Owner.CAPI)
-            and account.fc_data is not None
-            and account.cmdr_data is not None
+        snapshot = account.snapshot if account is not None else None
+        # Cached data is shown even if it's stale or the account needs reauthorizing; the Age column says how old it is
+        if (
+            snapshot is None
+            or (
+                column["owner"] is not Owner.COMMANDER
+                and column["owner"] is not Owner.FLEETCARRIER
+            )
+            or (snapshot.fc_data and snapshot.cmdr_data)
         ):
-            txt = self.generate_dynamic_label_text((None, account, column))
+            txt = self.generate_dynamic_label_text((None, account, column), snapshot)
         else:
             txt = "-"
         label = ttk.Label(parent, text=txt, anchor="w", background="azure")
         label.grid(row=row, column=col, sticky="nsew")
+        match column["owner"]:
+            case Owner.CAPI:
+                label.bind("<Button-1>", lambda e: self.generate_capi_uri(e))
+            case Owner.DELETE:
+                label.bind("<Button-1>", lambda e: self.remove_account_callback(e))
 
         self.dynamic_labels.append((label, account, column))
 
@@ -378,7 +947,7 @@ class EliteDangerousFleetTracker:
                     fc_cols += 1
                 case _:
                     self.logger.error(
-                        "Invalid Column Group Owner Passed: " + str(column["owner"])
+                        "Invalid Column Group Owner Passed: %s", column["owner"]
                     )
         ttk.Label(parent, text="Account Info", justify=CENTER).grid(
             row=header_row, column=col_start, columnspan=account_cols, sticky="nsew"
@@ -444,27 +1013,171 @@ class EliteDangerousFleetTracker:
             (self.sum_liquid_assets, self.currency_format),
         )
         self.dynamic_gridded_label(parent, 0, 5, None, liquid_colspec)
+        self.budget_label = ttk.Label(parent, text=self.budget_status(), anchor="w")
+        self.budget_label.grid(row=1, column=0, columnspan=cols + 1, sticky="w")
         return current_row, cols
 
+    @staticmethod
+    def budget_status() -> str:
+        """
+        :return: the planned refresh interval, projected cycle time and headroom (see edft_budget), for the Main tab
+        """
+        if BUDGET.latest is None:
+            return "Planning refresh interval..."
+        return BUDGET.status(BUDGET.latest)
+
     def sum_liquid_assets(self, dummy) -> int:
         """
         Computes the total liquid assets across all accounts monitored, defined as the sum of all Commanders' balance
-        plus the sum of all Fleet Carriers' balances.
+        plus the sum of all Fleet Carriers' balances. Accounts without data yet (just onboarded, or loaded from disk
+        before their first fetch ever completed, which leaves empty documents) are left out.
         :return: total liquid assets for all accounts (int)
         """
         liquid_assets = 0
         for account in self.account_table:
-            if not account.reauth_required:
-                liquid_assets += int(account.cmdr_data["commander"]["credits"]) + int(
-                    account.fc_data["balance"]
+            snapshot = account.snapshot
+            if not snapshot.reauth_required and snapshot.cmdr_data and snapshot.fc_data:
+                liquid_assets += int(snapshot.cmdr_data["commander"]["credits"]) + int(
+                    snapshot.fc_data["balance"]
                 )
         return liquid_assets
 
+    def projection_paths(self) -> dict:
+        """
+        Lists the key paths into each cAPI document that the columns, the change feed and the squadron view actually
+        read. Collector
+        worker processes use this to send back only these parts of each document rather than the whole thing.
+        :return: dict of endpoint -> list of key tuples
+        """
+        paths = {
+            endpoint: set(DIFF_PATHS[endpoint]) | set(SQUADRON_PATHS.get(endpoint, ()))
+            for endpoint in (API_CMDR_ENDPOINT, API_FC_ENDPOINT)
+        }
+        for column in self.columns:
+            if column["keys"] is None:
+                continue
+            match column["owner"]:
+                case Owner.COMMANDER:
+                    paths[API_CMDR_ENDPOINT].add(column["keys"])
+                case Owner.FLEETCARRIER:
+                    paths[API_FC_ENDPOINT].add(column["keys"])
+        return {endpoint: sorted(keys) for endpoint, keys in paths.items()}
+
+    @staticmethod
+    def column_key(column) -> str:
+        """
+        Names a column by its group and display name, e.g. "fleet_carrier.Balance", as views refer to it.
+        :param column: the column spec
+        :return: the name, or None for columns views can't show (the delete column and the liquid assets total)
+        """
+        match column["owner"]:
+            case Owner.ACCOUNT | Owner.CAPI:
+                return "account." + column["display_name"]
+            case Owner.COMMANDER:
+                return "commander." + column["display_name"]
+            case Owner.FLEETCARRIER:
+                return "fleet_carrier." + column["display_name"]
+        return None
+
+    def column_names(self) -> dict:
+        """
+        :return: dict of column name (see column_key()) -> column spec, for every column a view can show
+        """
+        return {
+            self.column_key(column): column
+            for column in self.columns
+            if self.column_key(column) is not None
+        }
+
+    @staticmethod
+    def column_document(column, snapshot) -> dict:
+        """
+        :return: the document a column's label text is computed from, or None if it depends on more than a document
+        """
+        match column["owner"]:
+            case Owner.COMMANDER:
+                return snapshot.cmdr_data
+            case Owner.FLEETCARRIER:
+                return snapshot.fc_data
+        return None
+
+    def fleet_state_version(self) -> tuple:
+        """
+        Returns a cheap, comparable token describing the current state of the account table. Changes whenever an
+        account is added or removed, or whenever any account's cAPI data or authorization state changes.
+        :return: tuple of (account name, data version) pairs
+        """
+        return tuple(
+            (account.name, account.snapshot.version) for account in self.account_table
+        )
+
+    def export_fleet_state(self) -> dict:
+        """
+        Builds a JSON-serializable view of the account table for external consumers. See export_account() for the
+        per-account entries.
+        :return: dict containing the liquid asset total and one entry per account
+        """
+        accounts = [self.export_account(account) for account in self.account_table]
+        try:
+            liquid_assets = self.sum_liquid_assets(None)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            liquid_assets = None
+        return {
+            "version": self.version,
+            "liquid_assets": liquid_assets,
+            "accounts": accounts,
+        }
+
+    def export_account(self, account, snapshot=None) -> dict:
+        """
+        Builds a JSON-serializable entry for one account. Values are generated from the same column specifications as
+        the GUI table, grouped by column Owner so duplicate display names (e.g. "Balance") don't collide.
+        :param account: the account to export
+        :param snapshot: the AccountSnapshot to export; defaults to the account's current one
+        :return: the entry dict
+        """
+        if snapshot is None:
+            snapshot = account.snapshot
+        entry = {
+            "nickname": account.name,
+            "authorized": not snapshot.reauth_required,
+            "last_fetched": snapshot.last_fetched or None,
+            "onboarding": (
+                snapshot.onboarding.name if snapshot.onboarding is not None else None
+            ),
+            "carrier_id": (snapshot.fc_data or {}).get("market", {}).get("id"),
+            "commander": {},
+            "fleet_carrier": {},
+        }
+        has_data = bool(snapshot.cmdr_data) and bool(snapshot.fc_data)
+        for column in self.columns:
+            match column["owner"]:
+                case Owner.COMMANDER:
+                    group = entry["commander"]
+                case Owner.FLEETCARRIER:
+                    group = entry["fleet_carrier"]
+                case _:
+                    continue
+            value = None
+            if has_data:
+                try:
+                    value = self.generate_dynamic_label_text(
+                        (None, account, column), snapshot
+                    )
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    self.logger.debug(
+                        "could not export %s for %s",
+                        column["display_name"],
+                        account.name,
+                    )
+            group[column["display_name"]] = value
+        return entry
+
     def recreate_main_frame(self) -> None:
         """
-        Destroys the frame containing the Label grid array and recreates. Called twice in the process of adapting to
-        the number of accounts changing: once to make room for the new (empty except for the cAPI link) row, and again
-        after the account data has been populated to actually create the dynamic Labels for that account.
+        Destroys the frame containing the Label grid array and recreates. Called when accounts are added or removed.
+        A new account's row starts out with "-" placeholders, which are filled in by the regular label updates once its
+        data arrives.
 
         This method also destroys the capi_buttons and dynamic_labels arrays and creates them from scratch as it was
         easier than determining how to modify them to accommodate the new account(s).
@@ -473,8 +1186,7 @@ class EliteDangerousFleetTracker:
         self.frm1.destroy()
         self.capi_buttons = []
         self.dynamic_labels = []
-        for account in self.account_table:
-            account.reauth_prompted = False
+        self.view_cache.retain({account.name for account in self.account_table})
         self.create_main_frame(self.tab_control)
 
     def add_account_callback(self) -> None:
@@ -491,9 +1203,16 @@ class EliteDangerousFleetTracker:
                 break
 
         if is_unique:
-            self.account_table.append(
-                Account(self.conn, self.log_handler, self.input_box.get())
-            )
+            # Replaced rather than appended to, like removals, so other threads iterating the table are unaffected
+            self.account_table = self.account_table + [
+                Account(
+                    self.conn,
+                    self.log_handler,
+                    self.input_box.get(),
+                    self.archive,
+                    self.change_feed,
+                )
+            ]
             self.recreate_main_frame()
         else:
             messagebox.showerror("Error", "Account name must be unique!")
@@ -517,12 +1236,10 @@ class EliteDangerousFleetTracker:
             idx += 1
 
         self.logger.info(
-            "Popping account: "
-            + account_to_pop.name
-            + ":"
-            + self.account_table[idx].name
+            "Popping account: %s:%s", account_to_pop.name, self.account_table[idx].name
         )
-        self.account_table.pop(idx)
+        self.account_table = self.account_table[:idx] + self.account_table[idx + 1 :]
+        self.alert_engine.forget(account_to_pop.name)
         self.recreate_main_frame()
 
     @staticmethod
@@ -543,6 +1260,21 @@ class EliteDangerousFleetTracker:
         """
         return "{:0,.0f}".format(float(value))
 
+    @staticmethod
+    def age_format(last_fetched) -> str:
+        """
+        Formats how long ago an account's data was fetched from cAPI, in the largest whole unit.
+        :param last_fetched: When the data was fetched (epoch seconds), or 0 if it never has been.
+        :return: The age, e.g. "42s", "5m", "3h", "2d", or "-" if there is no data.
+        """
+        if not last_fetched:
+            return "-"
+        age = max(0, int(time.time() - last_fetched))
+        for unit, seconds in (("d", 86400), ("h", 3600), ("m", 60)):
+            if age >= seconds:
+                return str(age // seconds) + unit
+        return str(age) + "s"
+
     @staticmethod
     def hex_decode(value) -> str:
         """
@@ -556,9 +1288,11 @@ class EliteDangerousFleetTracker:
     def capi_column(account) -> str:
         """
         Implements the logic to determine what icon to indicate cAPI status.
-        :param account: The account whose connection we are indicating.
+        :param account: The account (or AccountSnapshot) whose connection we are indicating.
         :return: The cAPI status icon (emoji).
         """
+        if account.onboarding is not None:
+            return "⏳"
         return "⚠️" if account.reauth_required else "✅"
 
     @staticmethod
@@ -578,7 +1312,7 @@ class EliteDangerousFleetTracker:
         :param fc_data: the fleet carrier's data object
         :return: the total cargo loaded.
         """
-        return fc_data["cargoNotForSale"] + fc_data["cargoForSale"]
+        return sum(fc_data[field] for field in TONNAGE_FIELDS)
 
     @staticmethod
     def ladder_display(system) -> str:
@@ -628,7 +1362,10 @@ class EliteDangerousFleetTracker:
         """
         for item in self.dynamic_labels:
             if item[LABEL] == e.widget:
-                return webbrowser.open_new(item[ACCOUNT].get("auth_uri"))
+                account = item[ACCOUNT]
+                if not account.reauth_required or not account.auth_uri:
+                    return False
+                return webbrowser.open_new(account.get("auth_uri"))
 
     @staticmethod
     def ghost_orders(sales) -> str:
@@ -0,0 +1,458 @@
+"""
+Benchmarks for the per-tick hot paths: label generation and its post-processors, the liquid assets total, loading
+accounts from the database and writing them back. Each benchmark runs on synthetic fleets of 10, 100 and 1,000
+accounts with payloads shaped like real cAPI responses, using a throwaway database, and reports the median time and the
+peak memory allocated. Projections run over a synthetic month of balance and fuel history for the same fleets.
+
+Usage:
+    python benchmark.py                   run, and compare against benchmark_baseline.json if it exists
+    python benchmark.py --save-baseline   run, and store the results as the new baseline
+    python benchmark.py --threshold 0.5   flag anything more than 50% slower (or hungrier) than the baseline
+
+Exits with status 1 if anything regressed past the threshold. Baselines are machine-specific: record one on the machine
+you compare on, before making the change you want to measure.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from cryptography.fernet import Fernet
+from edft_secrets import FERNET_KEY
+from Account import Account, API_CMDR_ENDPOINT, API_FC_ENDPOINT
+from EliteDangerousFleetTracker import EliteDangerousFleetTracker, LADDER
+from edft_archive import compress_payload, payload_digest
+from edft_db import ThreadLocalConnection
+
+FLEET_SIZES = (10, 100, 1000)
+REPEATS = 5
+POST_PROCESSOR_CALLS = 10000
+HISTORY_DAYS = 30
+HISTORY_SAMPLES_PER_DAY = 6
+DEFAULT_THRESHOLD = 0.25
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"
+)
+
+COMMODITIES = [
+    "tritium",
+    "gold",
+    "silver",
+    "palladium",
+    "bertrandite",
+    "indite",
+    "gallite",
+    "coltan",
+    "lepidolite",
+    "uraninite",
+    "bauxite",
+    "rutile",
+    "steel",
+    "aluminium",
+    "titanium",
+    "copper",
+    "polymers",
+    "semiconductors",
+    "superconductors",
+    "water",
+    "liquidoxygen",
+    "foodcartridges",
+    "fruitandvegetables",
+    "grain",
+    "cmmcomposite",
+    "insulatingmembrane",
+    "ceramiccomposites",
+    "hnshockmount",
+    "emergencypowercells",
+    "powergenerators",
+]
+
+
+def synthetic_cmdr_data(rng, idx) -> dict:
+    """
+    A /profile document with the fields EDFT reads, plus a realistic amount of everything else.
+    """
+    systems = list(LADDER) + ["Sol", "Colonia", "Shinrarta Dezhra"]
+    return {
+        "commander": {
+            "id": 1000000 + idx,
+            "name": "CMDR Benchmark " + str(idx),
+            "credits": rng.randint(0, 10000000000),
+            "debt": 0,
+            "rank": {"combat": 5, "trade": 8, "explore": 6},
+        },
+        "ship": {
+            "id": idx,
+            "name": "Type9_Heavy",
+            "starsystem": {"name": rng.choice(systems), "id": rng.randint(0, 10**12)},
+            "station": {"name": "Station " + str(rng.randint(0, 999))},
+            "modules": {
+                "Slot"
+                + str(slot): {
+                    "module": {"name": "Int_CargoRack_Size6", "health": 1000000}
+                }
+                for slot in range(30)
+            },
+        },
+        "ships": {
+            str(ship): {"name": "Ship " + str(ship), "value": {"hull": 1000000}}
+            for ship in range(20)
+        },
+    }
+
+
+def synthetic_fc_data(rng, idx) -> dict:
+    """
+    A /fleetcarrier document with the fields EDFT reads, including a full order book and cargo hold.
+    """
+    commodities = rng.sample(COMMODITIES, 20)
+    return {
+        "name": {
+            "callsign": "B{0:02d}-{1:03d}".format(idx % 100, idx % 1000),
+            "filteredVanityName": ("Benchmark Carrier " + str(idx))
+            .encode("utf8")
+            .hex(),
+        },
+        "fuel": rng.randint(0, 1000),
+        "balance": rng.randint(0, 50000000000),
+        "currentStarSystem": rng.choice(list(LADDER) + ["Sol"]),
+        "capacity": {
+            "shipPacks": 0,
+            "modulePacks": 4,
+            "cargoForSale": rng.randint(0, 10000),
+            "cargoNotForSale": rng.randint(0, 10000),
+            "cargoSpaceReserved": 0,
+            "crew": 3000,
+            "freeSpace": 5000,
+        },
+        "orders": {
+            "commodities": {
+                "sales": [
+                    {
+                        "name": name,
+                        "stock": rng.choice((0, rng.randint(1, 5000))),
+                        "price": rng.randint(1, 100000),
+                    }
+                    for name in commodities[:10]
+                ],
+                "purchases": [
+                    {
+                        "name": name,
+                        "total": 5000,
+                        "outstanding": rng.randint(0, 5000),
+                        "price": 1,
+                    }
+                    for name in commodities[10:]
+                ],
+            }
+        },
+        "cargo": [
+            {
+                "commodity": name,
+                "qty": rng.randint(1, 500),
+                "value": 100,
+                "stolen": False,
+                "mission": False,
+            }
+            for name in commodities
+            for _ in range(3)
+        ],
+        "market": {
+            "id": 3700000000 + idx,
+            "services": {"commodities": "ok", "refuel": "ok"},
+        },
+    }
+
+
+def measure(function, repeats=REPEATS) -> dict:
+    """
+    Runs a function several times and records its median wall time, then runs it once more under tracemalloc for
+    its peak allocation.
+    :param function: the function to run, without arguments
+    :param repeats: how many timed runs to take the median of
+    :return: {"seconds": median time, "peak_bytes": peak memory allocated during one run}
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": statistics.median(times), "peak_bytes": peak}
+
+
+class BenchmarkFleet:
+    """
+    A synthetic fleet stored in a throwaway database, with the tracker that would display it.
+    """
+
+    def __init__(self, directory, size, log_handler):
+        self.rng = random.Random(size)
+        self.log_handler = log_handler
+        self.conn = ThreadLocalConnection(
+            log_handler, os.path.join(directory, "bench-" + str(size) + ".db")
+        )
+        self.conn.execute(
+            "CREATE TABLE accounts(name, state, code, challenge, verifier, access_token, refresh_token,"
+            "reauth_required, reauth_prompted, cmdr_data, fc_data, last_fetched)"
+        )
+        self.tracker = EliteDangerousFleetTracker(self.conn, log_handler)
+        self.archive = self.tracker.archive
+        self.change_feed = self.tracker.change_feed
+        cipher = Fernet(FERNET_KEY)
+        self.names = []
+        for idx in range(size):
+            name = "bench" + str(idx)
+            self.names.append(name)
+            self.conn.execute(
+                "insert into accounts values (?,?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    name,
+                    None,
+                    None,
+                    None,
+                    None,
+                    cipher.encrypt(b"access-token"),
+                    cipher.encrypt(b"refresh-token"),
+                    False,
+                    False,
+                    None,
+                    None,
+                    time.time(),
+                ),
+            )
+            for endpoint, document in (
+                (API_CMDR_ENDPOINT, synthetic_cmdr_data(self.rng, idx)),
+                (API_FC_ENDPOINT, synthetic_fc_data(self.rng, idx)),
+            ):
+                content = json.dumps(document).encode("utf8")
+                self.archive.store(
+                    name,
+                    endpoint,
+                    time.time(),
+                    compress_payload(content),
+                    len(content),
+                    payload_digest(content),
+                )
+        self.conn.commit()
+        self.tracker.account_table = self.load_accounts()
+        self.add_history()
+
+    def add_history(self) -> None:
+        """
+        Gives every carrier a month of history in which its balance and fuel change a few times a day, mostly down.
+        """
+        history = self.tracker.history
+        start = time.time() - HISTORY_DAYS * 24 * 60 * 60
+        step = 24 * 60 * 60 / HISTORY_SAMPLES_PER_DAY
+        for name in self.names:
+            balance = self.rng.randint(0, 50000000000)
+            fuel = 1000
+            for sample in range(HISTORY_DAYS * HISTORY_SAMPLES_PER_DAY):
+                balance += self.rng.randint(-10000000, 1000000)
+                fuel = 1000 if fuel < 100 else fuel - self.rng.randint(0, 100)
+                history.append(name, start + sample * step, (balance, fuel))
+        self.conn.commit()
+
+    def load_accounts(self) -> list:
+        return [
+            Account(self.conn, self.log_handler, name, self.archive, self.change_feed)
+            for name in self.names
+        ]
+
+    def gui_tick(self) -> None:
+        """
+        Generates the text of every label in the table from one snapshot per account, as a tick where every account
+        changed would.
+        """
+        tracker = self.tracker
+        for account in tracker.account_table:
+            snapshot = account.snapshot
+            for column in tracker.columns:
+                tracker.generate_dynamic_label_text((None, account, column), snapshot)
+        tracker.sum_liquid_assets(None)
+
+    def sync_all(self) -> None:
+        """
+        Writes every account back to the database with one new payload each, as after a poll where everything
+        changed.
+        """
+        for account in self.tracker.account_table:
+            content = json.dumps({"nonce": self.rng.random()}).encode("utf8")
+            account.pending_payloads.append(
+                (
+                    API_FC_ENDPOINT,
+                    time.time(),
+                    compress_payload(content),
+                    len(content),
+                    payload_digest(content),
+                )
+            )
+            account.sync_to_database()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def run_benchmarks(sizes) -> dict:
+    """
+    Runs every benchmark.
+    :param sizes: fleet sizes to run the per-fleet benchmarks at
+    :return: dict of benchmark name -> measurement
+    """
+    log_handler = logging.NullHandler()
+    results = {}
+    rng = random.Random(0)
+    fc_data = synthetic_fc_data(rng, 0)
+    post_processors = {
+        "ghost_orders": (
+            EliteDangerousFleetTracker.ghost_orders,
+            fc_data["orders"]["commodities"]["sales"],
+        ),
+        "currency_format": (
+            EliteDangerousFleetTracker.currency_format,
+            fc_data["balance"],
+        ),
+        "hex_decode": (
+            EliteDangerousFleetTracker.hex_decode,
+            fc_data["name"]["filteredVanityName"],
+        ),
+        "calculate_tonnage": (
+            EliteDangerousFleetTracker.calculate_tonnage,
+            fc_data["capacity"],
+        ),
+        "ladder_display": (EliteDangerousFleetTracker.ladder_display, "HD 104785"),
+    }
+    for name, (function, value) in post_processors.items():
+        results["post_processor." + name] = measure(
+            lambda: [function(value) for _ in range(POST_PROCESSOR_CALLS)]
+        )
+        print(".", end="", flush=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            fleet = BenchmarkFleet(directory, size, log_handler)
+            try:
+                results["gui_tick[" + str(size) + "]"] = measure(fleet.gui_tick)
+                results["sum_liquid_assets[" + str(size) + "]"] = measure(
+                    lambda: fleet.tracker.sum_liquid_assets(None)
+                )
+                results["projections[" + str(size) + "]"] = measure(
+                    lambda: fleet.tracker.history.project(fleet.names)
+                )
+                results["account_init[" + str(size) + "]"] = measure(
+                    fleet.load_accounts, repeats=3
+                )
+                results["sync_to_database[" + str(size) + "]"] = measure(
+                    fleet.sync_all, repeats=3
+                )
+            finally:
+                fleet.close()
+            print(".", end="", flush=True)
+    print()
+    return results
+
+
+def compare(results, baseline, threshold) -> list:
+    """
+    Compares results against a baseline.
+    :param results: this run's measurements
+    :param baseline: stored measurements
+    :param threshold: allowed relative increase, e.g. 0.25 for 25%
+    :return: list of (benchmark, metric, baseline value, new value) that exceeded the threshold
+    """
+    regressions = []
+    for name, measurement in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in measurement.items():
+            previous = baseline[name].get(metric)
+            if previous and value > previous * (1 + threshold):
+                regressions.append((name, metric, previous, value))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EDFT hot path benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=FLEET_SIZES,
+        help="fleet sizes to benchmark",
+    )
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH, help="baseline file to compare against"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="allowed relative regression, e.g. 0.25 for 25%%",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)
+
+    print(
+        "{0:<34} {1:>12} {2:>12} {3:>14}".format(
+            "benchmark", "ms", "vs baseline", "peak KiB"
+        )
+    )
+    for name, measurement in results.items():
+        change = ""
+        if name in baseline and baseline[name]["seconds"]:
+            change = "{0:+.0%}".format(
+                measurement["seconds"] / baseline[name]["seconds"] - 1
+            )
+        print(
+            "{0:<34} {1:>12.3f} {2:>12} {3:>14,.0f}".format(
+                name,
+                measurement["seconds"] * 1000,
+                change,
+                measurement["peak_bytes"] / 1024,
+            )
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print("baseline saved to " + args.baseline)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, metric, previous, value in regressions:
+        print(
+            "REGRESSION: {0} {1} {2:.6g} -> {3:.6g}".format(
+                name, metric, previous, value
+            )
+        )
+    if not baseline:
+        print(
+            "no baseline at "
+            + args.baseline
+            + "; run with --save-baseline to create one"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from edft_diff import ChangeType, CMDR_ENDPOINT, FC_ENDPOINT, change_event
+from edft_shared_constants import LOCAL_DB_PATH
+
+ALERT_CONFIG_PATH = os.path.join(LOCAL_DB_PATH, "alerts.json")
+
+"""
+Default rule configuration, written to ALERT_CONFIG_PATH on first start so it can be edited. Threshold rules raise when
+the value drops below "threshold" and only clear once it has recovered to "threshold" + "hysteresis", so a value
+hovering around the threshold doesn't flap. "notify_command", if set, is a command line (list of str) that is run with
+the alert message appended whenever an alert is raised, e.g. to show a desktop notification.
+"""
+DEFAULT_ALERT_CONFIG = {
+    "low_fuel": {"enabled": True, "threshold": 200, "hysteresis": 50},
+    "low_balance": {"enabled": True, "threshold": 50000000, "hysteresis": 5000000},
+    "ghost_sells": {"enabled": True},
+    "reauth": {"enabled": True},
+    "notify_command": None,
+}
+
+""" The settings each rule takes besides "enabled", all numbers """
+RULE_SETTINGS = {
+    "low_fuel": ("threshold", "hysteresis"),
+    "low_balance": ("threshold", "hysteresis"),
+    "ghost_sells": (),
+    "reauth": (),
+}
+
+
+def load_alert_config(path=ALERT_CONFIG_PATH) -> dict:
+    """
+    Reads the alert configuration, filling in defaults for anything missing. Writes the defaults out if the file does
+    not exist yet.
+    :param path: the JSON configuration file
+    :return: the configuration dict
+    :raise ValueError: if the file isn't valid JSON or a rule's settings are invalid, see validate_alert_config()
+    """
+    config = json.loads(json.dumps(DEFAULT_ALERT_CONFIG))
+    if os.path.isfile(path):
+        with open(path, encoding="utf8") as f:
+            user_config = json.load(f)
+        if not isinstance(user_config, dict):
+            raise ValueError(path + " must contain an object")
+        for key, value in user_config.items():
+            if isinstance(value, dict) and isinstance(config.get(key), dict):
+                config[key].update(value)
+            else:
+                config[key] = value
+    else:
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(config, f, indent=4)
+    validate_alert_config(config)
+    return config
+
+
+def validate_alert_config(config) -> None:
+    """
+    Checks that every rule in RULE_SETTINGS has an object with a true/false "enabled" and numeric settings, and that
+    "notify_command" is either null or a list of strings.
+    :param config: configuration dict, see DEFAULT_ALERT_CONFIG
+    :raise ValueError: naming the rule (or setting) that is missing or invalid
+    """
+    for name, settings in RULE_SETTINGS.items():
+        entry = config.get(name)
+        if not isinstance(entry, dict):
+            raise ValueError("alert rule " + name + " must be an object")
+        if not isinstance(entry.get("enabled"), bool):
+            raise ValueError("alert rule " + name + " needs enabled: true or false")
+        for setting in settings:
+            value = entry.get(setting)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(
+                    "alert rule " + name + " needs a number for " + setting
+                )
+    command = config.get("notify_command")
+    if command is not None and not (
+        isinstance(command, list) and all(isinstance(arg, str) for arg in command)
+    ):
+        raise ValueError("notify_command must be null or a list of strings")
+
+
+def document_value(event, endpoint, path) -> object:
+    """
+    Gets the current value of a field from an event: the "new" value of a field event, or the field looked up in the
+    document carried by an INITIAL event.
+    :return: the value, or None if the event doesn't concern this field
+    """
+    if event["endpoint"] != endpoint:
+        return None
+    if event["type"] is ChangeType.INITIAL:
+        value = event["new"]
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    if event["path"] == path:
+        return event["new"]
+    return None
+
+
+class ThresholdRule:
+    """
+    Raises while a numeric field is below a threshold, with hysteresis on clearing.
+    """
+
+    def __init__(self, name, change_type, endpoint, path, label, threshold, hysteresis):
+        self.name = name
+        self.change_types = (change_type, ChangeType.INITIAL)
+        self.endpoint = endpoint
+        self.path = path
+        self.label = label
+        self.threshold = threshold
+        self.clear_at = threshold + hysteresis
+
+    def evaluate(self, event, active) -> [bool, str]:
+        """
+        :param event: a change event of one of self.change_types
+        :param active: whether this rule's alert is currently raised for the event's account
+        :return: the new alert state (or None if the event is irrelevant) and the alert message
+        """
+        value = document_value(event, self.endpoint, self.path)
+        if value is None:
+            return None, None
+        value = float(value)
+        message = "{0} {1:0,.0f} (alert below {2:0,.0f})".format(
+            self.label, value, self.threshold
+        )
+        if value < self.threshold:
+            return True, message
+        if value >= self.clear_at:
+            return False, message
+        return active, message
+
+
+class GhostSellsRule:
+    """
+    Raises while the carrier has sell orders with no stock left (see EliteDangerousFleetTracker.ghost_orders). Tracks
+    the affected commodities per account from order events, so only the orders that changed are looked at.
+    """
+
+    name = "ghost_sells"
+    change_types = (
+        ChangeType.INITIAL,
+        ChangeType.ORDER_ADDED,
+        ChangeType.ORDER_FILLED,
+        ChangeType.ORDER_REMOVED,
+        ChangeType.FIELD,
+    )
+    sales_path = ("orders", "commodities", "sales")
+
+    def __init__(self):
+        # Only touched under AlertEngine.lock
+        self.ghosts = {}
+
+    def evaluate(self, event, active) -> [bool, str]:
+        ghosts = self.ghosts.setdefault(event["account"], set())
+        if event["type"] is ChangeType.INITIAL:
+            sales = document_value(event, FC_ENDPOINT, self.sales_path)
+            if sales is None:
+                return None, None
+            ghosts.clear()
+            ghosts.update(s["name"] for s in sales if int(s["stock"]) == 0)
+        elif event["path"][:-1] == self.sales_path:
+            order = event["new"]
+            if order is not None and int(order["stock"]) == 0:
+                ghosts.add(order["name"])
+            else:
+                ghosts.discard(event["path"][-1])
+        else:
+            return None, None
+        return bool(ghosts), "Ghost sells: " + ",".join(
+            str.title(name) for name in sorted(ghosts)
+        )
+
+    def forget(self, account) -> None:
+        self.ghosts.pop(account, None)
+
+
+class ReauthRule:
+    """
+    Raises while an account needs to be reauthorized.
+    """
+
+    name = "reauth"
+    change_types = (ChangeType.AUTH,)
+
+    def evaluate(self, event, active) -> [bool, str]:
+        return bool(event["new"]), "cAPI reauthorization required"
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against the change feed. Rules are built from the configuration once, and indexed by the
+    change types they care about, so each change event only reaches the rules it could affect and the cost of a poll
+    depends on what changed, not on the size of the fleet. Alerts are keyed by account and rule, so a condition that
+    persists across polls is raised once and stays raised until it clears.
+
+    Events arrive from the polling thread, onboarding threads and lease adoption at once, so rules are evaluated and
+    `active` updated under one lock; logging, listeners and the notification command run after it is released.
+    """
+
+    log_handler = None
+
+    def __init__(self, config, change_feed, log_handler):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.notify_command = config.get("notify_command")
+        self.lock = threading.Lock()
+        self.active = {}
+        self.version = 0
+        self.listeners = []
+        self.rules = self.compile(config)
+        self.dispatch = {}
+        for rule in self.rules:
+            for change_type in rule.change_types:
+                self.dispatch.setdefault(change_type, []).append(rule)
+        change_feed.subscribe(self.on_changes, self.dispatch.keys())
+
+    @staticmethod
+    def compile(config) -> list:
+        """
+        Builds the enabled rules from the configuration.
+        :param config: configuration dict, see DEFAULT_ALERT_CONFIG
+        :return: list of rule objects
+        :raise ValueError: naming the rule whose settings are invalid, see validate_alert_config()
+        """
+        validate_alert_config(config)
+        rules = []
+        if config["low_fuel"]["enabled"]:
+            rules.append(
+                ThresholdRule(
+                    "low_fuel",
+                    ChangeType.FUEL,
+                    FC_ENDPOINT,
+                    ("fuel",),
+                    "Fuel",
+                    config["low_fuel"]["threshold"],
+                    config["low_fuel"]["hysteresis"],
+                )
+            )
+        if config["low_balance"]["enabled"]:
+            rules.append(
+                ThresholdRule(
+                    "low_balance",
+                    ChangeType.CARRIER_BALANCE,
+                    FC_ENDPOINT,
+                    ("balance",),
+                    "Carrier balance",
+                    config["low_balance"]["threshold"],
+                    config["low_balance"]["hysteresis"],
+                )
+            )
+        if config["ghost_sells"]["enabled"]:
+            rules.append(GhostSellsRule())
+        if config["reauth"]["enabled"]:
+            rules.append(ReauthRule())
+        return rules
+
+    def seed(self, accounts) -> None:
+        """
+        Evaluates every rule once against accounts loaded from disk, which never published an INITIAL event.
+        :param accounts: the account table
+        """
+        events = []
+        for account in accounts:
+            snapshot = account.snapshot
+            for endpoint, document in (
+                (CMDR_ENDPOINT, snapshot.cmdr_data),
+                (FC_ENDPOINT, snapshot.fc_data),
+            ):
+                if document:
+                    events.append(
+                        change_event(
+                            ChangeType.INITIAL,
+                            account.name,
+                            endpoint,
+                            (),
+                            None,
+                            document,
+                        )
+                    )
+            if snapshot.reauth_required:
+                events.append(
+                    change_event(
+                        ChangeType.AUTH,
+                        account.name,
+                        None,
+                        ("reauth_required",),
+                        False,
+                        True,
+                    )
+                )
+        self.on_changes(events)
+
+    def on_changes(self, events) -> None:
+        """
+        Change feed subscriber: runs the rules interested in each event and raises or clears alerts accordingly.
+        :param events: list of change events
+        """
+        raised = []
+        cleared = []
+        with self.lock:
+            for event in events:
+                for rule in self.dispatch.get(event["type"], ()):
+                    key = (event["account"], rule.name)
+                    state, message = rule.evaluate(event, key in self.active)
+                    if state is None:
+                        continue
+                    if state and key not in self.active:
+                        self.active[key] = {
+                            "account": key[0],
+                            "rule": key[1],
+                            "message": message,
+                            "raised_at": time.time(),
+                        }
+                        raised.append(self.active[key])
+                    elif state and self.active[key]["message"] != message:
+                        self.active[key] = dict(self.active[key], message=message)
+                    elif not state and key in self.active:
+                        del self.active[key]
+                        cleared.append(key)
+                    else:
+                        continue
+                    self.version += 1
+        for alert in raised:
+            self.announce(alert)
+        for account, rule in cleared:
+            self.logger.info("alert cleared: %s", rule, extra={"account": account})
+
+    def announce(self, alert) -> None:
+        """
+        Logs a newly raised alert, and passes it to the listeners and the notification command.
+        :param alert: the alert dict
+        """
+        self.logger.info(
+            "alert raised: %s", alert["message"], extra={"account": alert["account"]}
+        )
+        for listener in self.listeners:
+            listener(alert)
+        if self.notify_command:
+            try:
+                subprocess.Popen(
+                    list(self.notify_command)
+                    + [alert["account"] + ": " + alert["message"]]
+                )
+            except OSError:
+                self.logger.exception("alert notification command failed")
+
+    def add_listener(self, callback) -> None:
+        """
+        Registers a callback to be run with the alert dict whenever an alert is raised.
+        :param callback: function taking one argument
+        """
+        self.listeners.append(callback)
+
+    def forget(self, account) -> None:
+        """
+        Drops all alerts and rule state for an account that has been removed.
+        :param account: the account name
+        """
+        with self.lock:
+            for key in [key for key in self.active if key[0] == account]:
+                del self.active[key]
+            self.version += 1
+            for rule in self.rules:
+                if hasattr(rule, "forget"):
+                    rule.forget(account)
+
+    def active_alerts(self) -> list:
+        """
+        :return: the currently raised alerts, oldest first
+        """
+        with self.lock:
+            return sorted(self.active.values(), key=lambda alert: alert["raised_at"])
@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from edft_metrics import REGISTRY
+from edft_shared_constants import API_SERVER_HOST, API_SERVER_PORT
+
+FLEET_PATHS = ("/", "/fleet")
+METRICS_PATH = "/metrics"
+
+
+class FleetStateServer:
+    """
+    A local, read-only HTTP endpoint that serves the in-memory fleet state as JSON. Only the collector talks to cAPI;
+    dashboards and bots poll this instead. The response body is serialized (and gzipped) once per fleet state version
+    and reused for every request until the state changes, so polling is cheap no matter how many consumers there are.
+    """
+
+    instance = None
+    log_handler = None
+    httpd = None
+    thread = None
+    cached_version = None
+    cached_body = None
+    cached_gzip = None
+    cached_etag = None
+
+    def __init__(
+        self, instance, log_handler, host=API_SERVER_HOST, port=API_SERVER_PORT
+    ):
+        self.instance = instance
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.cache_lock = threading.Lock()
+
+    def start(self) -> bool:
+        """
+        Binds the listening socket and starts serving on a daemon thread.
+        :return: True if the server is running, False if the socket could not be bound (e.g. port already in use).
+        """
+        try:
+            self.httpd = ThreadingHTTPServer(
+                (self.host, self.port), self._make_handler()
+            )
+        except OSError:
+            self.logger.exception(
+                "could not start fleet state server on port %s", self.port
+            )
+            return False
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        self.logger.info("fleet state server listening on %s:%s", self.host, self.port)
+        return True
+
+    def stop(self) -> None:
+        """
+        Stops serving and closes the listening socket.
+        """
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def representation(self) -> [bytes, bytes, str]:
+        """
+        Returns the serialized fleet state, regenerating it only when the fleet state version has changed since the
+        last call.
+        :return: the identity-encoded body, the gzip-encoded body, and the ETag for this version.
+        """
+        with self.cache_lock:
+            version = self.instance.fleet_state_version()
+            if version != self.cached_version:
+                state = self.instance.export_fleet_state()
+                body = json.dumps(state, separators=(",", ":")).encode("utf8")
+                self.cached_body = body
+                self.cached_gzip = gzip.compress(body)
+                self.cached_etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                self.cached_version = version
+            return self.cached_body, self.cached_gzip, self.cached_etag
+
+    def _make_handler(self) -> type:
+        """
+        Creates the request handler class bound to this server instance.
+        :return: a BaseHTTPRequestHandler subclass
+        """
+        server = self
+
+        class FleetStateRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                self.respond(include_body=True)
+
+            def do_HEAD(self) -> None:
+                self.respond(include_body=False)
+
+            def respond(self, include_body) -> None:
+                path = self.path.split("?")[0]
+                if path == METRICS_PATH:
+                    self.respond_metrics(include_body)
+                    return
+                if path not in FLEET_PATHS:
+                    self.send_error(404)
+                    return
+                body, gzipped, etag = server.representation()
+                if etag_matches(self.headers.get("If-None-Match"), etag):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("ETag", etag)
+                self.send_header("Vary", "Accept-Encoding")
+                if accepts_gzip(self.headers.get("Accept-Encoding")):
+                    body = gzipped
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+
+            def respond_metrics(self, include_body) -> None:
+                body = REGISTRY.render_prometheus().encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                # The default implementation writes to stderr, which doesn't exist in the frozen windowed build.
+                server.logger.debug("%s - " + format, self.address_string(), *args)
+
+        return FleetStateRequestHandler
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    """
+    Checks an If-None-Match request header against the current ETag.
+    :param if_none_match: the raw header value, or None if the client didn't send one
+    :param etag: the current (quoted) ETag
+    :return: True if the client's cached copy is still current
+    """
+    if if_none_match is None:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or "W/" + etag in candidates
+
+
+def accepts_gzip(accept_encoding) -> bool:
+    """
+    Checks whether the client will accept a gzip-encoded response.
+    :param accept_encoding: the raw Accept-Encoding header value, or None if the client didn't send one
+    :return: True if gzip is acceptable
+    """
+    if accept_encoding is None:
+        return False
+    for coding in accept_encoding.split(","):
+        parts = coding.strip().split(";")
+        if parts[0].strip().lower() == "gzip":
+            return not any(
+                param.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+                for param in parts[1:]
+            )
+    return False
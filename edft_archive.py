@@ -0,0 +1,208 @@
+import hashlib
+import logging
+import time
+import zlib
+
+ARCHIVE_CODEC = "zlib"
+ARCHIVE_COMPRESSION_LEVEL = 9
+ARCHIVE_RETENTION_DAYS = 180
+
+
+def payload_digest(content) -> str:
+    """
+    Computes the content address of a raw cAPI response body.
+    :param content: the raw response body
+    :return: hex-encoded SHA-256 digest
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def compress_payload(content) -> bytes:
+    """
+    Compresses a raw cAPI response body with the archive codec. Kept separate from PayloadArchive.store() so the
+    compression can be done wherever the payload is received rather than on the thread that writes the database.
+    :param content: the raw response body
+    :return: the compressed body
+    """
+    return zlib.compress(content, ARCHIVE_COMPRESSION_LEVEL)
+
+
+class PayloadArchive:
+    """
+    A content-addressed archive of raw cAPI responses, stored alongside the accounts table.
+
+    Bodies are compressed and stored once per distinct digest in `payload_blobs`; `payload_index` records which digest
+    each account/endpoint returned and when. A payload identical to the previous one for the same account and endpoint
+    is not recorded at all, so the index only grows when something actually changed. Looking up "the payload as of
+    time t" therefore means finding the newest index entry at or before t.
+    """
+
+    conn = None
+    log_handler = None
+
+    def __init__(self, conn, log_handler):
+        self.conn = conn
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.latest = {}
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS payload_blobs(digest TEXT PRIMARY KEY, codec, raw_size, data)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS payload_index(account, endpoint, fetched_at, digest)"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS payload_index_lookup ON payload_index(account, endpoint, fetched_at)"
+        )
+        self.conn.commit()
+
+    def latest_digest(self, account, endpoint) -> str:
+        """
+        Returns the digest of the most recently archived payload for an account/endpoint, cached after the first call.
+        :param account: the account name
+        :param endpoint: the cAPI endpoint, e.g. API_FC_ENDPOINT
+        :return: the digest, or None if nothing has been archived yet
+        """
+        key = (account, endpoint)
+        if key not in self.latest:
+            row = (
+                self.conn.cursor()
+                .execute(
+                    "select digest from payload_index where account=? and endpoint=? "
+                    "order by fetched_at desc limit 1",
+                    key,
+                )
+                .fetchone()
+            )
+            self.latest[key] = row[0] if row is not None else None
+        return self.latest[key]
+
+    def store(
+        self, account, endpoint, fetched_at, compressed, raw_size, digest
+    ) -> bool:
+        """
+        Archives a payload. Does not commit; the caller commits alongside its own writes.
+        :param account: the account name
+        :param endpoint: the cAPI endpoint the payload came from
+        :param fetched_at: when the payload was fetched (epoch seconds)
+        :param compressed: the response body, as returned by compress_payload()
+        :param raw_size: the size of the uncompressed body
+        :param digest: payload_digest() of the uncompressed body
+        :return: True if anything was written, False if the payload was identical to the previous one
+        """
+        if digest == self.latest_digest(account, endpoint):
+            return False
+        cur = self.conn.cursor()
+        exists = cur.execute(
+            "select 1 from payload_blobs where digest=?", (digest,)
+        ).fetchone()
+        if exists is None:
+            cur.execute(
+                "insert into payload_blobs values (?,?,?,?)",
+                (digest, ARCHIVE_CODEC, raw_size, compressed),
+            )
+        cur.execute(
+            "insert into payload_index values (?,?,?,?)",
+            (account, endpoint, fetched_at, digest),
+        )
+        self.latest[(account, endpoint)] = digest
+        return True
+
+    def get(self, account, endpoint, at=None) -> [float, bytes]:
+        """
+        Retrieves the payload an account/endpoint was returning at a given time.
+        :param account: the account name
+        :param endpoint: the cAPI endpoint
+        :param at: epoch seconds; None for the most recent payload
+        :return: when that payload was first fetched and its raw body, or (None, None) if nothing was archived by then
+        """
+        row = (
+            self.conn.cursor()
+            .execute(
+                "select i.fetched_at, b.codec, b.data from payload_index i "
+                "join payload_blobs b on b.digest = i.digest "
+                "where i.account=? and i.endpoint=? and i.fetched_at<=? "
+                "order by i.fetched_at desc limit 1",
+                (account, endpoint, at if at is not None else float("inf")),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None, None
+        return row[0], decompress(row[1], row[2])
+
+    def history(self, account, endpoint, since=0, until=None) -> list:
+        """
+        Lists the archived changes for an account/endpoint within a time range.
+        :param account: the account name
+        :param endpoint: the cAPI endpoint
+        :param since: epoch seconds, inclusive
+        :param until: epoch seconds, inclusive; None for no upper bound
+        :return: list of (fetched_at, digest) in chronological order
+        """
+        return (
+            self.conn.cursor()
+            .execute(
+                "select fetched_at, digest from payload_index "
+                "where account=? and endpoint=? and fetched_at>=? and fetched_at<=? order by fetched_at",
+                (
+                    account,
+                    endpoint,
+                    since,
+                    until if until is not None else float("inf"),
+                ),
+            )
+            .fetchall()
+        )
+
+    def forget(self, account) -> None:
+        """
+        Removes every index entry for an account. Orphaned blobs are cleaned up by the next prune(). Does not commit.
+        :param account: the account name
+        """
+        self.conn.cursor().execute(
+            "delete from payload_index where account=?", (account,)
+        )
+        for key in [key for key in self.latest if key[0] == account]:
+            del self.latest[key]
+
+    def prune(self, retention_days=ARCHIVE_RETENTION_DAYS) -> int:
+        """
+        Applies the retention policy: drops index entries older than the retention window, except the newest entry for
+        each account/endpoint (which is still the current state), then deletes blobs no longer referenced.
+        :param retention_days: how many days of history to keep
+        :return: the number of index entries removed
+        """
+        cutoff = time.time() - retention_days * 24 * 60 * 60
+        cur = self.conn.cursor()
+        cur.execute(
+            "delete from payload_index where fetched_at < ? and rowid not in "
+            "(select rowid from payload_index i where fetched_at = "
+            "(select max(fetched_at) from payload_index j where j.account = i.account and j.endpoint = i.endpoint))",
+            (cutoff,),
+        )
+        removed = cur.rowcount
+        cur.execute(
+            "delete from payload_blobs where digest not in (select digest from payload_index)"
+        )
+        self.conn.commit()
+        if removed:
+            self.logger.info("pruned %s archived payloads", removed)
+        return removed
+
+
+def decompress(codec, data) -> bytes:
+    """
+    Decompresses a stored blob.
+    :param codec: the codec recorded with the blob
+    :param data: the compressed bytes
+    :return: the raw payload
+    """
+    match codec:
+        case "zlib":
+            return zlib.decompress(data)
+        case _:
+            raise ValueError("unknown archive codec: " + str(codec))
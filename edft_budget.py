@@ -0,0 +1,245 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from edft_shared_constants import (
+    CAPI_HOST_BUDGET,
+    CAPI_TOKEN_BUDGET,
+    MIN_REFRESH_INTERVAL,
+)
+
+""" Length of the sliding windows requests are counted over, in seconds; the budgets are per window """
+BUDGET_WINDOW = 60
+""" Fraction of each budget the planner lets the fleet use, leaving the rest for reauthorizations, retries and
+jitter """
+BUDGET_SAFETY = 0.8
+""" Longest refresh interval the planner will stretch to, in seconds """
+MAX_REFRESH_INTERVAL = 3600
+""" Requests a poll makes when nothing has been measured yet: the commander and fleet carrier endpoints """
+POLL_REQUESTS = 2
+""" Weight of the newest measurement in the running averages of poll duration and cycle time """
+SMOOTHING = 0.2
+""" Relative change below which the planned interval is left as it is, so the schedule doesn't churn """
+PLAN_TOLERANCE = 0.05
+
+
+class SlidingWindow:
+    """
+    Counts events over the last `window` seconds. Timestamps are kept in arrival order, so expiring the old ones only
+    ever looks at the front of the queue.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.times = deque()
+
+    def add(self, now) -> None:
+        self.times.append(now)
+
+    def count(self, now) -> int:
+        while self.times and self.times[0] <= now - self.window:
+            self.times.popleft()
+        return len(self.times)
+
+
+def smooth(average, value) -> float:
+    return value if average is None else average + SMOOTHING * (value - average)
+
+
+class RequestBudget:
+    """
+    Accounts for cAPI requests against Frontier's limits, and plans the refresh interval to fit the fleet into them.
+    Requests are counted over sliding windows per host and per token (i.e. per account, as each has one token at a
+    time), and each batch of polls is timed, which gives the time a full refresh cycle of the fleet takes.
+
+    From that, plan() works out the shortest refresh interval (the largest fleet-wide request rate) that keeps within
+    BUDGET_SAFETY of the host budget and of every token's budget, and that a refresh cycle actually fits into; within
+    MIN_REFRESH_INTERVAL and MAX_REFRESH_INTERVAL. Requests are recorded from the polling thread (and for onboarding,
+    from its pool) and read from the GUI, so everything is guarded by one lock.
+    """
+
+    host_budget = 0
+    token_budget = 0
+    poll_seconds = None
+    observed_cycle = None
+    interval = None
+    limit = None
+    latest = None
+
+    def __init__(
+        self,
+        host_budget=CAPI_HOST_BUDGET,
+        token_budget=CAPI_TOKEN_BUDGET,
+        window=BUDGET_WINDOW,
+        min_interval=MIN_REFRESH_INTERVAL,
+    ):
+        """
+        :param host_budget: requests allowed per host per window
+        :param token_budget: requests allowed per token per window
+        :param window: the window length, in seconds
+        :param min_interval: the shortest refresh interval to plan, in seconds
+        """
+        self.host_budget = host_budget
+        self.token_budget = token_budget
+        self.window = window
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.hosts = defaultdict(lambda: SlidingWindow(self.window))
+        self.tokens = defaultdict(lambda: SlidingWindow(self.window))
+        self.requests = SlidingWindow(self.window)
+        self.polls = SlidingWindow(self.window)
+        self.last_polled = {}
+
+    def record(self, host, token, now=None) -> None:
+        """
+        Counts one request.
+        :param host: the host it was sent to
+        :param token: what identifies the token it was made with (the account name)
+        :param now: when it was made (epoch seconds); defaults to now
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.hosts[host].add(now)
+            self.tokens[token].add(now)
+            self.requests.add(now)
+
+    def polled(self, names, seconds, parallelism=1, now=None) -> None:
+        """
+        Records a batch of polls, to measure how long polling an account takes and how often each account actually
+        gets polled.
+        :param names: the names of the accounts polled
+        :param seconds: how long the whole batch took
+        :param parallelism: how many accounts were polled at once (the number of collector processes, or 1)
+        :param now: when the batch finished (epoch seconds); defaults to now
+        """
+        if not names:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            self.poll_seconds = smooth(
+                self.poll_seconds, seconds * min(parallelism, len(names)) / len(names)
+            )
+            for name in names:
+                self.polls.add(now)
+                previous = self.last_polled.get(name)
+                if previous is not None:
+                    self.observed_cycle = smooth(self.observed_cycle, now - previous)
+                self.last_polled[name] = now
+
+    def usage(self, now=None) -> dict:
+        """
+        :return: dict with the requests in the current window per host ("hosts"), the busiest token's ("peak_token"),
+        and the average requests per poll ("per_poll")
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            hosts = {host: window.count(now) for host, window in self.hosts.items()}
+            peak_token = max(
+                (window.count(now) for window in self.tokens.values()), default=0
+            )
+            polls = self.polls.count(now)
+            requests = self.requests.count(now)
+        return {
+            "hosts": hosts,
+            "peak_token": peak_token,
+            "per_poll": requests / polls if polls else float(POLL_REQUESTS),
+        }
+
+    def plan(self, accounts, parallelism=1, now=None, instances=1) -> dict:
+        """
+        Plans the refresh interval for the fleet, and updates `interval` (and the `limit` that set it) if it has moved
+        by more than PLAN_TOLERANCE. What is returned describes the interval actually kept.
+        :param accounts: how many accounts are being polled
+        :param parallelism: how many accounts are polled at once
+        :param now: the current time (epoch seconds); defaults to now
+        :param instances: how many EDFT instances share the fleet (see edft_leases); each gets an equal part of the host
+        budget, as they all send requests to the same hosts
+        :return: dict with the planned "interval", the "projected_cycle" time a full cycle takes at the measured poll
+        duration, the "observed_cycle" time between polls of the same account, the "headroom" left in the tightest
+        budget at the planned interval (0 to 1), the budget that sets the interval ("limit": host, token, cycle,
+        minimum or maximum), the "host_budget" share it was planned against, and the current "usage". Also kept as
+        `latest`, for the GUI.
+        """
+        usage = self.usage(now)
+        per_poll = max(usage["per_poll"], 1.0)
+        host_budget = self.host_budget / max(instances, 1)
+        with self.lock:
+            poll_seconds = self.poll_seconds
+            observed_cycle = self.observed_cycle
+        projected_cycle = (
+            accounts * poll_seconds / max(parallelism, 1)
+            if poll_seconds is not None
+            else None
+        )
+        bounds = {
+            "minimum": self.min_interval,
+            "host": accounts * per_poll * self.window / (BUDGET_SAFETY * host_budget),
+            "token": per_poll * self.window / (BUDGET_SAFETY * self.token_budget),
+            "cycle": (projected_cycle or 0) / BUDGET_SAFETY,
+        }
+        limit = max(bounds, key=bounds.get)
+        interval = bounds[limit]
+        if interval > MAX_REFRESH_INTERVAL:
+            limit, interval = "maximum", MAX_REFRESH_INTERVAL
+        with self.lock:
+            if (
+                self.interval is None
+                or abs(interval - self.interval) > PLAN_TOLERANCE * self.interval
+            ):
+                self.interval, self.limit = interval, limit
+            interval, limit = self.interval, self.limit
+        used = max(
+            accounts * per_poll * self.window / (interval * host_budget),
+            per_poll * self.window / (interval * self.token_budget),
+            (projected_cycle or 0) / interval,
+        )
+        self.latest = {
+            "interval": interval,
+            "projected_cycle": projected_cycle,
+            "observed_cycle": observed_cycle,
+            "headroom": max(0.0, 1.0 - used),
+            "limit": limit,
+            "accounts": accounts,
+            "host_budget": host_budget,
+            "usage": usage,
+        }
+        return self.latest
+
+    def status(self, plan) -> str:
+        """
+        :param plan: a plan returned by plan()
+        :return: a one-line summary of it, for the GUI
+        """
+        return "Refresh every {0} s ({1}); cycle {2} s projected, {3} s observed; {4}% headroom".format(
+            math.ceil(plan["interval"]),
+            plan["limit"],
+            "-" if plan["projected_cycle"] is None else round(plan["projected_cycle"]),
+            "-" if plan["observed_cycle"] is None else round(plan["observed_cycle"]),
+            round(plan["headroom"] * 100),
+        )
+
+    def usage_lines(self, plan) -> list:
+        """
+        :param plan: a plan returned by plan()
+        :return: list of str describing the current window, for the Diagnostics tab
+        """
+        lines = [self.status(plan)]
+        for host, count in sorted(plan["usage"]["hosts"].items()):
+            lines.append(
+                "{0}: {1} of {2} requests in the last {3} s".format(
+                    host, count, round(plan["host_budget"]), self.window
+                )
+            )
+        lines.append(
+            "busiest token: {0} of {1} requests in the last {2} s; {3:.1f} requests per poll".format(
+                plan["usage"]["peak_token"],
+                self.token_budget,
+                self.window,
+                plan["usage"]["per_poll"],
+            )
+        )
+        return lines
+
+
+""" The application-wide request budget """
+BUDGET = RequestBudget()
@@ -0,0 +1,71 @@
+import logging
+import os
+import sqlite3
+import threading
+from edft_shared_constants import LOCAL_DB_PATH
+
+DB_PATH = os.path.join(LOCAL_DB_PATH, "edft.db")
+DB_BUSY_TIMEOUT = 10
+
+
+class ThreadLocalConnection:
+    """
+    Stands in for a sqlite3.Connection wherever one is passed around (the main class, Account, PayloadArchive), but
+    gives every thread its own underlying connection, opened the first time that thread touches the database. No
+    connection is ever shared between threads, so the GUI, the poller and any worker threads can all use the database
+    without coordinating with each other; SQLite's write-ahead log lets readers carry on while one of them writes.
+    """
+
+    log_handler = None
+    path = None
+
+    def __init__(self, log_handler, path=DB_PATH):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Returns the calling thread's connection, opening it if necessary.
+        :return: a connection only ever used by the calling thread
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # check_same_thread is off only so close() can clean up at shutdown; the connection is never shared
+            conn = sqlite3.connect(
+                self.path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+            self.logger.debug(
+                "opened database connection for thread %s",
+                threading.current_thread().name,
+            )
+        return conn
+
+    def cursor(self) -> sqlite3.Cursor:
+        return self.connection().cursor()
+
+    def execute(self, sql, parameters=()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, parameters)
+
+    def commit(self) -> None:
+        self.connection().commit()
+
+    def close(self) -> None:
+        """
+        Commits and closes every thread's connection. Only call this once all the threads using it have finished.
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.commit()
+            conn.close()
+        self.local = threading.local()
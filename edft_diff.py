@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+from enum import Enum
+
+
+class ChangeType(Enum):
+    INITIAL = 0
+    FIELD = 1
+    FUEL = 2
+    CARRIER_BALANCE = 3
+    CMDR_BALANCE = 4
+    JUMP = 5
+    LOCATION = 6
+    CARGO = 7
+    ORDER_ADDED = 8
+    ORDER_REMOVED = 9
+    ORDER_FILLED = 10
+    AUTH = 11
+
+
+""" Endpoints, duplicated from Account to avoid a circular import """
+CMDR_ENDPOINT = "/profile"
+FC_ENDPOINT = "/fleetcarrier"
+
+""" Fields that get their own ChangeType rather than ChangeType.FIELD, per endpoint """
+TYPED_PATHS = {
+    CMDR_ENDPOINT: {
+        ("commander", "credits"): ChangeType.CMDR_BALANCE,
+        ("ship", "starsystem", "name"): ChangeType.LOCATION,
+        ("ship", "station", "name"): ChangeType.LOCATION,
+    },
+    FC_ENDPOINT: {
+        ("fuel",): ChangeType.FUEL,
+        ("balance",): ChangeType.CARRIER_BALANCE,
+        ("currentStarSystem",): ChangeType.JUMP,
+    },
+}
+
+""" Subtrees with dedicated diff logic, skipped by the generic field diff """
+CARGO_PATH = ("cargo",)
+ORDERS_PATH = ("orders",)
+
+""" Everything the diff engine needs from each document; collector workers must keep at least these """
+DIFF_PATHS = {
+    CMDR_ENDPOINT: [
+        ("commander", "credits"),
+        ("ship", "starsystem"),
+        ("ship", "station"),
+    ],
+    FC_ENDPOINT: [
+        ("fuel",),
+        ("balance",),
+        ("currentStarSystem",),
+        ("capacity",),
+        CARGO_PATH,
+        ORDERS_PATH,
+    ],
+}
+
+""" Order book sides, and the quantity field that decreases as each kind of order is filled """
+ORDER_SIDES = {"sales": "stock", "purchases": "outstanding"}
+
+
+def change_event(change_type, account, endpoint, path, old, new) -> dict:
+    """
+    Creates a change event. Follows the same plain-dict pattern as the column specs.
+    :param change_type: a ChangeType
+    :param account: the name of the account the change belongs to
+    :param endpoint: the cAPI endpoint whose document changed, or None for changes to the account itself
+    :param path: tuple of keys locating the changed value in the document (for orders and cargo, the commodity name
+    is appended)
+    :param old: the previous value, or None if it was absent
+    :param new: the new value, or None if it is now absent
+    :return: the event dict. "delta" holds new - old when both are numeric, otherwise None.
+    """
+    try:
+        delta = float(new) - float(old)
+    except (TypeError, ValueError):
+        delta = None
+    return {
+        "type": change_type,
+        "account": account,
+        "endpoint": endpoint,
+        "path": path,
+        "old": old,
+        "new": new,
+        "delta": delta,
+        "timestamp": time.time(),
+    }
+
+
+def diff_payload(account, endpoint, old, new) -> list:
+    """
+    Compares two successive documents from the same account and endpoint.
+
+    The first document for an account produces a single INITIAL event carrying the whole document as "new", rather
+    than one event per field.
+
+    Keys missing from the new document are not reported: collector workers may send back a projection of the document
+    rather than all of it, and a field disappearing from a cAPI response is not interesting in itself.
+    :param account: the account name
+    :param endpoint: API_CMDR_ENDPOINT or API_FC_ENDPOINT
+    :param old: the previous document; None or empty if this is the first one
+    :param new: the new document
+    :return: list of change events, empty if nothing changed
+    """
+    if not old:
+        return [change_event(ChangeType.INITIAL, account, endpoint, (), None, new)]
+    events = []
+    typed = TYPED_PATHS.get(endpoint, {})
+    diff_fields(account, endpoint, typed, (), old, new, events)
+    if endpoint == FC_ENDPOINT:
+        if CARGO_PATH[0] in new:
+            diff_cargo(account, old.get(CARGO_PATH[0]), new[CARGO_PATH[0]], events)
+        if ORDERS_PATH[0] in new:
+            diff_orders(account, old.get(ORDERS_PATH[0]), new[ORDERS_PATH[0]], events)
+    return events
+
+
+def diff_fields(account, endpoint, typed, path, old, new, events) -> None:
+    """
+    Recursively compares two dicts, appending an event for each changed value. Lists are compared as a whole.
+    """
+    for key, new_value in new.items():
+        key_path = path + (key,)
+        if endpoint == FC_ENDPOINT and key_path in (CARGO_PATH, ORDERS_PATH):
+            continue
+        old_value = old.get(key) if isinstance(old, dict) else None
+        if old_value == new_value:
+            continue
+        if isinstance(new_value, dict) and isinstance(old_value, dict):
+            diff_fields(
+                account, endpoint, typed, key_path, old_value, new_value, events
+            )
+        else:
+            events.append(
+                change_event(
+                    typed.get(key_path, ChangeType.FIELD),
+                    account,
+                    endpoint,
+                    key_path,
+                    old_value,
+                    new_value,
+                )
+            )
+
+
+def cargo_totals(cargo) -> dict:
+    """
+    Sums carrier cargo quantities by commodity. The cAPI cargo list can hold several stacks of the same commodity.
+    """
+    totals = {}
+    for stack in cargo or []:
+        name = stack.get("commodity")
+        totals[name] = totals.get(name, 0) + int(stack.get("qty", 0))
+    return totals
+
+
+def diff_cargo(account, old, new, events) -> None:
+    """
+    Appends a CARGO event for each commodity whose total quantity aboard changed.
+    """
+    old_totals = cargo_totals(old)
+    new_totals = cargo_totals(new)
+    for name in old_totals.keys() | new_totals.keys():
+        if old_totals.get(name, 0) != new_totals.get(name, 0):
+            events.append(
+                change_event(
+                    ChangeType.CARGO,
+                    account,
+                    FC_ENDPOINT,
+                    CARGO_PATH + (name,),
+                    old_totals.get(name, 0),
+                    new_totals.get(name, 0),
+                )
+            )
+
+
+def diff_orders(account, old, new, events) -> None:
+    """
+    Compares the carrier's commodity order book. Orders are matched by side and commodity name; an order whose
+    remaining quantity went down is reported as filled, any other change to an existing order as a field change.
+    """
+    old_commodities = (old or {}).get("commodities") or {}
+    new_commodities = (new or {}).get("commodities") or {}
+    for side, quantity_key in ORDER_SIDES.items():
+        old_orders = {o["name"]: o for o in old_commodities.get(side) or []}
+        new_orders = {o["name"]: o for o in new_commodities.get(side) or []}
+        path = ORDERS_PATH + ("commodities", side)
+        for name, order in new_orders.items():
+            previous = old_orders.get(name)
+            if previous is None:
+                change_type = ChangeType.ORDER_ADDED
+            elif previous == order:
+                continue
+            elif int(order.get(quantity_key, 0)) < int(previous.get(quantity_key, 0)):
+                change_type = ChangeType.ORDER_FILLED
+            else:
+                change_type = ChangeType.FIELD
+            events.append(
+                change_event(
+                    change_type, account, FC_ENDPOINT, path + (name,), previous, order
+                )
+            )
+        for name in old_orders.keys() - new_orders.keys():
+            events.append(
+                change_event(
+                    ChangeType.ORDER_REMOVED,
+                    account,
+                    FC_ENDPOINT,
+                    path + (name,),
+                    old_orders[name],
+                    None,
+                )
+            )
+
+
+class ChangeFeed:
+    """
+    In-process publish/subscribe feed of change events. Subscribers are called synchronously on the publishing thread
+    (usually the polling thread), with a list of the events from one document update that match their filter, so they
+    should do little more than note what changed.
+    """
+
+    log_handler = None
+
+    def __init__(self, log_handler):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.next_token = 0
+
+    def subscribe(self, callback, change_types=None) -> int:
+        """
+        Registers a subscriber.
+        :param callback: called with a list of change events
+        :param change_types: iterable of ChangeTypes to receive, or None for all
+        :return: a token for unsubscribe()
+        """
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.subscribers[token] = (
+                callback,
+                frozenset(change_types) if change_types is not None else None,
+            )
+        return token
+
+    def unsubscribe(self, token) -> None:
+        """
+        Removes a subscriber.
+        :param token: the token returned by subscribe()
+        """
+        with self.lock:
+            self.subscribers.pop(token, None)
+
+    def publish(self, events) -> None:
+        """
+        Delivers events to every interested subscriber. A failing subscriber is logged and does not affect the others.
+        :param events: list of change events
+        """
+        if not events:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for callback, change_types in subscribers:
+            if change_types is None:
+                selected = events
+            else:
+                selected = [e for e in events if e["type"] in change_types]
+            if not selected:
+                continue
+            try:
+                callback(selected)
+            except Exception:
+                self.logger.exception("change feed subscriber failed")
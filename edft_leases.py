@@ -0,0 +1,520 @@
+import json
+import logging
+import math
+import socket
+import threading
+import uuid
+import zlib
+from edft_db import DB_PATH, ThreadLocalConnection
+from edft_shared_constants import LEASE_STORE
+
+LEASE_DURATION = 90
+LEASE_CHECK_INTERVAL = 10
+
+
+def shared_state(snapshot, projection_paths=None) -> dict:
+    """
+    Flattens the parts of an account snapshot other instances take over into a JSON-serializable dict. Tokens are
+    shared only as the ciphertext stored in the database, never in the clear, and documents only as the parts the
+    other instances display, as collector workers send them back.
+    :param snapshot: an AccountSnapshot
+    :param projection_paths: dict of endpoint -> key tuples to keep (see EliteDangerousFleetTracker.projection_paths());
+    None to share whole documents
+    :return: the state dict, see Account.apply_shared_state()
+    """
+    documents = {"cmdr_data": snapshot.cmdr_data, "fc_data": snapshot.fc_data}
+    if projection_paths is not None:
+        # Imported here: collector workers pull in the whole cAPI client, which the stores themselves don't need
+        from edft_workers import project
+        from Account import API_CMDR_ENDPOINT, API_FC_ENDPOINT
+
+        for field, endpoint in (
+            ("cmdr_data", API_CMDR_ENDPOINT),
+            ("fc_data", API_FC_ENDPOINT),
+        ):
+            if documents[field] is not None:
+                documents[field] = project(documents[field], projection_paths[endpoint])
+    return {
+        "fetched_at": snapshot.last_fetched,
+        "reauth_required": snapshot.reauth_required,
+        "token_ciphertext": (
+            [token.decode("ascii") for token in snapshot.token_ciphertext]
+            if snapshot.token_ciphertext is not None
+            else None
+        ),
+        **documents,
+    }
+
+
+def shared_fields(snapshot) -> tuple:
+    """
+    :return: the parts of a snapshot that, when any of them is replaced, make its shared state worth publishing again.
+    Fetch times change with every poll, so they are published on their own.
+    """
+    return (
+        snapshot.cmdr_data,
+        snapshot.fc_data,
+        snapshot.token_ciphertext,
+        snapshot.reauth_required,
+    )
+
+
+class LocalLeaseStore:
+    """
+    An in-memory lease store, for a single instance that shares its accounts with nobody. It is also the reference for
+    what any other store (e.g. a networked one) has to provide: every method is atomic with respect to the others.
+    Times are epoch seconds, passed in by the caller so all decisions in one claim use the same clock reading.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.holders = {}
+        self.lease_table = {}
+        self.states = {}
+        self.sequence = 0
+
+    def heartbeat(self, holder, name, expires_at) -> None:
+        """
+        Announces that an instance is alive until expires_at, so the others count it when sharing out accounts.
+        """
+        with self.lock:
+            self.holders[holder] = (name, expires_at)
+
+    def instances(self, now) -> list:
+        """
+        :return: list of (holder, name) of the instances alive at now
+        """
+        with self.lock:
+            return [
+                (holder, name)
+                for holder, (name, expires_at) in self.holders.items()
+                if expires_at > now
+            ]
+
+    def leases(self, now) -> dict:
+        """
+        :return: dict of account name -> holder, for the leases unexpired at now
+        """
+        with self.lock:
+            return {
+                account: holder
+                for account, (holder, expires_at) in self.lease_table.items()
+                if expires_at > now
+            }
+
+    def acquire(self, account, holder, expires_at, now) -> bool:
+        """
+        Takes or renews the lease on an account: succeeds if nobody holds it, its lease has expired, or holder already
+        holds it.
+        :return: True if holder now holds the lease, until expires_at
+        """
+        with self.lock:
+            current = self.lease_table.get(account)
+            if current is not None and current[0] != holder and current[1] > now:
+                return False
+            self.lease_table[account] = (holder, expires_at)
+            return True
+
+    def release(self, account, holder) -> None:
+        """
+        Gives up a lease, if holder holds it.
+        """
+        with self.lock:
+            if self.lease_table.get(account, (None,))[0] == holder:
+                del self.lease_table[account]
+
+    def release_all(self, holder) -> None:
+        """
+        Gives up all of holder's leases and withdraws it from the instances, e.g. at shutdown.
+        """
+        with self.lock:
+            for account in [
+                account
+                for account, (owner, _) in self.lease_table.items()
+                if owner == holder
+            ]:
+                del self.lease_table[account]
+            self.holders.pop(holder, None)
+
+    def publish_state(self, account, holder, fetched_at, state=None) -> int:
+        """
+        Updates the shared state of an account.
+        :param fetched_at: when the holder last fetched the account's data
+        :param state: the state dict, see shared_state(); None if only the fetch time has changed, which keeps the
+        state published last
+        :return: the sequence number it was stored under
+        """
+        with self.lock:
+            self.sequence += 1
+            if state is None:
+                state_sequence, state = self.states.get(account, (0,) * 5)[3:]
+            else:
+                state_sequence = self.sequence
+            self.states[account] = (
+                self.sequence,
+                holder,
+                fetched_at,
+                state_sequence,
+                state,
+            )
+            return self.sequence
+
+    def states_since(self, sequence) -> list:
+        """
+        :return: list of (sequence, account, holder, fetched_at, state) for the accounts published after sequence, in
+        sequence order; state is None unless the state itself (not just the fetch time) was published after sequence
+        """
+        with self.lock:
+            return [
+                (
+                    seq,
+                    account,
+                    holder,
+                    fetched_at,
+                    state if state_seq > sequence else None,
+                )
+                for account, (seq, holder, fetched_at, state_seq, state) in sorted(
+                    self.states.items(), key=lambda item: item[1][0]
+                )
+                if seq > sequence
+            ]
+
+    def latest_sequence(self) -> int:
+        """
+        :return: the sequence number of the latest state published
+        """
+        with self.lock:
+            return self.sequence
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteLeaseStore:
+    """
+    A lease store in an SQLite database, which all cooperating instances open: by default EDFT's own database, so
+    several instances running with the same data directory coordinate; set EDFT_LEASE_STORE to a database on a shared
+    drive to coordinate across machines. Leases are taken with a single conditional upsert, so two instances racing for
+    the same account can't both win.
+    """
+
+    log_handler = None
+
+    def __init__(self, log_handler, path=DB_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.conn = ThreadLocalConnection(log_handler, path)
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS lease_instances(holder TEXT PRIMARY KEY, name, expires_at)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS leases(account TEXT PRIMARY KEY, holder, expires_at)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS lease_shared(account TEXT PRIMARY KEY, sequence, holder, fetched_at, "
+            "state_sequence, state BLOB)"
+        )
+        self.conn.commit()
+
+    def heartbeat(self, holder, name, expires_at) -> None:
+        self.conn.execute(
+            "insert or replace into lease_instances values (?,?,?)",
+            (holder, name, expires_at),
+        )
+        self.conn.commit()
+
+    def instances(self, now) -> list:
+        return self.conn.execute(
+            "select holder, name from lease_instances where expires_at > ?", (now,)
+        ).fetchall()
+
+    def leases(self, now) -> dict:
+        return dict(
+            self.conn.execute(
+                "select account, holder from leases where expires_at > ?", (now,)
+            ).fetchall()
+        )
+
+    def acquire(self, account, holder, expires_at, now) -> bool:
+        cur = self.conn.execute(
+            "insert into leases values (?,?,?) on conflict(account) do update set "
+            "holder=excluded.holder, expires_at=excluded.expires_at "
+            "where leases.holder=excluded.holder or leases.expires_at <= ?",
+            (account, holder, expires_at, now),
+        )
+        self.conn.commit()
+        return cur.rowcount == 1
+
+    def release(self, account, holder) -> None:
+        self.conn.execute(
+            "delete from leases where account=? and holder=?", (account, holder)
+        )
+        self.conn.commit()
+
+    def release_all(self, holder) -> None:
+        self.conn.execute("delete from leases where holder=?", (holder,))
+        self.conn.execute("delete from lease_instances where holder=?", (holder,))
+        self.conn.commit()
+
+    def publish_state(self, account, holder, fetched_at, state=None) -> int:
+        # Each statement numbers itself from the current maximum, so concurrent publishers can't share a number
+        cur = self.conn.cursor()
+        if state is not None:
+            cur.execute(
+                "insert or replace into lease_shared values (?, (select coalesce(max(sequence), 0) + 1 from "
+                "lease_shared), ?, ?, (select coalesce(max(sequence), 0) + 1 from lease_shared), ?)",
+                (
+                    account,
+                    holder,
+                    fetched_at,
+                    zlib.compress(json.dumps(state).encode("utf8")),
+                ),
+            )
+        else:
+            cur.execute(
+                "update lease_shared set sequence=(select coalesce(max(sequence), 0) + 1 from lease_shared), "
+                "holder=?, fetched_at=? where account=?",
+                (holder, fetched_at, account),
+            )
+            if cur.rowcount == 0:
+                cur.execute(
+                    "insert into lease_shared values "
+                    "(?, (select coalesce(max(sequence), 0) + 1 from lease_shared), ?, ?, 0, null)",
+                    (account, holder, fetched_at),
+                )
+        sequence = cur.execute(
+            "select sequence from lease_shared where account=?", (account,)
+        ).fetchone()[0]
+        self.conn.commit()
+        return sequence
+
+    def states_since(self, sequence) -> list:
+        # Only the states published since are read and decompressed; rows whose fetch time alone moved come without
+        return [
+            (
+                seq,
+                account,
+                holder,
+                fetched_at,
+                json.loads(zlib.decompress(state)) if state is not None else None,
+            )
+            for seq, account, holder, fetched_at, state in self.conn.execute(
+                "select sequence, account, holder, fetched_at, "
+                "case when state_sequence > ? then state end from lease_shared where sequence > ? order by sequence",
+                (sequence, sequence),
+            ).fetchall()
+        ]
+
+    def latest_sequence(self) -> int:
+        return self.conn.execute(
+            "select coalesce(max(sequence), 0) from lease_shared"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def create_lease_store(log_handler) -> object:
+    """
+    Builds the lease store selected by EDFT_LEASE_STORE: unset for EDFT's own database, "local" for no coordination,
+    or the path of a shared SQLite database.
+    """
+    match LEASE_STORE:
+        case "":
+            return SqliteLeaseStore(log_handler)
+        case "local":
+            return LocalLeaseStore()
+        case path:
+            return SqliteLeaseStore(log_handler, path)
+
+
+class LeaseCoordinator:
+    """
+    Shares the polling of the account table between EDFT instances. Each account is polled, and its tokens refreshed,
+    only by the instance holding its lease; leases last LEASE_DURATION and are renewed every LEASE_CHECK_INTERVAL, so
+    when an instance dies (or quits, which releases them at once) its accounts are picked up by the others.
+
+    The accounts are shared out evenly: each instance aims to hold its fair share of the accounts, taking free leases
+    until it has that many and giving back any above it, so a new instance soon takes over part of the load.
+
+    So every instance still shows the whole fleet, the lease holder publishes each account's state (the displayed parts
+    of its documents, auth state and encrypted tokens) to the store when it changes, and just the fetch time when only
+    that has; the other instances take it over. An instance that (re)authorizes an account it doesn't hold publishes
+    the new tokens too, so the holder picks them up. An instance running on its own publishes nothing; when another one
+    appears, every instance publishes the full state of its accounts once, so the newcomer starts out up to date.
+    """
+
+    store = None
+    log_handler = None
+    holder = None
+    next_check = 0
+    sequence = None
+    projection_paths = None
+
+    def __init__(
+        self, store, log_handler, projection_paths=None, duration=LEASE_DURATION
+    ):
+        """
+        :param store: the lease store shared with the other instances
+        :param log_handler: the shared log handler
+        :param projection_paths: the document parts to share, see shared_state()
+        :param duration: how long a lease lasts, in seconds
+        """
+        self.store = store
+        self.projection_paths = projection_paths
+        self.duration = duration
+        self.holder = uuid.uuid4().hex
+        self.name = socket.gethostname()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.owned = set()
+        self.instance_count = 1
+        self.published = {}
+        self.tokens = {}
+
+    def claim(self, accounts, now) -> set:
+        """
+        Renews this instance's leases and takes or gives back leases to move towards its fair share. Only talks to the
+        store every LEASE_CHECK_INTERVAL; in between, returns the accounts it held at the last check.
+        :param accounts: the account table
+        :param now: the current time (epoch seconds)
+        :return: set of the names of the accounts this instance should poll
+        """
+        if now < self.next_check:
+            return set(self.owned)
+        self.next_check = now + LEASE_CHECK_INTERVAL
+        expires_at = now + self.duration
+        self.store.heartbeat(self.holder, self.name, expires_at)
+        names = sorted(account.name for account in accounts)
+        held = self.store.leases(now)
+        instance_count = max(1, len(self.store.instances(now)))
+        if instance_count > self.instance_count:
+            # Someone new to catch up
+            self.published.clear()
+        self.instance_count = instance_count
+        target = math.ceil(len(names) / self.instance_count)
+        mine = [name for name in names if held.get(name) == self.holder]
+        for name in mine[target:]:
+            self.store.release(name, self.holder)
+        mine = [
+            name
+            for name in mine[:target]
+            if self.store.acquire(name, self.holder, expires_at, now)
+        ]
+        for name in names:
+            if len(mine) >= target:
+                break
+            if name not in held and self.store.acquire(
+                name, self.holder, expires_at, now
+            ):
+                mine.append(name)
+        for name in held:
+            if held[name] == self.holder and name not in names:
+                self.store.release(name, self.holder)
+        if set(mine) != self.owned:
+            self.logger.info(
+                "polling %s of %s accounts, %s instances",
+                len(mine),
+                len(names),
+                self.instance_count,
+            )
+        self.owned = set(mine)
+        return set(self.owned)
+
+    def publish(self, accounts) -> int:
+        """
+        Publishes the state of every held account whose documents, tokens or auth state changed since it was last
+        published (or just its fetch time, if that is all that changed), and of any other account whose tokens changed
+        in this instance. Does nothing while this is the only instance.
+        :param accounts: the account table
+        :return: the number of accounts published
+        """
+        if self.instance_count < 2:
+            self.published.clear()
+            return 0
+        published = 0
+        for account in accounts:
+            snapshot = account.snapshot
+            if account.name not in self.tokens:
+                # Tokens as loaded at startup may be older than the holder's, so only later changes count
+                self.tokens[account.name] = snapshot.token_ciphertext
+            tokens_changed = snapshot.token_ciphertext is not self.tokens[account.name]
+            if account.name not in self.owned and not tokens_changed:
+                continue
+            fields = shared_fields(snapshot)
+            previous = self.published.get(account.name)
+            if previous is None or any(
+                field is not old for field, old in zip(fields, previous[0])
+            ):
+                state = shared_state(snapshot, self.projection_paths)
+            elif snapshot.last_fetched != previous[1]:
+                state = None
+            else:
+                continue
+            self.published[account.name] = (fields, snapshot.last_fetched)
+            self.tokens[account.name] = snapshot.token_ciphertext
+            self.store.publish_state(
+                account.name, self.holder, snapshot.last_fetched, state
+            )
+            published += 1
+        return published
+
+    def adopt(self, accounts) -> int:
+        """
+        Takes over the states other instances have published since the last call: all of it for the accounts this
+        instance doesn't hold, and just the tokens and auth state for those it does.
+        :param accounts: the account table
+        :return: the number of accounts updated
+        """
+        if self.sequence is None:
+            # What was published before this instance started is no newer than what it loaded from its database
+            self.sequence = self.store.latest_sequence()
+        if self.instance_count < 2:
+            return 0
+        by_name = {account.name: account for account in accounts}
+        adopted = 0
+        for sequence, name, holder, fetched_at, state in self.store.states_since(
+            self.sequence
+        ):
+            self.sequence = max(self.sequence, sequence)
+            account = by_name.get(name)
+            if holder == self.holder or account is None:
+                continue
+            if name in self.owned:
+                if state is None:
+                    continue
+                # Published by an instance that reauthorized the account; our own data is the latest, its tokens are
+                state = {
+                    "reauth_required": state["reauth_required"],
+                    "token_ciphertext": state["token_ciphertext"],
+                }
+            else:
+                state = dict(state or {}, fetched_at=fetched_at)
+            account.apply_shared_state(state)
+            snapshot = account.snapshot
+            self.published[name] = (shared_fields(snapshot), snapshot.last_fetched)
+            self.tokens[name] = snapshot.token_ciphertext
+            adopted += 1
+        return adopted
+
+    def status(self) -> str:
+        """
+        :return: a one-line description of this instance's share, for the Diagnostics tab
+        """
+        return "Polling {0} accounts; {1} EDFT instance{2} sharing the fleet".format(
+            len(self.owned),
+            self.instance_count,
+            "" if self.instance_count == 1 else "s",
+        )
+
+    def stop(self) -> None:
+        """
+        Releases every lease at once, so the other instances take over without waiting for them to expire.
+        """
+        self.store.release_all(self.holder)
+        self.owned = set()
@@ -0,0 +1,134 @@
+import atexit
+import logging
+import os
+import queue
+import time
+from logging import handlers
+from edft_shared_constants import LOCAL_DB_PATH
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_MAX_BYTES = 128 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+""" Fields that may be passed through `extra=` and are appended to the log line as key=value pairs, in this order """
+STRUCTURED_FIELDS = ("account", "endpoint", "status", "latency_ms", "suppressed")
+
+""" Rate limiting: at most RATE_LIMIT_BURST records per message template (and account) per RATE_LIMIT_WINDOW seconds """
+RATE_LIMIT_WINDOW = 60
+RATE_LIMIT_BURST = 20
+
+""" The most bytes of a cAPI response body that will ever be written to the log """
+PAYLOAD_CAPTURE_LIMIT = 1024
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    The usual EDFT log line, followed by any structured fields present on the record, e.g.
+    `... - DEBUG - cAPI request completed [account=alt1 endpoint=/profile status=200 latency_ms=412]`
+    """
+
+    def format(self, record) -> str:
+        line = super().format(record)
+        fields = [
+            field + "=" + str(record.__dict__[field])
+            for field in STRUCTURED_FIELDS
+            if field in record.__dict__
+        ]
+        if fields:
+            line += " [" + " ".join(fields) + "]"
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops repetitive records. Records are grouped by logger, level, unformatted message template and account, so lazy
+    %-style logging calls with different arguments still count as the same message. Once a group exceeds the burst
+    limit for the current window its records are dropped; the first record let through in the next window carries the
+    number that were suppressed.
+    """
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.groups = {}
+
+    def filter(self, record) -> bool:
+        key = (
+            record.name,
+            record.levelno,
+            record.msg,
+            record.__dict__.get("account"),
+        )
+        now = time.monotonic()
+        window_start, count, suppressed = self.groups.get(key, (now, 0, 0))
+        if now - window_start >= self.window:
+            window_start, count = now, 0
+        if count >= self.burst:
+            self.groups[key] = (window_start, count, suppressed + 1)
+            return False
+        if suppressed:
+            record.suppressed = suppressed
+        self.groups[key] = (window_start, count + 1, 0)
+        return True
+
+
+class DeferredQueueHandler(handlers.QueueHandler):
+    """
+    A QueueHandler that hands the record over untouched. The stock implementation merges the message arguments and
+    renders any traceback on the calling thread, which is exactly the work we want off the polling and Tk threads;
+    here all formatting happens on the writer thread instead.
+    """
+
+    def prepare(self, record) -> logging.LogRecord:
+        return record
+
+
+class PayloadSnippet:
+    """
+    Wraps a response body for logging. Nothing is decoded or copied unless the record is actually written, and then at
+    most PAYLOAD_CAPTURE_LIMIT bytes are.
+    """
+
+    def __init__(self, content, limit=PAYLOAD_CAPTURE_LIMIT):
+        self.content = content
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if self.content is None:
+            return "<no body>"
+        snippet = self.content[: self.limit]
+        if isinstance(snippet, bytes):
+            snippet = snippet.decode("utf8", errors="replace")
+        if len(self.content) > self.limit:
+            snippet += "... (" + str(len(self.content)) + " bytes total)"
+        return snippet
+
+
+def create_log_handler(filename) -> logging.Handler:
+    """
+    Creates the handler every module attaches to its logger. Records are rate-limited and put on an in-memory queue;
+    a background listener thread formats them and writes them to a rotating file in the logs directory, so logging
+    never blocks on disk I/O. The listener is flushed and stopped at interpreter exit.
+    :param filename: name of the log file inside the logs directory, e.g. "edft.log"
+    :return: the handler to attach to loggers
+    """
+    file_handler = handlers.RotatingFileHandler(
+        os.path.join(LOCAL_DB_PATH, "logs", filename),
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+    )
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.setLevel(logging.DEBUG)
+    queue_handler.addFilter(RateLimitFilter())
+
+    listener = handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
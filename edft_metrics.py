@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+""" Histogram bucket upper bounds """
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METRIC_HELP = {
+    "edft_capi_requests_total": "cAPI requests made, by endpoint, account and HTTP status",
+    "edft_capi_request_seconds": "cAPI request latency, by endpoint and account",
+    "edft_capi_payload_bytes": "cAPI response body size, by endpoint",
+    "edft_stage_seconds": "Pipeline stage duration (parse, persist, render), by account where applicable",
+    "edft_gui_tick_overruns_total": "GUI ticks that took longer than the GUI refresh interval",
+    "edft_change_events_total": "Change events published on the change feed, by type",
+}
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram. observe() only increments the single bucket the value falls into, so it stays cheap on hot
+    paths; counts are made cumulative (as Prometheus expects) only when rendered.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value) -> None:
+        """
+        Records a single observation.
+        :param value: the observed value (seconds, bytes, ...)
+        """
+        idx = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self) -> list:
+        """
+        :return: (upper bound, cumulative count) pairs, ending with the +Inf bucket.
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def quantile(self, q) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket that contains it. Coarse, but enough to spot trouble.
+        :param q: the quantile, between 0 and 1
+        :return: the estimated value, or the observed maximum if it falls in the +Inf bucket
+        """
+        target = q * self.count
+        for bound, running in self.cumulative():
+            if running >= target:
+                return bound if bound != float("inf") else self.max
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Holds every counter and histogram recorded by the application. Series are keyed by metric name and a sorted tuple
+    of label pairs, and created on first use, so nothing needs to be declared up front.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels) -> None:
+        """
+        Increments a counter.
+        :param name: the metric name
+        :param amount: how much to add
+        :param labels: label names and values identifying the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels) -> None:
+        """
+        Records an observation into a histogram.
+        :param name: the metric name
+        :param value: the observed value
+        :param buckets: bucket upper bounds, only used when the series is first created
+        :param labels: label names and values identifying the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """
+        Context manager that records the wall-clock duration of its body, in seconds, into a latency histogram.
+        :param name: the metric name
+        :param labels: label names and values identifying the series
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render_prometheus(self) -> str:
+        """
+        Renders every series in the Prometheus text exposition format.
+        :return: the exposition text
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, histogram.cumulative(), histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items()
+            )
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            describe(lines, described, name, "counter")
+            lines.append(name + format_labels(labels) + " " + format_value(value))
+        for (name, labels), buckets, total, count in histograms:
+            describe(lines, described, name, "histogram")
+            for bound, running in buckets:
+                le = "+Inf" if bound == float("inf") else format_value(bound)
+                lines.append(
+                    name
+                    + "_bucket"
+                    + format_labels(labels + (("le", le),))
+                    + " "
+                    + str(running)
+                )
+            lines.append(name + "_sum" + format_labels(labels) + " " + repr(total))
+            lines.append(name + "_count" + format_labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def export_to_file(self, path) -> None:
+        """
+        Writes the Prometheus exposition text to a file, e.g. for the node_exporter textfile collector.
+        :param path: the file to (over)write
+        """
+        text = self.render_prometheus()
+        with open(path + ".tmp", "w", encoding="utf8") as f:
+            f.write(text)
+        # Replace atomically so a collector never reads a half-written file
+        os.replace(path + ".tmp", path)
+
+    def summary_lines(self) -> list:
+        """
+        Produces a human-readable summary of every series for the Diagnostics tab.
+        :return: list of str, one per series
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (
+                    key,
+                    histogram.count,
+                    histogram.sum,
+                    histogram.quantile(0.5),
+                    histogram.quantile(0.95),
+                    histogram.max,
+                )
+                for key, histogram in self.histograms.items()
+            )
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(name + format_labels(labels) + "  " + format_value(value))
+        for (name, labels), count, total, p50, p95, peak in histograms:
+            if name.endswith("_seconds"):
+                scale, unit = 1000, "ms"
+            else:
+                scale, unit = 1, ""
+            lines.append(
+                "{0}{1}  n={2}  avg={3:.1f}{7}  p50<={4:.1f}{7}  p95<={5:.1f}{7}  max={6:.1f}{7}".format(
+                    name,
+                    format_labels(labels),
+                    count,
+                    total / count * scale if count else 0,
+                    p50 * scale,
+                    p95 * scale,
+                    peak * scale,
+                    unit,
+                )
+            )
+        return lines
+
+
+def describe(lines, described, name, metric_type) -> None:
+    """
+    Appends the HELP and TYPE lines for a metric the first time it is rendered.
+    """
+    if name in described:
+        return
+    described.add(name)
+    if name in METRIC_HELP:
+        lines.append("# HELP " + name + " " + METRIC_HELP[name])
+    lines.append("# TYPE " + name + " " + metric_type)
+
+
+def format_labels(labels) -> str:
+    """
+    Formats a tuple of label pairs as {name="value",...}, escaping values per the exposition format.
+    """
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            key
+            + '="'
+            + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            + '"'
+            for key, value in labels
+        )
+        + "}"
+    )
+
+
+def format_value(value) -> str:
+    """
+    Formats a sample value, dropping the trailing .0 from whole numbers.
+    """
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+""" The application-wide registry """
+REGISTRY = MetricsRegistry()
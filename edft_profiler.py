@@ -0,0 +1,265 @@
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from edft_shared_constants import LOCAL_DB_PATH
+
+PROFILE_OUTPUT_DIR = os.path.join(LOCAL_DB_PATH, "logs")
+PROFILE_DURATION = 30
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_TRACEMALLOC_FRAMES = 10
+PROFILE_REPORT_LINES = 25
+
+"""
+Innermost frames of threads that are idle, waiting rather than working: Condition.wait (behind Event.wait, queue.get
+and Thread.join), a thread pool worker or the log listener waiting for work, select, and Tk's mainloop waiting for
+events. A wait in a C function called straight from our own code, such as time.sleep(), leaves no frame of its own, so
+the functions that only ever sit in such a wait when innermost are listed too: the poller between rounds and the live
+transport pacing its queries. Anything else counts as working, including C calls that release the GIL, such as
+compression, hashing and SQLite.
+"""
+BLOCKING_FRAMES = frozenset(
+    {
+        "threading.py:wait",
+        "threading.py:_wait_for_tstate_lock",
+        "thread.py:_worker",
+        "selectors.py:select",
+        "connection.py:_poll",
+        "connection.py:_recv",
+        "__init__.py:mainloop",
+        "handlers.py:dequeue",
+        "EDFT.py:capi_refresh_task",
+        "edft_transport.py:pace",
+    }
+)
+
+
+def frame_label(frame) -> str:
+    """
+    Names a stack frame for the folded stack output, as `file.py:function`. Spaces are replaced because the folded
+    format uses a space to separate the stack from its count.
+    :param frame: a frame object
+    :return: the label
+    """
+    code = frame.f_code
+    return (os.path.basename(code.co_filename) + ":" + code.co_name).replace(" ", "_")
+
+
+def fold_stack(thread_name, frame) -> str:
+    """
+    Renders a thread's current stack in the "folded" format used by flamegraph.pl and speedscope: the thread name, then
+    each frame from the outermost to the innermost, separated by semicolons.
+    :param thread_name: name of the thread the stack belongs to
+    :param frame: the innermost frame, as returned by sys._current_frames()
+    :return: the folded stack
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(" ", "_"))
+    return ";".join(reversed(labels))
+
+
+class Profiler:
+    """
+    An on-demand sampling profiler for the whole process. While running, a background thread records the stack of
+    every other thread every PROFILE_SAMPLE_INTERVAL seconds, and tracemalloc traces allocations. Sampling works on all
+    threads at once (the GUI, the poller, the fleet state server) without having to instrument any of them, and costs
+    nothing when the profiler isn't running. Stacks of threads that are waiting (see BLOCKING_FRAMES) are kept apart
+    from those doing work, so idle threads don't crowd out the busy ones. At the end of the window two files are
+    written to the logs directory: `profile-<time>.folded`, the working stacks for flame graph tools, and
+    `profile-<time>.txt`, a readable summary of where each thread spent its time, the busiest functions, what the
+    threads waited in, and the memory allocated during the window.
+    """
+
+    log_handler = None
+    output_dir = None
+    thread = None
+    ends_at = 0
+    last_report = None
+
+    def __init__(self, log_handler, output_dir=PROFILE_OUTPUT_DIR):
+        self.output_dir = output_dir
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.stop_event = threading.Event()
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=PROFILE_DURATION) -> bool:
+        """
+        Starts profiling for a bounded window.
+        :param duration: length of the window, in seconds
+        :return: False if a profile was already being taken
+        """
+        if self.running():
+            return False
+        self.stop_event.clear()
+        self.ends_at = time.time() + duration
+        self.thread = threading.Thread(
+            target=self._run, args=(duration,), name="edft-profiler", daemon=True
+        )
+        self.thread.start()
+        self.logger.info("profiling for %s seconds", duration)
+        return True
+
+    def stop(self) -> None:
+        """
+        Ends the current window early. The report is still written.
+        """
+        self.stop_event.set()
+
+    def status(self) -> str:
+        """
+        :return: a one-line description of what the profiler is doing, for the Diagnostics tab
+        """
+        if self.running():
+            return "Profiling, {0:.0f} s left".format(
+                max(0, self.ends_at - time.time())
+            )
+        if self.last_report is not None:
+            return "Last profile: " + self.last_report
+        return "Not profiling"
+
+    def _run(self, duration) -> None:
+        """
+        Profiler thread: samples until the window ends or stop() is called, then writes the report.
+        :param duration: length of the window, in seconds
+        """
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        baseline = tracemalloc.take_snapshot()
+        stacks = Counter()
+        waiting = Counter()
+        samples = 0
+        own_ident = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + duration
+        try:
+            while time.monotonic() < deadline and not self.stop_event.is_set():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    blocked = frame_label(frame) in BLOCKING_FRAMES
+                    stack = fold_stack(names.get(ident, str(ident)), frame)
+                    (waiting if blocked else stacks)[stack] += 1
+                samples += 1
+                self.stop_event.wait(PROFILE_SAMPLE_INTERVAL)
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+        try:
+            self.last_report = self.write_report(
+                stacks,
+                waiting,
+                samples,
+                time.monotonic() - started,
+                baseline,
+                snapshot,
+                peak,
+            )
+            self.logger.info("profile written to %s", self.last_report)
+        except OSError:
+            self.logger.exception("could not write profile")
+
+    def write_report(
+        self, stacks, waiting, samples, elapsed, baseline, snapshot, peak
+    ) -> str:
+        """
+        Writes the folded stacks and the summary report. Percentages are of all the stacks sampled (one per thread per
+        sample), so they add up to 100% across threads, working and waiting.
+        :param stacks: Counter of folded stack -> number of samples, for threads that were working
+        :param waiting: Counter of folded stack -> number of samples, for threads that were waiting
+        :param samples: how many times the threads were sampled
+        :param elapsed: length of the window, in seconds
+        :param baseline: tracemalloc snapshot from the start of the window
+        :param snapshot: tracemalloc snapshot from the end of the window
+        :param peak: peak traced memory during the window, in bytes
+        :return: path of the summary report
+        """
+        base = os.path.join(
+            self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S", time.localtime())
+        )
+        with open(base + ".folded", "w", encoding="utf8") as f:
+            for stack, count in stacks.most_common():
+                f.write(stack + " " + str(count) + "\n")
+
+        total = max(sum(stacks.values()) + sum(waiting.values()), 1)
+        inclusive = Counter()
+        own = Counter()
+        threads = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            for label in set(frames[1:]):
+                inclusive[label] += count
+            own[frames[-1]] += count
+            threads[frames[0]] += count
+        waits = Counter()
+        idle = Counter()
+        for stack, count in waiting.items():
+            frames = stack.split(";")
+            waits[frames[0] + " in " + frames[-1]] += count
+            idle[frames[0]] += count
+        own_filter = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+        allocations = snapshot.filter_traces(own_filter).compare_to(
+            baseline.filter_traces(own_filter), "lineno"
+        )
+
+        lines = [
+            "EDFT profile: {0:.1f} s, {1} samples every {2:.0f} ms, {3} thread stacks".format(
+                elapsed, samples, PROFILE_SAMPLE_INTERVAL * 1000, total
+            ),
+            "",
+            "Threads (% of their own samples spent working):",
+        ]
+        lines += [
+            "  {0:6.1f}%  {1}".format(
+                100 * threads[name] / (threads[name] + idle[name]), name
+            )
+            for name in sorted(threads.keys() | idle.keys())
+        ]
+        lines += [
+            "",
+            "Busiest functions, including time in their callees (% of thread stacks):",
+        ]
+        lines += [
+            "  {0:6.1f}%  {1}".format(100 * count / total, label)
+            for label, count in inclusive.most_common(PROFILE_REPORT_LINES)
+        ]
+        lines += [
+            "",
+            "Busiest functions, excluding their callees (% of thread stacks):",
+        ]
+        lines += [
+            "  {0:6.1f}%  {1}".format(100 * count / total, label)
+            for label, count in own.most_common(PROFILE_REPORT_LINES)
+        ]
+        lines += ["", "Waiting (% of thread stacks):"]
+        lines += [
+            "  {0:6.1f}%  {1}".format(100 * count / total, label)
+            for label, count in waits.most_common(PROFILE_REPORT_LINES)
+        ]
+        lines += [
+            "",
+            "Memory allocated during the window (peak traced: {0:0,.0f} KiB):".format(
+                peak / 1024
+            ),
+        ]
+        lines += ["  " + str(stat) for stat in allocations[:PROFILE_REPORT_LINES]]
+        with open(base + ".txt", "w", encoding="utf8") as f:
+            f.write("\n".join(lines) + "\n")
+        return base + ".txt"
@@ -0,0 +1,316 @@
+import json
+import logging
+import time
+from array import array
+from edft_archive import ARCHIVE_RETENTION_DAYS
+
+# Optional: without it, projections fall back to plain Python, which is fine for small fleets
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROJECTION_WINDOW_DAYS = 30
+PROJECTION_MIN_SPAN = 24 * 60 * 60
+SECONDS_PER_DAY = 24 * 60 * 60
+PROJECTION_FIELDS = ("balance", "fuel")
+
+
+def carrier_values(fc_data) -> [int, int]:
+    """
+    Extracts the values projections are made from.
+    :param fc_data: a fleet carrier document
+    :return: the carrier balance and its tritium fuel level, or None if the document doesn't have them
+    """
+    try:
+        return int(fc_data["balance"]), int(fc_data["fuel"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class FleetHistory:
+    """
+    Balance and fuel of every carrier over time, one sample per poll that changed either of them. A poll that returns
+    the same values adds nothing, so a carrier sitting idle costs no history; the rate at which the values go down is
+    all projections need, and that is fully described by the points where they changed.
+
+    The samples within the projection window are also kept in memory, in columns (typed arrays of carrier index, time,
+    balance and fuel) that NumPy can use in place, so projections never go back to the database or copy the history.
+    Each carrier's samples are in chronological order, though different carriers' samples are interleaved.
+    """
+
+    conn = None
+    log_handler = None
+    version = 0
+
+    def __init__(self, conn, log_handler, window_days=PROJECTION_WINDOW_DAYS):
+        self.conn = conn
+        self.window = window_days * SECONDS_PER_DAY
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.recorded = {}
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS carrier_history(account, fetched_at, balance, fuel)"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS carrier_history_lookup ON carrier_history(account, fetched_at)"
+        )
+        self.conn.commit()
+        self.load()
+
+    def clear(self) -> None:
+        self.carrier_index = {}
+        self.carriers = array("q")
+        self.times = array("d")
+        self.balances = array("d")
+        self.fuels = array("d")
+        self.latest = {}
+        self.version += 1
+
+    def load(self) -> None:
+        """
+        Loads the samples within the projection window, plus the last sample before it for each account, which is what
+        the account's values were when the window started.
+        """
+        cutoff = time.time() - self.window
+        self.clear()
+        for account, fetched_at, balance, fuel in self.conn.cursor().execute(
+            "select account, fetched_at, balance, fuel from carrier_history h where fetched_at >= ? "
+            "or fetched_at = (select max(fetched_at) from carrier_history j "
+            "where j.account = h.account and j.fetched_at < ?) "
+            "order by account, fetched_at",
+            (cutoff, cutoff),
+        ):
+            self._add(account, fetched_at, (balance, fuel))
+
+    def empty(self) -> bool:
+        cur = self.conn.cursor()
+        return cur.execute("select 1 from carrier_history limit 1").fetchone() is None
+
+    def _add(self, account, fetched_at, values) -> None:
+        if account not in self.carrier_index:
+            self.carrier_index[account] = len(self.carrier_index)
+        self.carriers.append(self.carrier_index[account])
+        self.times.append(fetched_at)
+        self.balances.append(values[0])
+        self.fuels.append(values[1])
+        self.latest[account] = (fetched_at, values)
+        self.version += 1
+
+    def append(self, account, fetched_at, values) -> bool:
+        """
+        Adds a sample if the values differ from the account's previous one. Does not commit.
+        :param account: the account name
+        :param fetched_at: when the values were fetched (epoch seconds)
+        :param values: (balance, fuel) as returned by carrier_values()
+        :return: True if a sample was added
+        """
+        latest = self.latest.get(account)
+        if latest is not None and (latest[1] == values or fetched_at <= latest[0]):
+            return False
+        self.conn.cursor().execute(
+            "insert into carrier_history values (?,?,?,?)",
+            (account, fetched_at, values[0], values[1]),
+        )
+        self._add(account, fetched_at, values)
+        return True
+
+    def record(self, accounts) -> int:
+        """
+        Samples every account whose carrier document has changed since the last call. Called once per GUI tick.
+        :param accounts: the account table
+        :return: the number of samples added
+        """
+        added = 0
+        for account in accounts:
+            snapshot = account.snapshot
+            # Documents are never modified in place, so an unchanged object means unchanged data
+            if snapshot.fc_data is self.recorded.get(account.name):
+                continue
+            self.recorded[account.name] = snapshot.fc_data
+            values = carrier_values(snapshot.fc_data)
+            if values is not None and snapshot.last_fetched:
+                added += self.append(account.name, snapshot.last_fetched, values)
+        if added:
+            self.conn.commit()
+        return added
+
+    def backfill(self, archive, names, endpoint) -> int:
+        """
+        Builds the history from the payload archive, for databases that have archived payloads from before the history
+        was kept.
+        :param archive: the PayloadArchive
+        :param names: the account names
+        :param endpoint: the fleet carrier endpoint
+        :return: the number of samples added
+        """
+        added = 0
+        for name in names:
+            for fetched_at, _ in archive.history(name, endpoint):
+                content = archive.get(name, endpoint, fetched_at)[1]
+                try:
+                    values = carrier_values(json.loads(content))
+                except (TypeError, ValueError):
+                    values = None
+                if values is not None:
+                    added += self.append(name, fetched_at, values)
+        self.conn.commit()
+        if added:
+            self.logger.info("built %s history samples from the archive", added)
+        return added
+
+    def prune(self, retention_days=ARCHIVE_RETENTION_DAYS) -> int:
+        """
+        Drops samples older than the retention window, except each account's newest, and samples of accounts that no
+        longer exist. Reloads the in-memory columns, which also drops samples that have left the projection window.
+        :param retention_days: how many days of history to keep
+        :return: the number of samples removed
+        """
+        cutoff = time.time() - retention_days * SECONDS_PER_DAY
+        cur = self.conn.cursor()
+        cur.execute(
+            "delete from carrier_history where account not in (select name from accounts) or (fetched_at < ? and "
+            "fetched_at < (select max(fetched_at) from carrier_history j where j.account = carrier_history.account))",
+            (cutoff,),
+        )
+        removed = cur.rowcount
+        self.conn.commit()
+        self.load()
+        return removed
+
+    def project(self, names, now=None, vectorized=None) -> dict:
+        """
+        Projects the given accounts' carriers from the history. See project_fleet().
+        """
+        return project_fleet(
+            self,
+            names,
+            time.time() if now is None else now,
+            self.window / SECONDS_PER_DAY,
+            vectorized,
+        )
+
+
+def project_fleet(
+    history, names, now, window_days=PROJECTION_WINDOW_DAYS, vectorized=None
+) -> dict:
+    """
+    Projects how long each carrier's balance and fuel will last at the rate they went down over the projection window.
+    The burn rate is everything a value lost within the window (deposits and refuelling don't offset it) divided by
+    the time covered, so upkeep and jumps count in full however often the carrier is topped up. Carriers with less
+    than PROJECTION_MIN_SPAN of history get no rate.
+    :param history: the FleetHistory
+    :param names: the accounts to project, in display order
+    :param now: the time to project from (epoch seconds)
+    :param window_days: how far back to look
+    :param vectorized: force the NumPy (True) or plain Python (False) implementation; default is NumPy if installed
+    :return: dict with "carriers", a list of per-carrier dicts in the order of names, and "totals" for the fleet
+    """
+    if vectorized is None:
+        vectorized = numpy is not None
+    window_start = now - window_days * SECONDS_PER_DAY
+    if vectorized:
+        current, consumed, first = _burn_numpy(history, window_start)
+    else:
+        current, consumed, first = _burn_python(history, window_start)
+    carriers = []
+    totals = {"balance": 0, "fuel": 0, "balance_burn": 0.0, "fuel_burn": 0.0}
+    for name in names:
+        carrier = {"name": name}
+        i = history.carrier_index.get(name)
+        span = now - max(first[i], window_start) if i is not None else 0
+        for field in PROJECTION_FIELDS:
+            value = int(current[field][i]) if i is not None else None
+            rate = None
+            if span >= PROJECTION_MIN_SPAN:
+                rate = consumed[field][i] / span * SECONDS_PER_DAY
+            carrier[field] = value
+            carrier[field + "_burn"] = rate
+            carrier[field + "_days"] = days_left(value, rate)
+            totals[field] += value or 0
+            totals[field + "_burn"] += rate or 0.0
+        carriers.append(carrier)
+    for field in PROJECTION_FIELDS:
+        totals[field + "_days"] = days_left(totals[field], totals[field + "_burn"])
+        totals["first_" + field + "_days"] = min(
+            (
+                carrier[field + "_days"]
+                for carrier in carriers
+                if carrier[field + "_days"] is not None
+            ),
+            default=None,
+        )
+    return {"carriers": carriers, "totals": totals}
+
+
+def days_left(value, rate) -> float:
+    """
+    :return: how many days value lasts at rate per day; None if it isn't going down (or isn't known)
+    """
+    if value is None or not rate:
+        return None
+    return max(value, 0) / rate
+
+
+def _burn_python(history, window_start) -> [dict, dict, list]:
+    """
+    Works out each carrier's current values, what they lost within the window, and when its history starts, in one
+    pass over the samples.
+    :param history: the FleetHistory
+    :param window_start: where the window starts (epoch seconds)
+    :return: current values and losses as dicts of field -> list, and the list of first sample times, all indexed by
+    carrier index
+    """
+    count = len(history.carrier_index)
+    first = [None] * count
+    current = {field: [0] * count for field in PROJECTION_FIELDS}
+    consumed = {field: [0] * count for field in PROJECTION_FIELDS}
+    for carrier, fetched_at, balance, fuel in zip(
+        history.carriers, history.times, history.balances, history.fuels
+    ):
+        if first[carrier] is None:
+            first[carrier] = fetched_at
+        elif fetched_at >= window_start:
+            for field, value in (("balance", balance), ("fuel", fuel)):
+                if value < current[field][carrier]:
+                    consumed[field][carrier] += current[field][carrier] - value
+        current["balance"][carrier] = balance
+        current["fuel"][carrier] = fuel
+    return current, consumed, first
+
+
+def _burn_numpy(history, window_start) -> [dict, dict, list]:
+    """
+    Same as _burn_python(), for every carrier at once. The columns are viewed as NumPy arrays without copying, grouped
+    by carrier with a stable sort (which keeps each carrier's samples in order), and the losses are summed per carrier
+    with bincount().
+    """
+    count = len(history.carrier_index)
+    if not count:
+        return (
+            {field: [] for field in PROJECTION_FIELDS},
+            {field: [] for field in PROJECTION_FIELDS},
+            [],
+        )
+    carriers = numpy.frombuffer(history.carriers, dtype=numpy.int64)
+    order = numpy.argsort(carriers, kind="stable")
+    carriers = carriers[order]
+    times = numpy.frombuffer(history.times)[order]
+    # Every carrier in carrier_index has at least one sample, so starts[i] is where carrier i's samples begin
+    starts = numpy.flatnonzero(numpy.r_[True, carriers[1:] != carriers[:-1]])
+    ends = numpy.r_[starts[1:] - 1, len(carriers) - 1]
+    # A drop counts when it happened within the window, and both samples belong to the same carrier
+    counted = (carriers[1:] == carriers[:-1]) & (times[1:] >= window_start)
+    current = {}
+    consumed = {}
+    for field, column in (("balance", history.balances), ("fuel", history.fuels)):
+        values = numpy.frombuffer(column)[order]
+        drops = numpy.where(counted, numpy.maximum(values[:-1] - values[1:], 0), 0)
+        consumed[field] = numpy.bincount(
+            carriers[1:], weights=drops, minlength=count
+        ).tolist()
+        current[field] = values[ends].tolist()
+    return current, consumed, times[starts].tolist()
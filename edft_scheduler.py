@@ -0,0 +1,87 @@
+import logging
+import random
+
+""" Fraction of the refresh interval used as random jitter on top of each account's regular due time """
+POLL_JITTER = 0.1
+
+
+class PollScheduler:
+    """
+    Decides when each account is next polled. Accounts are scheduled individually from the time their data was last
+    fetched, so a restart doesn't re-poll data that is still fresh. Accounts whose data is already stale when first
+    seen are spread randomly across one refresh interval instead of all being polled at once, and every later due time
+    gets a little jitter so accounts don't drift back into lockstep.
+    """
+
+    log_handler = None
+    interval = 0
+
+    def __init__(self, interval, log_handler):
+        """
+        :param interval: the refresh interval, in seconds
+        :param log_handler: the shared log handler
+        """
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.next_due = {}
+
+    def jitter(self) -> float:
+        return random.uniform(0, self.interval * POLL_JITTER)
+
+    def first_due(self, account, now) -> float:
+        """
+        Works out when an account that has not been scheduled yet should first be polled.
+        :param account: the Account
+        :param now: the current time (epoch seconds)
+        :return: the due time (epoch seconds)
+        """
+        age = now - (account.last_fetched or 0)
+        if age >= self.interval:
+            due = now + random.uniform(0, self.interval)
+        else:
+            due = account.last_fetched + self.interval + self.jitter()
+        self.logger.debug(
+            "data is %ss old, first poll in %ss",
+            round(age),
+            round(due - now),
+            extra={"account": account.name},
+        )
+        return due
+
+    def due_accounts(self, accounts, now) -> list:
+        """
+        Picks out the accounts that should be polled now. Accounts that need reauthorization, or are in the middle of
+        it, are never due, and are scheduled afresh once they have been reauthorized.
+        :param accounts: the account table
+        :param now: the current time (epoch seconds)
+        :return: list of Accounts to poll
+        """
+        due = []
+        names = set()
+        for account in accounts:
+            names.add(account.name)
+            if account.reauth_required or account.onboarding is not None:
+                self.next_due.pop(account.name, None)
+                continue
+            if account.name not in self.next_due:
+                self.next_due[account.name] = self.first_due(account, now)
+            if self.next_due[account.name] <= now:
+                due.append(account)
+        for name in self.next_due.keys() - names:
+            del self.next_due[name]
+        return due
+
+    def polled(self, account, now) -> None:
+        """
+        Schedules an account's next poll after it has been polled. Keeps the account's place in the cycle where
+        possible, so the spread set up by first_due() is preserved.
+        :param account: the Account that was polled
+        :param now: the current time (epoch seconds)
+        """
+        due = self.next_due.get(account.name, now) + self.interval
+        if due <= now:
+            due = now + self.jitter()
+        self.next_due[account.name] = due
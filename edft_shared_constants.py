@@ -1,4 +1,63 @@
 import os
 
-LOCAL_DB_PATH = os.getenv("LOCALAPPDATA") + "\\edft\\dist"
+""" Where EDFT keeps its database, logs and settings. LOCALAPPDATA is only set on Windows; elsewhere (e.g. replaying
+recorded sessions on Linux, see edft_transport) the usual per-user data directory is used instead. """
+LOCAL_DB_PATH = os.path.join(
+    os.getenv("LOCALAPPDATA")
+    or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "edft",
+    "dist",
+)
 API_QUERY_INTERVAL = 650
+API_SERVER_HOST = "127.0.0.1"
+API_SERVER_PORT = 8677
+
+""" Number of worker processes to spread cAPI collection across. 0 collects on the polling thread, as before. """
+COLLECTOR_PROCESSES = int(os.getenv("EDFT_COLLECTOR_PROCESSES", "0"))
+
+""" Seconds to profile for right after startup (see edft_profiler). 0 disables; profiling can also be started from the
+Diagnostics tab. """
+PROFILE_ON_START = int(os.getenv("EDFT_PROFILE", "0"))
+
+""" cAPI record/replay (see edft_transport). EDFT_CAPI_RECORD records every cAPI exchange, tokens scrubbed, into the
+given directory; EDFT_CAPI_REPLAY answers cAPI requests from a recording in the given directory instead of Frontier, at
+EDFT_CAPI_REPLAY_SPEED: 1 for real time, another number for that many times faster, or "max". """
+CAPI_RECORD_DIR = os.getenv("EDFT_CAPI_RECORD")
+CAPI_REPLAY_DIR = os.getenv("EDFT_CAPI_REPLAY")
+CAPI_REPLAY_SPEED = os.getenv("EDFT_CAPI_REPLAY_SPEED", "1")
+
+""" Where EDFT instances sharing a fleet coordinate who polls which account (see edft_leases). Unset for the database in
+LOCAL_DB_PATH, so instances sharing a data directory share the fleet; a path for another SQLite database, e.g. on a
+shared drive; "local" for an instance that shares with nobody. """
+LEASE_STORE = os.getenv("EDFT_LEASE_STORE", "")
+
+""" cAPI request budget (see edft_budget): requests allowed per host, and per account token, in any 60 seconds, and the
+shortest refresh interval EDFT will plan, in seconds. Frontier doesn't publish its limits; lower these if requests get
+throttled. """
+CAPI_HOST_BUDGET = int(os.getenv("EDFT_CAPI_HOST_BUDGET", "120"))
+CAPI_TOKEN_BUDGET = int(os.getenv("EDFT_CAPI_TOKEN_BUDGET", "10"))
+MIN_REFRESH_INTERVAL = int(os.getenv("EDFT_MIN_REFRESH_INTERVAL", "60"))
+
+""" The Ladder: system name -> step, from N16 down to N0 """
+LADDER = {
+    "Gali": "N16",
+    "Wregoe ZE-B c28-2": "N15",
+    "Wregoe OP-D b58-0": "N14",
+    "Plaa Trua QL-B c27-0": "N13",
+    "Plaa Trua WQ-C d13-0": "N12",
+    "HD 107865": "N11",
+    "HD 105548": "N10",
+    "HD 104785": "N9",
+    "HD 102000": "N8",
+    "HD 102779": "N7",
+    "HD 104392": "N6",
+    "HIP 56843": "N5",
+    "HIP 57478": "N4",
+    "HIP 57784": "N3",
+    "HD 104495": "N2",
+    "HD 105341": "N1",
+    "HIP 58832": "N0",
+}
+
+""" The fleet carrier capacity entries whose sum is the cargo loaded, as shown in the Tonnage column """
+TONNAGE_FIELDS = ("cargoNotForSale", "cargoForSale")
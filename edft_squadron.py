@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from edft_archive import payload_digest
+from edft_diff import FC_ENDPOINT
+
+SNAPSHOT_FORMAT = "edft-fleet-snapshot"
+SNAPSHOT_VERSION = 1
+
+""" Fields the squadron view needs beyond the table columns; collector workers must keep these too """
+SQUADRON_PATHS = {FC_ENDPOINT: [("market", "id")]}
+
+
+def carrier_aliases(record) -> list:
+    """
+    Lists the identities a carrier record can be matched on: its carrier ID and its callsign. Either may be missing,
+    e.g. from instances whose data predates the carrier ID being kept.
+    :param record: a carrier record
+    :return: list of alias strings
+    """
+    aliases = []
+    if record.get("carrier_id") is not None:
+        aliases.append("id:" + str(record["carrier_id"]))
+    callsign = record.get("fleet_carrier", {}).get("Callsign")
+    if callsign:
+        aliases.append("callsign:" + str(callsign))
+    return aliases
+
+
+class SquadronView:
+    """
+    A merged view of the carriers of several EDFT instances, e.g. all of a squadron's operators.
+
+    Each instance exports a snapshot file (export_snapshot()); other instances import it (import_snapshot()). Carriers
+    are deduplicated by carrier ID or callsign, and for each carrier the record with the newest `updated_at` (when
+    its data was fetched from cAPI) wins, whichever instance it came from. The merge is incremental: a file identical
+    to the one last imported from the same path is skipped without parsing, and within a file only carriers newer than
+    that source's watermark (the newest update already imported from it), or not in the view at all, are considered.
+    Only carriers that actually changed are written to the database and reported to the GUI. This instance's own
+    carriers take part as just another source, re-merged only when their snapshot version changes.
+    """
+
+    conn = None
+    log_handler = None
+    instance_id = None
+    version = 0
+
+    def __init__(self, conn, log_handler):
+        self.conn = conn
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.carriers = {}
+        self.aliases = {}
+        self.sources = {}
+        self.file_digests = {}
+        self.local_versions = {}
+        self.changed = set()
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS squadron_meta(key TEXT PRIMARY KEY, value)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS squadron_sources(source TEXT PRIMARY KEY, name, path, digest, watermark)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS squadron_carriers(carrier TEXT PRIMARY KEY, source, updated_at, record)"
+        )
+        row = cur.execute(
+            "select value from squadron_meta where key='instance_id'"
+        ).fetchone()
+        if row is None:
+            self.instance_id = uuid.uuid4().hex
+            cur.execute(
+                "insert into squadron_meta values ('instance_id', ?)",
+                (self.instance_id,),
+            )
+        else:
+            self.instance_id = row[0]
+        for source, name, path, digest, watermark in cur.execute(
+            "select source, name, path, digest, watermark from squadron_sources"
+        ).fetchall():
+            self.sources[source] = {"name": name, "path": path, "watermark": watermark}
+            if path is not None:
+                self.file_digests[path] = digest
+        for carrier, record in cur.execute(
+            "select carrier, record from squadron_carriers"
+        ).fetchall():
+            record = json.loads(record)
+            self.carriers[carrier] = record
+            for alias in carrier_aliases(record):
+                self.aliases[alias] = carrier
+        self.conn.commit()
+        self.changed.update(self.carriers)
+
+    def carrier_records(self, instance) -> list:
+        """
+        Builds carrier records for this instance's own accounts that have carrier data.
+        :param instance: the EliteDangerousFleetTracker
+        :return: list of carrier records
+        """
+        records = []
+        for account in instance.account_table:
+            snapshot = account.snapshot
+            if not snapshot.fc_data or not snapshot.last_fetched:
+                continue
+            records.append(self.carrier_record(instance, account, snapshot))
+        return records
+
+    @staticmethod
+    def carrier_record(instance, account, snapshot) -> dict:
+        """
+        Builds the carrier record for one account: its export_account() entry, stamped with when its data was fetched.
+        """
+        record = instance.export_account(account, snapshot)
+        record["updated_at"] = snapshot.last_fetched
+        return record
+
+    def export_snapshot(self, instance, path) -> int:
+        """
+        Writes this instance's carriers to a snapshot file for other instances to import. The file is replaced
+        atomically, so an instance importing it from a shared folder never sees half of it.
+        :param instance: the EliteDangerousFleetTracker
+        :param path: the file to write
+        :return: the number of carriers exported
+        """
+        records = self.carrier_records(instance)
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "format_version": SNAPSHOT_VERSION,
+            "source": self.instance_id,
+            "name": socket.gethostname(),
+            "exported_at": time.time(),
+            "carriers": records,
+        }
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf8") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, path)
+        self.logger.info("exported %s carriers to %s", len(records), path)
+        return len(records)
+
+    def import_snapshot(self, path) -> int:
+        """
+        Merges a snapshot file exported by another instance.
+        :param path: the snapshot file
+        :return: the number of carriers that changed in the merged view
+        :raise ValueError: if the file is not an EDFT fleet snapshot
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = payload_digest(content)
+        if self.file_digests.get(path) == digest:
+            return 0
+        snapshot = json.loads(content)
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("format") != SNAPSHOT_FORMAT
+            or snapshot.get("format_version", 0) > SNAPSHOT_VERSION
+        ):
+            raise ValueError(path + " is not a supported EDFT fleet snapshot")
+        source = snapshot["source"]
+        if source == self.instance_id:
+            raise ValueError(path + " was exported by this instance")
+        watermark = self.sources.get(source, {}).get("watermark") or 0
+        newer = [
+            record
+            for record in snapshot["carriers"]
+            if record.get("updated_at")
+            and (
+                record["updated_at"] > watermark
+                or not any(alias in self.aliases for alias in carrier_aliases(record))
+            )
+        ]
+        changed = self.merge(source, newer)
+        self.sources[source] = {
+            "name": snapshot.get("name"),
+            "path": path,
+            "watermark": max([watermark] + [record["updated_at"] for record in newer]),
+        }
+        self.file_digests[path] = digest
+        self.conn.cursor().execute(
+            "insert or replace into squadron_sources values (?,?,?,?,?)",
+            (
+                source,
+                snapshot.get("name"),
+                path,
+                digest,
+                self.sources[source]["watermark"],
+            ),
+        )
+        self.conn.commit()
+        self.logger.info(
+            "imported %s: %s carriers newer than last import, %s changed",
+            path,
+            len(newer),
+            changed,
+        )
+        return changed
+
+    def reimport(self) -> int:
+        """
+        Imports every snapshot file that has been imported before again, picking up whatever changed since.
+        :return: the number of carriers that changed in the merged view
+        """
+        changed = 0
+        for path in list(self.file_digests):
+            try:
+                changed += self.import_snapshot(path)
+            except (OSError, ValueError):
+                self.logger.exception("could not reimport %s", path)
+        return changed
+
+    def merge_local(self, instance) -> int:
+        """
+        Merges this instance's own carriers, skipping accounts whose snapshot hasn't changed since the last merge.
+        :param instance: the EliteDangerousFleetTracker
+        :return: the number of carriers that changed in the merged view
+        """
+        records = []
+        for account in instance.account_table:
+            snapshot = account.snapshot
+            if self.local_versions.get(account.name) == snapshot.version:
+                continue
+            self.local_versions[account.name] = snapshot.version
+            if snapshot.fc_data and snapshot.last_fetched:
+                records.append(self.carrier_record(instance, account, snapshot))
+        if not records:
+            return 0
+        changed = self.merge(self.instance_id, records)
+        self.conn.commit()
+        return changed
+
+    def merge(self, source, records) -> int:
+        """
+        Merges carrier records into the view, keeping the newest record for each carrier. Does not commit.
+        :param source: the instance the records came from
+        :param records: list of carrier records
+        :return: the number of carriers that changed
+        """
+        cur = self.conn.cursor()
+        changed = 0
+        for record in records:
+            aliases = carrier_aliases(record)
+            if not aliases:
+                continue
+            key = next(
+                (self.aliases[alias] for alias in aliases if alias in self.aliases),
+                aliases[0],
+            )
+            current = self.carriers.get(key)
+            if current is not None and current["updated_at"] >= record["updated_at"]:
+                continue
+            record = dict(record, source=source)
+            self.carriers[key] = record
+            for alias in aliases:
+                self.aliases[alias] = key
+            cur.execute(
+                "insert or replace into squadron_carriers values (?,?,?,?)",
+                (key, source, record["updated_at"], json.dumps(record)),
+            )
+            self.changed.add(key)
+            changed += 1
+        if changed:
+            self.version += 1
+        return changed
+
+    def source_name(self, source) -> str:
+        """
+        :param source: an instance ID
+        :return: a readable name for the instance
+        """
+        if source == self.instance_id:
+            return "This EDFT"
+        return self.sources.get(source, {}).get("name") or source[:8]
+
+    def drain_changes(self) -> set:
+        """
+        Returns the keys of the carriers that changed since the last call, and forgets them.
+        :return: set of carrier keys
+        """
+        changed, self.changed = self.changed, set()
+        return changed
@@ -0,0 +1,325 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from edft_shared_constants import LADDER, LOCAL_DB_PATH, TONNAGE_FIELDS
+
+STATE_FILE_PATH = os.path.join(LOCAL_DB_PATH, "fleet_state.bin")
+STATE_FILE_MAGIC = b"EDFTSTAT"
+STATE_FILE_LAYOUT = 2
+STATE_FILE_CAPACITY = 1024
+STATE_FILE_INTERVAL = 0.25
+STATE_FILE_READ_RETRIES = 1000
+
+"""
+Header, at offset 0: magic, layout version, record size, capacity (number of record slots), record count (slots in
+use are all below this), generation (bumped after every batch of record updates), writer process ID, live flag (1 while
+EDFT is running and keeping the file up to date).
+"""
+HEADER = struct.Struct("<8sHHIIQIB31x")
+
+"""
+Each record starts with its sequence number, an unsigned 64-bit integer. The writer makes it odd before changing the
+record and even again afterwards, so a reader that sees the same even number before and after reading the body has a
+consistent copy.
+"""
+SEQUENCE = struct.Struct("<Q")
+
+"""
+Record body, directly after the sequence number: in-use flag, auth state (see AUTH_STATES), ladder step (16 for N16
+down to 0 for N0; NOT_ON_LADDER when not on the ladder), fuel, carrier balance, tonnage, account data version, last
+fetched (epoch seconds), then callsign, current system and account nickname as NUL-padded UTF-8.
+"""
+RECORD_BODY = struct.Struct("<BBBxIqIId16s64s32s8x")
+RECORD_SIZE = SEQUENCE.size + RECORD_BODY.size
+NOT_ON_LADDER = 0xFF
+
+AUTH_AUTHORIZED = 0
+AUTH_REAUTH_REQUIRED = 1
+AUTH_ONBOARDING = 2
+AUTH_STATES = {
+    AUTH_AUTHORIZED: "authorized",
+    AUTH_REAUTH_REQUIRED: "reauth_required",
+    AUTH_ONBOARDING: "onboarding",
+}
+
+
+def encode_text(text, size) -> bytes:
+    """
+    Encodes a string for a fixed-width field, cutting it short on a character boundary if it doesn't fit.
+    :param text: the string, or None
+    :param size: the field width, in bytes
+    :return: the encoded bytes, at most size long
+    """
+    return (text or "").encode("utf8")[:size].decode("utf8", "ignore").encode("utf8")
+
+
+def decode_text(raw) -> str:
+    return raw.rstrip(b"\0").decode("utf8", "replace")
+
+
+def carrier_fields(snapshot) -> tuple:
+    """
+    Flattens an account snapshot into the values of a record body.
+    :param snapshot: an AccountSnapshot
+    :return: tuple to pack with RECORD_BODY
+    """
+    if snapshot.onboarding is not None:
+        auth = AUTH_ONBOARDING
+    elif snapshot.reauth_required:
+        auth = AUTH_REAUTH_REQUIRED
+    else:
+        auth = AUTH_AUTHORIZED
+    fc_data = snapshot.fc_data or {}
+    system = fc_data.get("currentStarSystem")
+    try:
+        tonnage = sum(fc_data["capacity"][field] for field in TONNAGE_FIELDS)
+    except (KeyError, TypeError):
+        tonnage = 0
+    return (
+        1,
+        auth,
+        int(LADDER[system][1:]) if system in LADDER else NOT_ON_LADDER,
+        int(fc_data.get("fuel") or 0),
+        int(fc_data.get("balance") or 0),
+        tonnage,
+        snapshot.version & 0xFFFFFFFF,
+        snapshot.last_fetched or 0.0,
+        encode_text(fc_data.get("name", {}).get("callsign"), 16),
+        encode_text(system, 64),
+        encode_text(snapshot.name, 32),
+    )
+
+
+class FleetStateFile:
+    """
+    Keeps a memory-mapped file with one fixed-width binary record per account, for overlays, stream widgets and scripts
+    that want live carrier status without talking to the database or parsing JSON. A background thread compares each
+    account's snapshot version with the one last written and rewrites only the records that changed, in place.
+
+    There is exactly one writer, so records are protected seqlock-style rather than with a lock readers would have to
+    take: see SEQUENCE. Readers map the file read-only and unpack fields straight out of the mapping; FleetStateReader
+    shows how. An account keeps its slot for as long as it exists; a deleted account's slot is marked unused and may be
+    reused. Accounts beyond STATE_FILE_CAPACITY are left out.
+    """
+
+    instance = None
+    log_handler = None
+    path = None
+    mm = None
+    thread = None
+    generation = 0
+    count = 0
+    overflow_logged = False
+
+    def __init__(self, instance, log_handler, path=STATE_FILE_PATH):
+        self.instance = instance
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.stop_event = threading.Event()
+        self.slots = {}
+        self.free_slots = []
+        self.written_versions = {}
+
+    def start(self) -> bool:
+        """
+        Creates (or resets) the state file, maps it, and starts keeping it up to date on a daemon thread.
+        :return: True if the file is being kept, False if it could not be created or mapped.
+        """
+        size = HEADER.size + RECORD_SIZE * STATE_FILE_CAPACITY
+        try:
+            # Reset in place rather than replace, so readers that already have the file mapped keep working
+            with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as f:
+                if os.fstat(f.fileno()).st_size != size:
+                    f.truncate(size)
+                self.mm = mmap.mmap(f.fileno(), size)
+        except (OSError, ValueError):
+            self.logger.exception("could not create fleet state file %s", self.path)
+            return False
+        self.mm[HEADER.size :] = bytes(size - HEADER.size)
+        self.write_header(live=True)
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._run, name="edft-state-file", daemon=True
+        )
+        self.thread.start()
+        self.logger.info("keeping fleet state file %s", self.path)
+        return True
+
+    def stop(self) -> None:
+        """
+        Stops updating the file and clears its live flag. The records are left as they were, showing the last known
+        state.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.mm is not None:
+            self.write_header(live=False)
+            self.mm.close()
+            self.mm = None
+
+    def write_header(self, live) -> None:
+        HEADER.pack_into(
+            self.mm,
+            0,
+            STATE_FILE_MAGIC,
+            STATE_FILE_LAYOUT,
+            RECORD_SIZE,
+            STATE_FILE_CAPACITY,
+            self.count,
+            self.generation,
+            os.getpid(),
+            1 if live else 0,
+        )
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(STATE_FILE_INTERVAL):
+            try:
+                self.sync(list(self.instance.account_table))
+            except Exception:
+                self.logger.exception("could not update fleet state file")
+
+    def sync(self, accounts) -> int:
+        """
+        Brings the records in line with the account table, rewriting only those whose account changed.
+        :param accounts: the account table
+        :return: the number of records written
+        """
+        written = 0
+        names = set()
+        for account in accounts:
+            names.add(account.name)
+            snapshot = account.snapshot
+            if self.written_versions.get(account.name) == snapshot.version:
+                continue
+            slot = self.slot_for(account.name)
+            if slot is None:
+                continue
+            self.write_record(slot, RECORD_BODY.pack(*carrier_fields(snapshot)))
+            self.written_versions[account.name] = snapshot.version
+            written += 1
+        for name in self.slots.keys() - names:
+            slot = self.slots.pop(name)
+            self.written_versions.pop(name, None)
+            self.write_record(slot, bytes(RECORD_BODY.size))
+            self.free_slots.append(slot)
+            written += 1
+        if written:
+            self.generation += 1
+            self.write_header(live=True)
+        return written
+
+    def slot_for(self, name) -> int:
+        """
+        :param name: an account name
+        :return: the account's record slot, assigning one if it has none, or None if the file is full
+        """
+        if name in self.slots:
+            return self.slots[name]
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        elif self.count < STATE_FILE_CAPACITY:
+            slot = self.count
+            self.count += 1
+        else:
+            if not self.overflow_logged:
+                self.logger.warning(
+                    "more than %s accounts, the rest are left out of the fleet state file",
+                    STATE_FILE_CAPACITY,
+                )
+                self.overflow_logged = True
+            return None
+        self.slots[name] = slot
+        return slot
+
+    def write_record(self, slot, body) -> None:
+        """
+        Overwrites one record's body, bracketed by the two sequence number updates readers check.
+        :param slot: the record slot
+        :param body: the packed record body
+        """
+        offset = HEADER.size + slot * RECORD_SIZE
+        sequence = SEQUENCE.unpack_from(self.mm, offset)[0]
+        SEQUENCE.pack_into(self.mm, offset, sequence + 1)
+        self.mm[offset + SEQUENCE.size : offset + RECORD_SIZE] = body
+        SEQUENCE.pack_into(self.mm, offset, sequence + 2)
+
+
+class FleetStateReader:
+    """
+    Reads the fleet state file from another thread or process. Meant as a reference for external readers as much as
+    for use from Python: map the file, check the header, then read each record with the seqlock protocol. Needs nothing
+    beyond the standard library and edft_shared_constants, so scripts can use it without the GUI's dependencies.
+    """
+
+    mm = None
+
+    def __init__(self, path=STATE_FILE_PATH):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, layout, record_size = HEADER.unpack_from(self.mm, 0)[:3]
+        if magic != STATE_FILE_MAGIC or layout != STATE_FILE_LAYOUT:
+            self.mm.close()
+            raise ValueError(path + " is not a supported EDFT fleet state file")
+
+    def header(self) -> dict:
+        _, _, _, capacity, count, generation, pid, live = HEADER.unpack_from(self.mm, 0)
+        return {
+            "capacity": capacity,
+            "count": count,
+            "generation": generation,
+            "pid": pid,
+            "live": bool(live),
+        }
+
+    def read_record(self, slot) -> dict:
+        """
+        Reads a consistent copy of one record, retrying while the writer is in the middle of changing it.
+        :param slot: the record slot
+        :return: the record's fields, or None if the slot is unused
+        :raise TimeoutError: if no consistent copy could be read in STATE_FILE_READ_RETRIES attempts
+        """
+        offset = HEADER.size + slot * RECORD_SIZE
+        for _ in range(STATE_FILE_READ_RETRIES):
+            before = SEQUENCE.unpack_from(self.mm, offset)[0]
+            if not before & 1:
+                body = RECORD_BODY.unpack_from(self.mm, offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(self.mm, offset)[0] == before:
+                    break
+            # Give the writer a chance to finish before trying again
+            time.sleep(0)
+        else:
+            raise TimeoutError("record " + str(slot) + " kept changing")
+        used, auth, ladder, fuel, balance, tonnage, version, fetched = body[:8]
+        if not used:
+            return None
+        return {
+            "sequence": before,
+            "auth": AUTH_STATES.get(auth),
+            "ladder_step": None if ladder == NOT_ON_LADDER else ladder,
+            "fuel": fuel,
+            "balance": balance,
+            "tonnage": tonnage,
+            "version": version,
+            "last_fetched": fetched or None,
+            "callsign": decode_text(body[8]),
+            "system": decode_text(body[9]),
+            "nickname": decode_text(body[10]),
+        }
+
+    def records(self) -> list:
+        """
+        :return: every record in use
+        """
+        records = (self.read_record(slot) for slot in range(self.header()["count"]))
+        return [record for record in records if record is not None]
+
+    def close(self) -> None:
+        self.mm.close()
@@ -0,0 +1,281 @@
+import base64
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+import requests
+from edft_shared_constants import (
+    CAPI_RECORD_DIR,
+    CAPI_REPLAY_DIR,
+    CAPI_REPLAY_SPEED,
+)
+
+RECORDING_PATTERN = "capi-*.jsonl.gz"
+SCRUBBED = b"scrubbed"
+TOKEN_FIELDS = ("access_token", "refresh_token")
+REPLAY_MISSING_STATUS = 503
+
+
+class TransportResponse(NamedTuple):
+    """
+    The parts of a requests.Response that EDFT uses, which is all a replayed response has.
+    """
+
+    status_code: int
+    content: bytes
+
+
+class LiveTransport:
+    """
+    Sends cAPI requests to Frontier. Every cAPI request EDFT makes, in the GUI process and in collector workers, goes
+    through the transport returned by create_transport(), so it can be swapped for one that records or replays them.
+    """
+
+    def request(self, account, method, host, endpoint, headers, data=None) -> object:
+        """
+        :param account: name of the account the request is made for
+        :param method: "GET" or "POST"
+        :param host: API_DATA_HOST or API_AUTH_HOST
+        :param endpoint: the endpoint, e.g. API_CMDR_ENDPOINT
+        :param headers: the request headers
+        :param data: the request body, if any
+        :return: the response; anything with status_code and content
+        """
+        return requests.request(method, host + endpoint, headers=headers, data=data)
+
+    def pace(self, seconds) -> None:
+        """
+        Waits between successive queries (see API_QUERY_INTERVAL).
+        :param seconds: how long a live session waits
+        """
+        time.sleep(seconds)
+
+    def close(self) -> None:
+        """
+        Finishes writing anything the transport has buffered. Called at exit.
+        """
+
+
+class RecordingTransport(LiveTransport):
+    """
+    Sends requests to Frontier like LiveTransport, and also appends every exchange to a gzipped JSON lines file in the
+    recording directory, one file per process (collector workers record their own share). Tokens are scrubbed: request
+    headers and bodies are not recorded at all, token values in token endpoint responses are replaced, and any token
+    the request carried is blanked out of the response too. Each line is flushed as it is written, so a recording cut
+    short by a crash is still readable up to the last exchange.
+    """
+
+    directory = None
+    file = None
+    pid = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def request(self, account, method, host, endpoint, headers, data=None) -> object:
+        started = time.time()
+        response = super().request(account, method, host, endpoint, headers, data)
+        content = scrub(response.content, request_secrets(headers, data))
+        if content is None:
+            encoding, body = "base64", base64.b64encode(response.content).decode()
+        else:
+            encoding, body = "utf8", content
+        entry = {
+            "t": started,
+            "elapsed": time.time() - started,
+            "account": account,
+            "method": method,
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "encoding": encoding,
+            "body": body,
+        }
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self.lock:
+            if self.pid != os.getpid():
+                os.makedirs(self.directory, exist_ok=True)
+                self.pid = os.getpid()
+                self.file = gzip.open(
+                    os.path.join(
+                        self.directory,
+                        "capi-{0}-{1}.jsonl.gz".format(int(started), self.pid),
+                    ),
+                    "wt",
+                    encoding="utf8",
+                )
+            self.file.write(line)
+            self.file.flush()
+        return response
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.pid = None
+
+
+class ReplayTransport:
+    """
+    Answers cAPI requests from a recording instead of Frontier. Each account's requests to each endpoint get that
+    account's recorded responses to it, in order, so the real Account code runs through exactly the session that was
+    recorded. At speed 1 a response is held back until the point in the replay at which it was recorded; higher speeds
+    compress the recording's timeline, and "max" serves everything as fast as the pipeline asks for it. A request with
+    nothing left to replay gets a REPLAY_MISSING_STATUS response.
+    """
+
+    speed = None
+    started = None
+    recording_start = 0
+    total = 0
+    served = 0
+
+    def __init__(self, directory, speed="max"):
+        self.speed = None if str(speed) == "max" else float(speed)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.queues = defaultdict(deque)
+        entries = load_recording(directory)
+        for entry in entries:
+            self.queues[(entry["account"], entry["endpoint"])].append(entry)
+        self.total = len(entries)
+        self.accounts = sorted({entry["account"] for entry in entries})
+        if entries:
+            self.recording_start = entries[0]["t"]
+        else:
+            self.finished.set()
+
+    def request(self, account, method, host, endpoint, headers, data=None) -> object:
+        with self.lock:
+            if self.started is None:
+                self.started = time.time()
+            queue = self.queues.get((account, endpoint))
+            entry = queue.popleft() if queue else None
+            if entry is not None:
+                self.served += 1
+                if self.served == self.total:
+                    self.finished.set()
+        if entry is None:
+            return TransportResponse(REPLAY_MISSING_STATUS, b"{}")
+        if self.speed is not None:
+            due = self.started + (entry["t"] - self.recording_start) / self.speed
+            time.sleep(max(0.0, due - time.time()) + entry["elapsed"] / self.speed)
+        if entry["encoding"] == "base64":
+            content = base64.b64decode(entry["body"])
+        else:
+            content = entry["body"].encode("utf8")
+        return TransportResponse(entry["status"], content)
+
+    def pace(self, seconds) -> None:
+        # The recorded timestamps already include the waits between queries, so replaying them reproduces the pacing
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def discard_next(self) -> None:
+        """
+        Drops the earliest exchange not yet replayed, e.g. one the pipeline never asks for.
+        """
+        with self.lock:
+            queues = [queue for queue in self.queues.values() if queue]
+            if queues:
+                min(queues, key=lambda queue: queue[0]["t"]).popleft()
+                self.served += 1
+                if self.served == self.total:
+                    self.finished.set()
+
+    def next_account(self) -> str:
+        """
+        :return: the account whose next recorded request is the earliest, or None once everything has been replayed
+        """
+        with self.lock:
+            heads = [queue[0] for queue in self.queues.values() if queue]
+        if not heads:
+            return None
+        return min(heads, key=lambda entry: entry["t"])["account"]
+
+
+def request_secrets(headers, data) -> list:
+    """
+    Picks the tokens and codes out of a request, so they can be blanked out of anything recorded.
+    :param headers: the request headers
+    :param data: the form-encoded request body, if any
+    :return: list of secret byte strings
+    """
+    secrets = []
+    authorization = (headers or {}).get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        secrets.append(authorization[len("Bearer ") :].encode("utf8"))
+    for pair in (data or "").split("&"):
+        key, _, value = pair.partition("=")
+        if key in ("code", "code_verifier", "refresh_token") and value:
+            secrets.append(value.encode("utf8"))
+    return [secret for secret in secrets if secret]
+
+
+def scrub(content, secrets) -> str:
+    """
+    Removes tokens from a response body: token fields of a JSON object are replaced, and any of the request's secrets
+    appearing anywhere else are blanked.
+    :param content: the raw response body
+    :param secrets: list of secret byte strings, see request_secrets()
+    :return: the scrubbed body as text, or None if it isn't UTF-8 (binary bodies are recorded as they are)
+    """
+    for secret in secrets:
+        content = content.replace(secret, SCRUBBED)
+    try:
+        text = content.decode("utf8")
+    except UnicodeDecodeError:
+        return None
+    try:
+        document = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(document, dict) and any(field in document for field in TOKEN_FIELDS):
+        for field in TOKEN_FIELDS:
+            if field in document:
+                document[field] = "scrubbed-" + field.replace("_", "-")
+        return json.dumps(document)
+    return text
+
+
+def load_recording(directory) -> list:
+    """
+    Reads every recording file in a directory. A file cut short (e.g. by a crash) is read up to where it ends.
+    :param directory: the recording directory
+    :return: list of exchanges, in the order they were recorded
+    """
+    entries = []
+    for path in sorted(glob.glob(os.path.join(directory, RECORDING_PATTERN))):
+        with gzip.open(path, "rt", encoding="utf8") as f:
+            try:
+                for line in f:
+                    if line.endswith("\n"):
+                        entries.append(json.loads(line))
+            except EOFError:
+                pass
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
+
+
+def create_transport() -> object:
+    """
+    Builds the transport selected by the environment: EDFT_CAPI_REPLAY (replay from that directory, at
+    EDFT_CAPI_REPLAY_SPEED), EDFT_CAPI_RECORD (record to that directory), or neither (live).
+    """
+    if CAPI_REPLAY_DIR:
+        return ReplayTransport(CAPI_REPLAY_DIR, CAPI_REPLAY_SPEED)
+    if CAPI_RECORD_DIR:
+        return RecordingTransport(CAPI_RECORD_DIR)
+    return LiveTransport()
+
+
+""" The transport every cAPI request goes through. Look it up as edft_transport.TRANSPORT at the time of the request,
+so a replay driver can swap it out (see replay.py). """
+TRANSPORT = create_transport()
@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+from edft_shared_constants import LOCAL_DB_PATH
+
+VIEWS_CONFIG_PATH = os.path.join(LOCAL_DB_PATH, "views.json")
+MISSING_TEXT = "-"
+
+"""
+Default views, written to VIEWS_CONFIG_PATH on first start so they can be edited. Each view is a tab with "name", the
+"columns" it shows, optional "filters" that every row must pass, and an optional "sort" order (first entry first).
+Columns are named by group and display name as in the Main tab, e.g. "fleet_carrier.Balance"; the groups are
+"account", "commander" and "fleet_carrier". A filter compares a column with "value" using "op", one of =, !=, <, <=, >,
+>= and contains; columns whose text is a number (thousands separators allowed) compare and sort as numbers.
+"""
+DEFAULT_VIEWS = [
+    {
+        "name": "Trade",
+        "columns": [
+            "account.Nickname",
+            "fleet_carrier.Callsign",
+            "fleet_carrier.Name",
+            "fleet_carrier.System",
+            "fleet_carrier.Tonnage",
+            "fleet_carrier.Ghost Sells",
+        ],
+        "filters": [],
+        "sort": [{"column": "fleet_carrier.Tonnage", "descending": True}],
+    },
+    {
+        "name": "Logistics",
+        "columns": [
+            "account.Nickname",
+            "account.Age",
+            "fleet_carrier.Callsign",
+            "fleet_carrier.System",
+            "fleet_carrier.N#",
+            "fleet_carrier.Fuel",
+            "commander.System",
+        ],
+        "filters": [],
+        "sort": [{"column": "fleet_carrier.Fuel", "descending": False}],
+    },
+    {
+        "name": "Finance",
+        "columns": [
+            "account.Nickname",
+            "commander.Name",
+            "commander.Balance",
+            "fleet_carrier.Callsign",
+            "fleet_carrier.Balance",
+        ],
+        "filters": [],
+        "sort": [{"column": "fleet_carrier.Balance", "descending": False}],
+    },
+]
+
+FILTER_OPS = ("=", "!=", "<", "<=", ">", ">=", "contains")
+
+
+def load_views(path=VIEWS_CONFIG_PATH) -> list:
+    """
+    Reads the view definitions. Writes the defaults out if the file does not exist yet.
+    :param path: the JSON configuration file
+    :return: list of view definition dicts, see DEFAULT_VIEWS
+    """
+    if not os.path.isfile(path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(DEFAULT_VIEWS, f, indent=4)
+        return json.loads(json.dumps(DEFAULT_VIEWS))
+    with open(path, encoding="utf8") as f:
+        views = json.load(f)
+    if not isinstance(views, list):
+        raise ValueError(path + " must contain a list of views")
+    return views
+
+
+def number_value(text) -> float:
+    """
+    :return: the number a label shows, or None if it isn't one
+    """
+    try:
+        return float(str(text).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def sort_key(text) -> tuple:
+    """
+    Orders numbers before text and missing values last, so a column mixing them still sorts sensibly.
+    """
+    if text is None or text == MISSING_TEXT:
+        return 2, 0, ""
+    number = number_value(text)
+    if number is not None:
+        return 0, number, ""
+    return 1, 0, str(text).lower()
+
+
+def matches(text, op, value) -> bool:
+    """
+    Applies one filter to a label.
+    :param text: the label text
+    :param op: one of FILTER_OPS
+    :param value: what to compare with
+    :return: True if the row passes
+    """
+    if op == "contains":
+        return str(value).lower() in str(text).lower()
+    number = number_value(text)
+    if isinstance(value, (int, float)) and number is not None:
+        left, right = number, value
+    else:
+        left, right = str(text), str(value)
+    match op:
+        case "=":
+            return left == right
+        case "!=":
+            return left != right
+        case "<" if isinstance(left, float):
+            return left < right
+        case "<=" if isinstance(left, float):
+            return left <= right
+        case ">" if isinstance(left, float):
+            return left > right
+        case ">=" if isinstance(left, float):
+            return left >= right
+    return False
+
+
+class ViewCache:
+    """
+    Label text computed for any view (or the Main tab), shared by all of them so each value is computed once however
+    many tabs show it. A commander or fleet carrier column's text depends only on the document it reads, and documents
+    are never modified in place, so an entry stays valid for as long as the account's document is the same object.
+    Account columns (age, auth state) change with time rather than with the documents, so they are never cached.
+
+    Only used from the GUI thread, so there is no locking.
+    """
+
+    log_handler = None
+    hits = 0
+    misses = 0
+
+    def __init__(self, generate, document, log_handler):
+        """
+        :param generate: function (column, account, snapshot) -> label text
+        :param document: function (column, snapshot) -> the document the column's text is computed from, or None if
+        the column can't be cached
+        """
+        self.generate = generate
+        self.document = document
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        self.log_handler = log_handler
+        self.logger.addHandler(log_handler)
+        self.entries = {}
+
+    def text(self, account, snapshot, key, column) -> str:
+        """
+        :param account: the account
+        :param snapshot: the AccountSnapshot to compute from
+        :param key: the column's name, see EliteDangerousFleetTracker.column_key()
+        :param column: the column spec
+        :return: the label text, or MISSING_TEXT if the account's data doesn't have it
+        """
+        document = self.document(column, snapshot)
+        if document is None:
+            return self._compute(account, snapshot, key, column)
+        entry = self.entries.get((account.name, key))
+        if entry is not None and entry[0] is document:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        text = self._compute(account, snapshot, key, column)
+        self.entries[(account.name, key)] = (document, text)
+        return text
+
+    def _compute(self, account, snapshot, key, column) -> str:
+        try:
+            text = self.generate(column, account, snapshot)
+            return MISSING_TEXT if text is None else text
+        except (AttributeError, KeyError, TypeError, ValueError):
+            self.logger.debug("could not compute %s for %s", key, account.name)
+            return MISSING_TEXT
+
+    def retain(self, names) -> None:
+        """
+        Drops the entries of accounts that no longer exist.
+        :param names: the names of the accounts that do
+        """
+        self.entries = {
+            key: entry for key, entry in self.entries.items() if key[0] in names
+        }
+
+
+class TableView:
+    """
+    One user-defined view: a subset of the table columns, filtered and sorted. Evaluating it computes only the columns
+    it filters on, sorts by or shows, and the shown ones only for rows that pass the filters.
+    """
+
+    name = None
+
+    def __init__(self, definition, columns):
+        """
+        :param definition: the view definition, see DEFAULT_VIEWS
+        :param columns: dict of column name -> column spec, for every column that can be shown
+        :raise ValueError: if the definition is incomplete or names a column or filter operator that doesn't exist
+        """
+        try:
+            self.name = str(definition["name"])
+            self.columns = [(key, columns[key]) for key in definition["columns"]]
+            self.filters = [
+                (item["column"], columns[item["column"]], item["op"], item["value"])
+                for item in definition.get("filters", [])
+            ]
+            self.sort = [
+                (item["column"], columns[item["column"]], item.get("descending", False))
+                for item in definition.get("sort", [])
+            ]
+        except (KeyError, TypeError) as e:
+            raise ValueError("invalid view definition: " + repr(e)) from e
+        for _, _, op, _ in self.filters:
+            if op not in FILTER_OPS:
+                raise ValueError(
+                    "unknown filter operator in view " + self.name + ": " + op
+                )
+
+    def headings(self) -> list:
+        """
+        :return: the display names of the view's columns, in order, with the group added to any that appear twice
+        (e.g. "Balance (commander)" and "Balance (fleet carrier)")
+        """
+        names = [column["display_name"] for _, column in self.columns]
+        return [
+            (
+                name + " (" + key.split(".", 1)[0].replace("_", " ") + ")"
+                if names.count(name) > 1
+                else name
+            )
+            for name, (key, _) in zip(names, self.columns)
+        ]
+
+    def evaluate(self, accounts, cache) -> list:
+        """
+        Computes the view's rows.
+        :param accounts: the account table
+        :param cache: the shared ViewCache
+        :return: list of (account name, list of label texts), filtered and in display order
+        """
+        rows = []
+        for account in accounts:
+            snapshot = account.snapshot
+            if not all(
+                matches(cache.text(account, snapshot, key, column), op, value)
+                for key, column, op, value in self.filters
+            ):
+                continue
+            keys = [
+                sort_key(cache.text(account, snapshot, key, column))
+                for key, column, _ in self.sort
+            ]
+            values = [
+                cache.text(account, snapshot, key, column)
+                for key, column in self.columns
+            ]
+            rows.append((keys, account.name, values))
+        # Stable sorts, last key first, so each key can have its own direction; missing values stay last either way
+        for i in reversed(range(len(self.sort))):
+            rows.sort(key=lambda row: row[0][i], reverse=self.sort[i][2])
+            rows.sort(key=lambda row: row[0][i][0] == 2)
+        return [(name, values) for _, name, values in rows]
@@ -0,0 +1,207 @@
+import json
+import multiprocessing
+import time
+from cryptography.fernet import Fernet
+from edft_secrets import CLIENT_ID, FERNET_KEY
+from edft_archive import compress_payload, payload_digest
+from edft_shared_constants import API_QUERY_INTERVAL
+import edft_transport
+from Account import (
+    API_AUTH_HOST,
+    API_CMDR_ENDPOINT,
+    API_DATA_HOST,
+    API_FC_ENDPOINT,
+    API_TOKEN_ENDPOINT,
+)
+
+
+def project(data, paths) -> dict:
+    """
+    Copies only the parts of a cAPI document the coordinator actually uses. Each path is a tuple of keys, as in a
+    column spec; the whole subtree under the last key is kept.
+    :param data: the parsed cAPI document
+    :param paths: iterable of key tuples
+    :return: a nested dict containing just those paths
+    """
+    projection = {}
+    for path in paths:
+        source = data
+        found = True
+        for key in path:
+            if not isinstance(source, dict) or key not in source:
+                found = False
+                break
+            source = source[key]
+        if not found:
+            continue
+        target = projection
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = source
+    return projection
+
+
+def fetch_endpoint(job, endpoint, result) -> bool:
+    """
+    Queries one cAPI data endpoint for one account, recording the outcome in the job's result.
+    :param job: the account's collection job, as built by Account.collection_job()
+    :param endpoint: API_CMDR_ENDPOINT or API_FC_ENDPOINT
+    :param result: the result dict being built for this account
+    :return: True if the request succeeded
+    """
+    start = time.perf_counter()
+    req = edft_transport.TRANSPORT.request(
+        job["name"],
+        "GET",
+        API_DATA_HOST,
+        endpoint,
+        headers={"Authorization": "Bearer " + result["access_token"]},
+    )
+    result["requests"].append(
+        (endpoint, req.status_code, time.perf_counter() - start, len(req.content))
+    )
+    if req.status_code != 200:
+        return False
+    result["fetched_at"] = time.time()
+    digest = payload_digest(req.content)
+    if digest == job["digests"].get(endpoint):
+        return True
+    start = time.perf_counter()
+    json_data = json.loads(req.content)
+    result["payloads"][endpoint] = {
+        "fetched_at": result["fetched_at"],
+        "digest": digest,
+        "projection": project(json_data, job["projection_paths"][endpoint]),
+        "compressed": compress_payload(req.content),
+        "raw_size": len(req.content),
+    }
+    result["parse_seconds"] += time.perf_counter() - start
+    return True
+
+
+def refresh_tokens(result, cipher) -> None:
+    """
+    Exchanges the account's refresh token for a new token pair, mirroring Account.obtain_tokens(REFRESH). New tokens
+    are returned already encrypted for storage, so the coordinator never has to run Fernet for them.
+    :param result: the result dict being built for this account
+    :param cipher: a Fernet instance
+    """
+    start = time.perf_counter()
+    req = edft_transport.TRANSPORT.request(
+        result["name"],
+        "POST",
+        API_AUTH_HOST,
+        API_TOKEN_ENDPOINT,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=refresh_token"
+        "&client_id={0}"
+        "&refresh_token={1}".format(CLIENT_ID, result["refresh_token"]),
+    )
+    result["requests"].append(
+        (
+            API_TOKEN_ENDPOINT,
+            req.status_code,
+            time.perf_counter() - start,
+            len(req.content),
+        )
+    )
+    if req.status_code == 200:
+        json_data = json.loads(req.content)
+        result["access_token"] = json_data["access_token"]
+        result["refresh_token"] = json_data["refresh_token"]
+        result["token_ciphertext"] = (
+            cipher.encrypt(result["access_token"].encode("utf8")),
+            cipher.encrypt(result["refresh_token"].encode("utf8")),
+        )
+    else:
+        result["reauth_required"] = True
+
+
+def collect_shard(shard) -> list:
+    """
+    Worker process entry point. Fetches and parses every account in the shard in turn, enforcing API_QUERY_INTERVAL
+    between successive queries just like Account.update_from_capi(), and returns only compact results.
+    :param shard: list of collection jobs
+    :return: list of result dicts, one per job, to be applied with Account.apply_collected()
+    """
+    cipher = Fernet(FERNET_KEY)
+    results = []
+    for job in shard:
+        result = {
+            "name": job["name"],
+            "access_token": job["access_token"],
+            "refresh_token": job["refresh_token"],
+            "token_ciphertext": None,
+            "reauth_required": False,
+            "fetched_at": None,
+            "payloads": {},
+            "requests": [],
+            "parse_seconds": 0.0,
+        }
+        try:
+            for endpoint in (API_CMDR_ENDPOINT, API_FC_ENDPOINT):
+                if not fetch_endpoint(job, endpoint, result):
+                    refresh_tokens(result, cipher)
+                edft_transport.TRANSPORT.pace(API_QUERY_INTERVAL / 1000)
+                if result["reauth_required"]:
+                    break
+        except Exception as e:
+            # Workers have no log handler; report the failure for the coordinator to log
+            result["error"] = repr(e)
+        results.append(result)
+    return results
+
+
+class CollectorPool:
+    """
+    Spreads cAPI collection across a pool of worker processes. The account table is partitioned into one shard per
+    worker; each worker fetches, parses, projects and compresses its shard, so the CPU-bound work happens outside the
+    GUI process and only the projected fields and compressed raw payloads come back.
+    """
+
+    processes = 0
+    pool = None
+
+    def __init__(self, processes):
+        self.processes = processes
+
+    def start(self) -> None:
+        """
+        Starts the worker processes.
+        """
+        self.pool = multiprocessing.Pool(self.processes)
+
+    def stop(self) -> None:
+        """
+        Stops the worker processes without waiting for in-flight shards.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def collect(self, accounts, projection_paths, exitapp) -> None:
+        """
+        Collects fresh data for the given accounts and applies the results as each shard completes.
+        :param accounts: the Account objects to update
+        :param projection_paths: dict of endpoint -> key tuples to keep, see
+        EliteDangerousFleetTracker.projection_paths()
+        :param exitapp: the shared exit flag; stops waiting for (and applying) results once it is set
+        """
+        if not accounts:
+            return
+        by_name = {account.name: account for account in accounts}
+        shards = [[] for _ in range(min(self.processes, len(accounts)))]
+        for idx, account in enumerate(accounts):
+            shards[idx % len(shards)].append(account.collection_job(projection_paths))
+        pending = self.pool.imap_unordered(collect_shard, shards)
+        remaining = len(shards)
+        while remaining and not exitapp[0]:
+            try:
+                # Wake up every second so a quit doesn't have to wait for the slowest shard
+                results = pending.next(timeout=1)
+            except multiprocessing.TimeoutError:
+                continue
+            remaining -= 1
+            for result in results:
+                by_name[result["name"]].apply_collected(result)
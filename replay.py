@@ -0,0 +1,169 @@
+"""
+Replays a recorded cAPI session through the real pipeline, without a GUI and without talking to Frontier: Account
+queries and token handling, payload archive and database writes, the change feed and alert engine, carrier history, and
+label generation for every column. Record a session by running EDFT with EDFT_CAPI_RECORD set to a directory; tokens
+are scrubbed from the recording, so it can be shared and replayed on any machine.
+
+Usage:
+    python replay.py RECORDING_DIR                 replay as fast as possible and report throughput
+    python replay.py RECORDING_DIR --speed 1       replay in real time, as the session was recorded
+    python replay.py RECORDING_DIR --expect DIGEST exit with status 1 unless the final fleet state matches DIGEST
+
+Accounts are created from the names in the recording, already authorized, in a throwaway database (or --db). The run
+ends with a digest of the resulting fleet state (leaving out fetch times, which depend on when the replay ran), which is
+the same on every replay of the same recording; use it with --expect as a regression test.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from cryptography.fernet import Fernet
+from edft_secrets import FERNET_KEY
+import edft_transport
+from edft_transport import ReplayTransport
+from EliteDangerousFleetTracker import EliteDangerousFleetTracker
+from edft_db import ThreadLocalConnection
+
+
+def create_accounts(conn, names) -> None:
+    """
+    Creates the accounts table with one authorized account per recorded name. The tokens are placeholders; replayed
+    responses don't check them.
+    """
+    cipher = Fernet(FERNET_KEY)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS accounts(name, state, code, challenge, verifier, access_token, refresh_token,"
+        "reauth_required, reauth_prompted, cmdr_data, fc_data, last_fetched)"
+    )
+    for name in names:
+        conn.execute(
+            "insert into accounts values (?,?,?,?,?,?,?,?,?,?,?,?)",
+            (
+                name,
+                None,
+                None,
+                None,
+                None,
+                cipher.encrypt(b"replay-access-token"),
+                cipher.encrypt(b"replay-refresh-token"),
+                False,
+                False,
+                None,
+                None,
+                0,
+            ),
+        )
+    conn.commit()
+
+
+def tick(tracker, account) -> None:
+    """
+    Does what a GUI tick does after an account has been updated: regenerates its labels, persists it, and records its
+    carrier history.
+    """
+    snapshot = account.snapshot
+    for column in tracker.columns:
+        try:
+            tracker.generate_dynamic_label_text((None, account, column), snapshot)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+    if account.needs_sync:
+        account.sync_to_database()
+    tracker.history.record([account])
+
+
+def state_digest(tracker) -> str:
+    """
+    :return: a digest of the fleet state that depends only on the replayed data
+    """
+    state = tracker.export_fleet_state()
+    for entry in state["accounts"]:
+        del entry["last_fetched"]
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def replay(directory, speed, db_path) -> dict:
+    """
+    Replays a recording.
+    :param directory: the recording directory
+    :param speed: "max", or how many times faster than real time
+    :param db_path: the database to replay into
+    :return: summary of the run
+    """
+    log_handler = logging.NullHandler()
+    transport = ReplayTransport(directory, speed)
+    edft_transport.TRANSPORT = transport
+    conn = ThreadLocalConnection(log_handler, db_path)
+    try:
+        create_accounts(conn, transport.accounts)
+        tracker = EliteDangerousFleetTracker(conn, log_handler)
+        tracker.init_account_table()
+        accounts = {account.name: account for account in tracker.account_table}
+        polls = 0
+        discarded = 0
+        started = time.perf_counter()
+        while not transport.finished.is_set():
+            account = accounts[transport.next_account()]
+            served = transport.served
+            account.update_from_capi()
+            polls += 1
+            if transport.served == served:
+                # The next recorded exchange is one this pipeline doesn't make (e.g. an onboarding token exchange)
+                transport.discard_next()
+                discarded += 1
+            tick(tracker, account)
+        elapsed = time.perf_counter() - started
+        return {
+            "exchanges": transport.total,
+            "discarded": discarded,
+            "accounts": len(accounts),
+            "polls": polls,
+            "seconds": elapsed,
+            "digest": state_digest(tracker),
+        }
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded cAPI session")
+    parser.add_argument("recording", help="directory the session was recorded to")
+    parser.add_argument(
+        "--speed",
+        default="max",
+        help='"max" (default), or how many times faster than real time, e.g. 1',
+    )
+    parser.add_argument(
+        "--db", help="database to replay into; default is a throwaway one"
+    )
+    parser.add_argument("--expect", help="fleet state digest the replay must end with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = replay(
+            args.recording, args.speed, args.db or os.path.join(directory, "replay.db")
+        )
+    print(
+        "replayed {0} exchanges ({1} skipped) for {2} accounts: {3} polls in {4:.2f} s, {5:.1f} polls/s".format(
+            result["exchanges"],
+            result["discarded"],
+            result["accounts"],
+            result["polls"],
+            result["seconds"],
+            result["polls"] / max(result["seconds"], 1e-9),
+        )
+    )
+    print("fleet state digest: " + result["digest"])
+    if args.expect and args.expect != result["digest"]:
+        print("fleet state differs from the expected " + args.expect)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import logging
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from edft_statefile import FleetStateFile, FleetStateReader
+
+Snapshot = namedtuple(
+    "Snapshot",
+    "name version reauth_required last_fetched fc_data onboarding",
+)
+FakeAccount = namedtuple("FakeAccount", "name snapshot")
+
+
+def carrier(name, system):
+    fc_data = {
+        "currentStarSystem": system,
+        "fuel": 500,
+        "balance": 1000000,
+        "capacity": {"cargoNotForSale": 100, "cargoForSale": 250},
+        "name": {"callsign": "ABC-123"},
+    }
+    return FakeAccount(name, Snapshot(name, 1, False, 1700000000.0, fc_data, None))
+
+
+class FleetStateFileTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "fleet_state.bin")
+        self.writer = FleetStateFile(None, logging.NullHandler(), self.path)
+        # Only the mapping is wanted; records are written with sync() rather than by the background thread
+        self.writer.start()
+        self.writer.stop_event.set()
+        self.writer.thread.join()
+        self.addCleanup(self.writer.stop)
+
+    def read(self, *accounts):
+        self.writer.sync(list(accounts))
+        reader = FleetStateReader(self.path)
+        try:
+            return {record["nickname"]: record for record in reader.records()}
+        finally:
+            reader.close()
+
+    def test_ladder_steps(self):
+        records = self.read(
+            carrier("top", "Gali"),
+            carrier("bottom", "HIP 58832"),
+            carrier("elsewhere", "Sol"),
+        )
+        self.assertEqual(records["top"]["ladder_step"], 16)
+        self.assertEqual(records["bottom"]["ladder_step"], 0)
+        self.assertIsNone(records["elsewhere"]["ladder_step"])
+
+    def test_record_fields(self):
+        record = self.read(carrier("cmdr", "HIP 58832"))["cmdr"]
+        self.assertEqual(record["auth"], "authorized")
+        self.assertEqual(record["tonnage"], 350)
+        self.assertEqual(record["callsign"], "ABC-123")
+        self.assertEqual(record["system"], "HIP 58832")
+
+
+if __name__ == "__main__":
+    unittest.main()